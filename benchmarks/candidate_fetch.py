@@ -0,0 +1,147 @@
+"""Память на выборку кандидатов: sqlite3.Row → dict → User против RowMapper.
+
+Запуск из корня репозитория:
+
+    python benchmarks/candidate_fetch.py [--users 5000] [--batch 20] [--rounds 200]
+
+Для каждого способа выбирается пачка кандидатов (как в ленте) ``rounds``
+раз; tracemalloc считает пиковую память на кандидата во время выборки и
+сколько памяти на кандидата остаётся у готовой пачки.
+"""
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.database.migrations import migrate  # noqa: E402
+from src.models import RowMapper, User  # noqa: E402
+
+QUERY = '''
+    SELECT u.*
+    FROM users u
+    WHERE u.is_active = TRUE AND u.id != ?
+    ORDER BY u.created_at DESC
+    LIMIT ?
+'''
+
+
+@dataclass
+class LegacyUser:
+    """Прежний User: обычный dataclass с __dict__ и множеством изменений"""
+    id: int
+    tg_id: int
+    name: str = ''
+    age: int | None = None
+    gender: str = ''
+    photo_file_id: str | None = None
+    goal: str = ''
+    description: str = ''
+    is_active: bool = False
+    version: int = 0
+
+    def __post_init__(self):
+        object.__setattr__(self, '_changed', set())
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            id=data['id'],
+            tg_id=data['tg_id'],
+            name=data['name'],
+            age=data['age'],
+            gender=data['gender'],
+            photo_file_id=data['photo_file_id'],
+            goal=data['goal'],
+            description=data['description'],
+            is_active=bool(data['is_active']),
+            version=data.get('version', 0)
+        )
+
+
+def fetch_via_dict(conn: sqlite3.Connection, batch: int):
+    # Прежний путь: sqlite3.Row → dict в слое БД → User.from_dict в Storage
+    conn.row_factory = sqlite3.Row
+    rows = [dict(row) for row in conn.execute(QUERY, (1, batch)).fetchall()]
+    return [LegacyUser.from_dict(row) for row in rows]
+
+
+def fetch_via_mapper(conn: sqlite3.Connection, batch: int):
+    conn.row_factory = RowMapper(User)
+    return conn.execute(QUERY, (1, batch)).fetchall()
+
+
+def seed(conn: sqlite3.Connection, users: int):
+    migrate(conn)
+    conn.executemany(
+        '''
+        INSERT INTO users (tg_id, name, age, gender, photo_file_id, goal, description, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, TRUE)
+        ''',
+        (
+            (tg_id, f'User{tg_id}', 18 + tg_id % 40, ('Мужской', 'Женский')[tg_id % 2],
+             f'photo{tg_id}', '💼 Деловое', 'Описание анкеты ' * 4)
+            for tg_id in range(1, users + 1)
+        ),
+    )
+    conn.commit()
+
+
+def measure(fetch, conn: sqlite3.Connection, batch: int, rounds: int) -> dict:
+    fetch(conn, batch)  # прогрев кэша запросов sqlite3
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fetch(conn, batch)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peak = 0
+    retained = 0
+    for _ in range(rounds):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        result = fetch(conn, batch)
+        after, round_peak = tracemalloc.get_traced_memory()
+        peak += round_peak - before
+        retained += after - before
+        del result
+    tracemalloc.stop()
+
+    fetched = batch * rounds
+    return {
+        'peak_bytes': peak / fetched,
+        'retained_bytes': retained / fetched,
+        'usec': elapsed / fetched * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(Path(tmp) / 'bench.db')
+        seed(conn, args.users)
+
+        results = {
+            'sqlite3.Row + dict + from_dict': measure(fetch_via_dict, conn, args.batch, args.rounds),
+            'RowMapper(User)': measure(fetch_via_mapper, conn, args.batch, args.rounds),
+        }
+        conn.close()
+
+    print(f'{"способ":<32} {"пик, Б/канд.":>14} {"остаётся, Б/канд.":>19} {"мкс/канд.":>10}')
+    for name, r in results.items():
+        print(f'{name:<32} {r["peak_bytes"]:>14.0f} {r["retained_bytes"]:>19.0f} {r["usec"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
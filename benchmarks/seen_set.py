@@ -0,0 +1,119 @@
+"""Подбор пачки ленты у пользователя с длинной историей: NOT EXISTS против SeenSet.
+
+Запуск из корня репозитория:
+
+    python benchmarks/seen_set.py [--users 30000] [--swipes 12000] [--rounds 200] [--batch 20]
+
+Один пользователь лайкает или пропускает ``swipes`` самых новых анкет
+противоположного пола — ровно те, что подбор ленты просматривает первыми.
+Дальше ``rounds`` раз подбирается пачка из ``batch`` кандидатов тем же
+вызовом, что делает лента без индекса анкет (PROFILE_INDEX=0):
+db.get_candidates с двумя NOT EXISTS и NOT IN по уже выданным анкетам
+и он же с проверкой по множеству в памяти.
+Отдельно замеряется холодная загрузка множества (BLOB + хвост свайпов).
+"""
+import argparse
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.database.sqlite import SQLiteDatabase  # noqa: E402
+from src.seen import SeenStore  # noqa: E402
+
+
+def seed(path: Path, users: int, swipes: int, background: int) -> int:
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        '''
+        INSERT INTO users (tg_id, name, age, gender, goal, description, is_active, created_at)
+        VALUES (?, ?, ?, ?, ?, '', TRUE, datetime(1700000000 + ?, 'unixepoch'))
+        ''',
+        (
+            (tg_id, f'User{tg_id}', 18 + tg_id % 40, ('Мужской', 'Женский')[tg_id % 2],
+             ('💼 Деловое', '👥 Дружеское', '❤️ Романтическое')[tg_id % 3], tg_id)
+            for tg_id in range(1, users + 1)
+        ),
+    )
+    viewer = conn.execute("SELECT id FROM users WHERE gender = 'Мужской' ORDER BY id LIMIT 1").fetchone()[0]
+    targets = [row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE gender = 'Женский' ORDER BY created_at DESC LIMIT ?", (swipes,)
+    )]
+    # Треть — лайки, остальное — пропуски
+    conn.executemany('INSERT INTO likes (from_user_id, to_user_id) VALUES (?, ?)',
+                     ((viewer, target) for target in targets[::3]))
+    conn.executemany('INSERT INTO skips (from_user_id, to_user_id) VALUES (?, ?)',
+                     ((viewer, target) for i, target in enumerate(targets) if i % 3))
+    # Свайпы остальных пользователей: таблицы размером как в живой базе
+    conn.executemany(
+        'INSERT OR IGNORE INTO skips (from_user_id, to_user_id) VALUES (?, ?)',
+        ((2 + i % (users - 1), 1 + (i * 7919) % users) for i in range(background))
+    )
+    conn.commit()
+    conn.close()
+    return viewer
+
+
+async def measure(fn, rounds: int) -> float:
+    await fn()  # прогрев
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'bench.db'
+        db = SQLiteDatabase(path, group_commit=False)
+        viewer = seed(path, args.users, args.swipes, args.background)
+        store = SeenStore(db.load_seen_set, db.store_seen_set)
+
+        start = time.perf_counter()
+        await store.get(viewer)  # первая загрузка заодно пишет BLOB
+        first_load = (time.perf_counter() - start) * 1000
+
+        async def cold_load():
+            store.forget(viewer)
+            await store.get(viewer)
+
+        # Лента исключает анкеты, уже выданные в прошлой пачке
+        exclude = [user.id for user in await db.get_candidates(viewer, args.batch)]
+
+        async def anti_join():
+            return await db.get_candidates(viewer, args.batch, exclude)
+
+        async def seen_set():
+            return await db.get_candidates(viewer, args.batch, exclude, await store.get(viewer))
+
+        assert [u.id for u in await anti_join()] == [u.id for u in await seen_set()]
+
+        results = {
+            'NOT EXISTS (likes, skips)': await measure(anti_join, args.rounds),
+            'SeenSet в памяти': await measure(seen_set, args.rounds),
+            'загрузка SeenSet из BLOB': await measure(cold_load, args.rounds),
+        }
+        db.close()
+
+    print(f'{args.users} анкет, {args.swipes} свайпов у пользователя, пачка {args.batch}')
+    print(f'{"первая загрузка (likes + skips → BLOB)":<40} {first_load:>8.2f} мс')
+    for name, ms in results.items():
+        print(f'{name:<40} {ms:>8.2f} мс')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=30000)
+    parser.add_argument('--swipes', type=int, default=12000)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=20)
+    parser.add_argument('--background', type=int, default=1_000_000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""Синтетическая база для нагрузочного тестирования бота.
+
+Запуск из корня репозитория:
+
+    python generate_dataset.py load.db [--users 1000000] [--likes 50000000] [--skips 75000000]
+
+Создаёт новый файл БД со схемой SQLiteDatabase и заполняет его:
+
+* анкетами с правдоподобными распределениями пола, возраста и цели (цели —
+  те же строки с эмодзи, что принимает goal_step); часть анкет брошена на
+  первом шаге, часть ждёт модерации или отклонена;
+* лайками со степенным распределением: сколько лайков ставит пользователь
+  и насколько популярна анкета, — с заданной долей взаимных;
+* пропусками (не пересекаются с лайками того же пользователя);
+* записями модерации во всех статусах, включая взятые в работу админом,
+  и кэшем решений photo_verdicts.
+
+Строки вставляются через executemany большими транзакциями; вторичные
+индексы и триггеры счётчиков на время загрузки снимаются и создаются
+заново в конце, счётчики статистики пересчитываются.
+"""
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from src.database.sqlite import STATS_COUNT_QUERIES, SQLiteDatabase  # noqa: E402
+
+GENDERS = ('Мужской', 'Женский')
+GENDER_SHARE = (0.58, 0.42)
+# Те же варианты, что в клавиатуре goal_step
+GOALS = ('❤️ Романтическое', '👥 Дружеское', '💼 Деловое')
+GOAL_SHARE = (0.55, 0.30, 0.15)
+NAMES = {
+    'Мужской': ('Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей', 'Артём', 'Илья',
+                'Кирилл', 'Михаил', 'Никита', 'Матвей', 'Роман', 'Егор', 'Иван', 'Павел'),
+    'Женский': ('Анастасия', 'Мария', 'Анна', 'Виктория', 'Екатерина', 'Наталья', 'Марина', 'Полина',
+                'Дарья', 'Алина', 'Ксения', 'Елена', 'Ольга', 'Софья', 'Юлия', 'Татьяна'),
+}
+DESCRIPTIONS = (
+    '', '', '', '',
+    'Люблю путешествия и хорошие книги',
+    'Бегаю по утрам, ищу компанию для пробежек',
+    'Программист, играю на гитаре',
+    'Кофе, кино и долгие прогулки',
+    'Ищу единомышленников для настолок',
+    'Работаю в маркетинге, открыта к новым знакомствам',
+    'Горы, велосипед, фотография',
+)
+
+# Кем становится анкета: активная, ждёт модерации, отклонена, брошена на первом шаге
+KIND_ACTIVE, KIND_PENDING, KIND_REJECTED, KIND_ABANDONED = range(4)
+KIND_SHARE = (0.80, 0.04, 0.04, 0.12)
+# Доля активных анкет, у которых до одобрения было отклонённое фото
+REJECTED_BEFORE_SHARE = 0.1
+# Доля ожидающих модерации, уже взятых в работу админом
+CLAIMED_SHARE = 0.3
+# Показатель степенного распределения: активность пользователей и популярность анкет
+DEGREE_ALPHA = 2.2
+POPULARITY_ALPHA = 1.6
+# Доля свайпов по анкетам своего пола (остальные — по противоположному)
+SAME_GENDER_SHARE = 0.05
+ADMIN_IDS = (100001, 100002, 100003)
+DAY = 86400
+
+# Вторичные индексы и триггеры таблиц, которые заполняет генератор
+BULK_TABLES = ('users', 'likes', 'skips', 'moderation', 'photo_verdicts')
+
+
+def pareto_counts(rng: np.random.Generator, size: int, mean: float, cap: int) -> np.ndarray:
+    """Целые со степенным хвостом и заданным средним (обрезанные сверху cap)"""
+    if mean <= 0 or size == 0:
+        return np.zeros(size, np.int64)
+    scale = mean * (DEGREE_ALPHA - 1) / DEGREE_ALPHA
+    counts = np.floor(scale * (1 + rng.pareto(DEGREE_ALPHA, size)))
+    return np.minimum(counts, cap).astype(np.int64)
+
+
+def generate_users(rng: np.random.Generator, n: int, now: float):
+    """Колонки анкет в порядке регистрации (id = номер + 1)"""
+    ids = np.arange(1, n + 1, dtype=np.int64)
+    # Telegram выдаёт id по возрастанию — более поздние регистрации с большими id
+    tg_ids = 100_000_000 + np.cumsum(rng.integers(1, 5000, n))
+    # Регистрации за последний год, с ростом к концу
+    created = now - 365 * DAY * (1 - np.sort(rng.random(n)) ** 0.7)
+    gender = rng.choice(2, n, p=GENDER_SHARE)
+    goal = rng.choice(len(GOALS), n, p=GOAL_SHARE)
+    # Мода около 23 лет, длинный хвост до 65
+    age = np.minimum(18 + rng.gamma(2.0, 4.5, n), 65).astype(np.int64)
+    kind = rng.choice(4, n, p=KIND_SHARE)
+    return ids, tg_ids, created, gender, goal, age, kind
+
+
+def photo_ids(user_id: int, attempt: int) -> tuple[str, str]:
+    """Похожие на настоящие file_id и file_unique_id фото"""
+    key = f'{user_id:08X}{attempt:02X}'
+    return f'AgACAgIAAxkBAAI{key}ZmFrZV9waG90bw', f'AQAD{key}'
+
+
+def insert_users(conn, rng, users):
+    # Списки Python: скаляры NumPy sqlite3 записал бы как BLOB
+    ids, tg_ids, created, gender, goal, age, kind = (column.tolist() for column in users)
+    name_choice = rng.integers(0, len(NAMES['Мужской']), len(ids)).tolist()
+    description = rng.integers(0, len(DESCRIPTIONS), len(ids)).tolist()
+
+    def rows():
+        for i, user_id in enumerate(ids):
+            k = kind[i]
+            g = GENDERS[gender[i]]
+            if k == KIND_ABANDONED:
+                # Запустил бота и не дошёл даже до имени
+                yield user_id, tg_ids[i], '', None, None, None, None, '', False, created[i]
+                continue
+            photo = photo_ids(user_id, 1)[0] if k == KIND_ACTIVE else None
+            yield (user_id, tg_ids[i], NAMES[g][name_choice[i]], age[i], g, photo,
+                   GOALS[goal[i]], DESCRIPTIONS[description[i]], k == KIND_ACTIVE, created[i])
+
+    conn.executemany(
+        '''
+        INSERT INTO users (id, tg_id, name, age, gender, photo_file_id, goal, description,
+                           is_active, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime(?, 'unixepoch'))
+        ''',
+        rows(),
+    )
+
+
+def insert_moderation(conn, rng, users, now: float):
+    ids, _, created, _, _, _, kind = (column.tolist() for column in users)
+
+    def moderation_rows():
+        for i, user_id in enumerate(ids):
+            k = kind[i]
+            if k == KIND_ABANDONED:
+                continue
+            submitted = created[i] + rng.uniform(60, 3600)
+            admin = ADMIN_IDS[user_id % len(ADMIN_IDS)]
+            if k == KIND_ACTIVE:
+                if rng.random() < REJECTED_BEFORE_SHARE:
+                    yield (user_id, *photo_ids(user_id, 0), 'rejected', submitted,
+                           admin, submitted + 600, None, None)
+                    submitted += 1800
+                yield (user_id, *photo_ids(user_id, 1), 'approved', submitted,
+                       admin, submitted + rng.uniform(60, 7200), None, None)
+            elif k == KIND_REJECTED:
+                yield (user_id, *photo_ids(user_id, 1), 'rejected', submitted,
+                       admin, submitted + rng.uniform(60, 7200), None, None)
+            elif rng.random() < CLAIMED_SHARE:
+                # Админ взял пачку и ещё не решил
+                yield (user_id, *photo_ids(user_id, 1), 'pending', submitted,
+                       None, None, admin, now + rng.uniform(0, 300))
+            else:
+                yield (user_id, *photo_ids(user_id, 1), 'pending', submitted, None, None, None, None)
+
+    conn.executemany(
+        '''
+        INSERT INTO moderation (user_id, photo_file_id, photo_unique_id, status, created_at,
+                                decided_by, decided_at, claimed_by, claimed_until)
+        VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'),
+                ?, datetime(?, 'unixepoch'), ?, ?)
+        ''',
+        moderation_rows(),
+    )
+    # Кэш решений — по последнему решению для каждого фото
+    conn.execute('''
+        INSERT OR REPLACE INTO photo_verdicts (photo_unique_id, status, user_id, decided_at)
+        SELECT photo_unique_id, status, user_id, decided_at FROM moderation
+        WHERE status != 'pending' ORDER BY id
+    ''')
+
+
+class TargetPool:
+    """Выбор анкет для свайпа пропорционально их популярности"""
+
+    def __init__(self, ids: np.ndarray, popularity: np.ndarray):
+        self.ids = ids
+        self.cumulative = np.cumsum(popularity)
+
+    def sample(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        if not len(self.ids) or not size:
+            return np.zeros(size, np.int64)
+        picks = np.searchsorted(self.cumulative, rng.random(size) * self.cumulative[-1], side='right')
+        return self.ids[np.minimum(picks, len(self.ids) - 1)]
+
+
+def generate_swipes(conn, rng, users, likes: int, skips: int, mutual: float,
+                    now: float, chunk: int, log):
+    """Лайки и пропуски активных анкет, по chunk свайпающих за раз"""
+    ids, _, created, gender, _, _, kind = users
+    active = ids[kind == KIND_ACTIVE]
+    if len(active) < 2:
+        return
+    active_gender = gender[kind == KIND_ACTIVE]
+    popularity = 1 + rng.pareto(POPULARITY_ALPHA, len(active))
+    pools = [
+        TargetPool(active[active_gender == g], popularity[active_gender == g])
+        for g in range(len(GENDERS))
+    ]
+    # Доля mutual лайков получает ответный лайк — итоговая доля учитывает и их
+    like_mean = likes / len(active) / (1 + mutual)
+    cap = len(active) - 1
+    like_counts = pareto_counts(rng, len(active), like_mean, cap)
+    skip_counts = pareto_counts(rng, len(active), skips / len(active), cap)
+    created_by_id = np.concatenate(([0.0], created))
+
+    like_sql = ("INSERT OR IGNORE INTO likes (from_user_id, to_user_id, created_at) "
+                "VALUES (?, ?, datetime(?, 'unixepoch'))")
+    skip_sql = ("INSERT OR IGNORE INTO skips (from_user_id, to_user_id, created_at) "
+                "VALUES (?, ?, datetime(?, 'unixepoch'))")
+
+    for start in range(0, len(active), chunk):
+        sources = active[start:start + chunk]
+        source_gender = active_gender[start:start + chunk]
+        n_likes = like_counts[start:start + chunk]
+        n_skips = skip_counts[start:start + chunk]
+        per_source = n_likes + n_skips
+
+        from_ids = np.repeat(sources, per_source)
+        from_gender = np.repeat(source_gender, per_source)
+        # 1 — лайк, 0 — пропуск; порядок внутри пользователя случайный
+        offsets = np.arange(len(from_ids)) - np.repeat(np.cumsum(per_source) - per_source, per_source)
+        is_like = offsets < np.repeat(n_likes, per_source)
+
+        # Большинство свайпов — по противоположному полу
+        target_gender = np.where(rng.random(len(from_ids)) < SAME_GENDER_SHARE, from_gender, 1 - from_gender)
+        to_ids = np.empty(len(from_ids), np.int64)
+        for g, pool in enumerate(pools):
+            mask = target_gender == g
+            to_ids[mask] = pool.sample(rng, int(mask.sum()))
+
+        # Без свайпов по себе и повторов пары (первый свайп пары побеждает)
+        keep = from_ids != to_ids
+        from_ids, to_ids, is_like = from_ids[keep], to_ids[keep], is_like[keep]
+        _, first = np.unique(from_ids * (ids[-1] + 1) + to_ids, return_index=True)
+        from_ids, to_ids, is_like = from_ids[first], to_ids[first], is_like[first]
+
+        # Свайп — после регистрации обоих
+        since = np.maximum(created_by_id[from_ids], created_by_id[to_ids])
+        swiped = since + (now - since) * rng.random(len(from_ids))
+
+        conn.executemany(like_sql, zip(from_ids[is_like].tolist(), to_ids[is_like].tolist(),
+                                       swiped[is_like].tolist()))
+        conn.executemany(skip_sql, zip(from_ids[~is_like].tolist(), to_ids[~is_like].tolist(),
+                                       swiped[~is_like].tolist()))
+
+        # Ответные лайки: позже исходного
+        answered = is_like & (rng.random(len(from_ids)) < mutual)
+        reply_at = swiped[answered] + (now - swiped[answered]) * rng.random(int(answered.sum()))
+        conn.executemany(like_sql, zip(to_ids[answered].tolist(), from_ids[answered].tolist(),
+                                       reply_at.tolist()))
+        conn.commit()
+        log(f'свайпают {min(start + chunk, len(active))} из {len(active)}')
+
+    # Ответный лайк мог попасть на уже пропущенную анкету: лайк важнее
+    conn.execute('''
+        DELETE FROM skips WHERE EXISTS (
+            SELECT 1 FROM likes l
+            WHERE l.from_user_id = skips.from_user_id AND l.to_user_id = skips.to_user_id
+        )
+    ''')
+    # Взаимность по факту: лайк взаимный, если есть встречный
+    conn.execute('''
+        UPDATE likes SET is_mutual = TRUE WHERE EXISTS (
+            SELECT 1 FROM likes r
+            WHERE r.from_user_id = likes.to_user_id AND r.to_user_id = likes.from_user_id
+        )
+    ''')
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', type=Path, help='Новый файл БД')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--likes', type=int, default=None, help='По умолчанию 50 на анкету')
+    parser.add_argument('--skips', type=int, default=None, help='По умолчанию полтора лайка')
+    parser.add_argument('--mutual', type=float, default=0.15,
+                        help='Доля лайков, получивших ответный лайк (взаимными станут обе стороны)')
+    parser.add_argument('--chunk', type=int, default=20_000, help='Свайпающих на транзакцию')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help='Перезаписать существующий файл')
+    args = parser.parse_args()
+
+    likes = args.users * 50 if args.likes is None else args.likes
+    skips = likes * 3 // 2 if args.skips is None else args.skips
+
+    if args.path.exists():
+        if not args.force:
+            parser.error(f'{args.path} уже существует (--force, чтобы перезаписать)')
+        for suffix in ('', '-wal', '-shm'):
+            Path(f'{args.path}{suffix}').unlink(missing_ok=True)
+
+    started = time.perf_counter()
+
+    def log(message: str):
+        print(f'[{time.perf_counter() - started:7.1f} с] {message}', flush=True)
+
+    # Схема, миграции и auto_vacuum — как у бота
+    SQLiteDatabase(args.path, group_commit=False).close()
+
+    rng = np.random.default_rng(args.seed)
+    now = time.time()
+    conn = sqlite3.connect(args.path)
+    journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    # Файл новый: при сбое его проще создать заново, поэтому журнал и fsync не нужны
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -512000')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+    placeholders = ','.join('?' * len(BULK_TABLES))
+    schema = conn.execute(
+        f"SELECT type, name, sql FROM sqlite_master "
+        f"WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        BULK_TABLES,
+    ).fetchall()
+    for kind, name, _ in schema:
+        conn.execute(f'DROP {kind.upper()} {name}')
+    conn.commit()
+
+    users = generate_users(rng, args.users, now)
+    insert_users(conn, rng, users)
+    conn.commit()
+    log(f'анкет: {args.users}')
+
+    insert_moderation(conn, rng, users, now)
+    conn.commit()
+    log('модерация готова')
+
+    generate_swipes(conn, rng, users, likes, skips, args.mutual, now, args.chunk, log)
+    log('свайпы готовы')
+
+    for _, _, sql in schema:
+        conn.execute(sql)
+    for name, query in STATS_COUNT_QUERIES.items():
+        conn.execute('INSERT OR REPLACE INTO stats_counters (name, value) VALUES (?, ?)',
+                     (name, conn.execute(query).fetchone()[0]))
+    conn.commit()
+    # Статистика для планировщика по выборке строк, а не полным проходом
+    conn.execute('PRAGMA analysis_limit = 1000')
+    conn.execute('ANALYZE')
+    conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+    log('индексы и счётчики восстановлены')
+
+    stats = dict(conn.execute('SELECT name, value FROM stats_counters').fetchall())
+    stats['skips'] = conn.execute('SELECT COUNT(*) FROM skips').fetchone()[0]
+    conn.close()
+
+    size = args.path.stat().st_size / 2**20
+    print(f'{args.path}: {size:.0f} МБ')
+    for name in (*STATS_COUNT_QUERIES, 'skips'):
+        print(f'  {name:<20} {stats[name]:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,8 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from dotenv import load_dotenv
 
+from src.fsm import create_fsm_storage
+
 logging.basicConfig(level=logging.INFO)
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -27,13 +29,40 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 
-dp = Dispatcher()
+# Состояния FSM (создание анкеты, удаление пользователя) переживают перезапуск
+fsm_storage = create_fsm_storage()
+dp = Dispatcher(storage=fsm_storage)
 
 
 async def main():
     try:
         # Импортируем роутеры внутри функции main, чтобы избежать циклических импортов
         from src.handlers import profile, browse, admin
+        from src import consumers  # noqa: F401 — регистрирует подписчиков шины событий
+        from src.config import cfg
+        from src.database.sqlite import db
+        from src.digest import like_digest
+        from src.events import bus
+        from src.middlewares import UserMiddleware
+        from src.outbox import outbox
+        from src.retention import retention
+        from src.storage import storage
+
+        # Схема БД создаётся и обновляется до первого апдейта
+        db.open()
+
+        # Пользователь загружается один раз на апдейт и передаётся в обработчики
+        dp.update.outer_middleware(UserMiddleware(storage))
+        # Перед остановкой досылаем то, что осталось в очереди отправки
+        dp.shutdown.register(bus.drain)
+        dp.shutdown.register(outbox.drain)
+        # Дайджесты лайков, не отправленные до перезапуска
+        dp.startup.register(like_digest.start)
+        dp.shutdown.register(like_digest.close)
+        # Фоновая чистка устаревших пропусков
+        dp.startup.register(retention.start)
+        dp.shutdown.register(retention.close)
+        dp.shutdown.register(fsm_storage.close)
 
         # Регистрируем все роутеры
         print("📋 Регистрирую роутеры...")
@@ -50,8 +79,14 @@ async def main():
         print("  /admin - Панель администратора (для админов)")
         print("  /adminhelp - Справка по админ-командам")
 
-        print("\n⏳ Запускаю поллинг...")
-        await dp.start_polling(bot)
+        if cfg.webhook_url:
+            from src.webhook import run_webhook
+
+            print(f"\n⏳ Запускаю вебхук {cfg.webhook_url}{cfg.webhook_path}...")
+            await run_webhook(dp, bot)
+        else:
+            print("\n⏳ Запускаю поллинг...")
+            await dp.start_polling(bot)
 
     except Exception as e:
         print(f"Критическая ошибка при запуске: {e}")
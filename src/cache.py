@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .storage import User
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class UserCache:
+    """Ограниченный LRU-кэш пользователей с TTL, доступный по id и по tg_id.
+
+    Наружу всегда отдаются копии: обработчики меняют поля анкеты перед
+    сохранением, и эти изменения не должны попадать в кэш.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._by_id: OrderedDict[int, Tuple[float, 'User']] = OrderedDict()
+        self._id_by_tg: Dict[int, int] = {}
+        # Меняется при каждой инвалидации: чтение из БД, начатое раньше,
+        # не должно положить в кэш устаревшую строку
+        self._version = 0
+
+    def token(self) -> int:
+        """Запомнить состояние кэша перед чтением из БД (см. put)"""
+        return self._version
+
+    def get_by_id(self, user_id: int) -> Optional['User']:
+        entry = self._by_id.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._drop(user_id)
+            self.misses += 1
+            return None
+
+        self._by_id.move_to_end(user_id)
+        self.hits += 1
+        return replace(user)
+
+    def get_by_tg(self, tg_id: int) -> Optional['User']:
+        user_id = self._id_by_tg.get(tg_id)
+        if user_id is None:
+            self.misses += 1
+            return None
+        return self.get_by_id(user_id)
+
+    def put(self, user: 'User', token: int | None = None):
+        if token is not None and token != self._version:
+            return
+
+        self._drop(user.id)
+        self._by_id[user.id] = (time.monotonic() + self.ttl, replace(user))
+        self._id_by_tg[user.tg_id] = user.id
+
+        while len(self._by_id) > self.maxsize:
+            oldest_id = next(iter(self._by_id))
+            self._drop(oldest_id)
+
+    def invalidate(self, user_id: int | None = None, tg_id: int | None = None):
+        self._version += 1
+        if user_id is None and tg_id is not None:
+            user_id = self._id_by_tg.pop(tg_id, None)
+        if user_id is not None:
+            self._drop(user_id)
+
+    def clear(self):
+        self._version += 1
+        self._by_id.clear()
+        self._id_by_tg.clear()
+
+    def stats(self) -> CacheStats:
+        return CacheStats(hits=self.hits, misses=self.misses, size=len(self._by_id))
+
+    def _drop(self, user_id: int):
+        entry = self._by_id.pop(user_id, None)
+        if entry is not None:
+            self._id_by_tg.pop(entry[1].tg_id, None)
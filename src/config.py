@@ -10,12 +10,133 @@ load_dotenv(BASE_DIR / ".env")
 ADMIN_IDS = os.getenv('ADMIN_IDS', '')
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'PUT_YOUR_TOKEN_HERE')
 
+# Файл базы бота (по умолчанию dating_bot.db в корне репозитория)
+DB_PATH = os.getenv('DB_PATH', '')
+# Пул соединений SQLite и executor для запросов настраиваются независимо
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '10'))
+# Опциональный путь записи: WAL и поток-писатель с групповым коммитом
+DB_WAL = os.getenv('DB_WAL', '').lower() in ('1', 'true', 'yes')
+DB_GROUP_COMMIT = os.getenv('DB_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+DB_GROUP_COMMIT_WINDOW_MS = float(os.getenv('DB_GROUP_COMMIT_WINDOW_MS', '5'))
+
+# Лента кандидатов: размер пачки и порог фоновой дозагрузки
+FEED_BATCH_SIZE = int(os.getenv('FEED_BATCH_SIZE', '20'))
+FEED_LOW_WATERMARK = int(os.getenv('FEED_LOW_WATERMARK', '5'))
+
+# Кэш пользователей в Storage
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+
+# Очередь исходящих сообщений: лимиты Telegram на бота и на отдельный чат
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '30'))
+OUTBOX_CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE', '1'))
+OUTBOX_CHAT_BURST = float(os.getenv('OUTBOX_CHAT_BURST', '3'))
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv('OUTBOX_MAX_IN_FLIGHT', '10'))
+OUTBOX_MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES', '3'))
+
+# Дайджест лайков: окно накопления в секундах и порог немедленной отправки
+LIKE_DIGEST_WINDOW = float(os.getenv('LIKE_DIGEST_WINDOW', '60'))
+LIKE_DIGEST_THRESHOLD = int(os.getenv('LIKE_DIGEST_THRESHOLD', '10'))
+
+# Режим вебхука включается, если задан WEBHOOK_URL (иначе long polling)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Сколько апдейтов обрабатываем одновременно и сохранять ли порядок внутри чата
+WEBHOOK_MAX_WORKERS = int(os.getenv('WEBHOOK_MAX_WORKERS', '32'))
+WEBHOOK_CHAT_ORDERING = os.getenv('WEBHOOK_CHAT_ORDERING', '1').lower() in ('1', 'true', 'yes')
+
+# Хранилище FSM: sqlite (по умолчанию, в файле бота или FSM_DB_PATH) или memory
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite').lower()
+FSM_DB_PATH = os.getenv('FSM_DB_PATH', '')
+# Апдейты одних чатов обрабатывают несколько процессов с общей БД FSM: кэш
+# сверяется с БД перед каждым чтением. Без этого (0) каждый чат должен
+# обслуживать один процесс — иначе другой процесс прочитает устаревшее состояние
+FSM_SHARED = os.getenv('FSM_SHARED', '0').lower() in ('1', 'true', 'yes')
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+# Брошенные анкеты и диалоги забываются через сутки
+FSM_TTL = float(os.getenv('FSM_TTL', '86400'))
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '1'))
+FSM_FLUSH_BATCH = int(os.getenv('FSM_FLUSH_BATCH', '100'))
+
+# Модерация: сколько фото админ берёт за раз (не больше 10 — предел медиагруппы)
+# и на сколько секунд они закрепляются за ним, прежде чем вернуться в очередь
+MODERATION_BATCH_SIZE = min(int(os.getenv('MODERATION_BATCH_SIZE', '10')), 10)
+MODERATION_LEASE = float(os.getenv('MODERATION_LEASE', '300'))
+
+# Подбор кандидатов по индексу анкет в памяти (NumPy) вместо SQL-сортировки
+PROFILE_INDEX = os.getenv('PROFILE_INDEX', '1').lower() in ('1', 'true', 'yes')
+# Множества просмотренных анкет: для скольких пользователей держать в памяти
+# и после скольких новых свайпов перезаписывать сжатую копию в БД
+SEEN_CACHE_SIZE = int(os.getenv('SEEN_CACHE_SIZE', '10000'))
+SEEN_COMPACT_AFTER = int(os.getenv('SEEN_COMPACT_AFTER', '256'))
+
+# Пропуски старше SKIP_TTL_DAYS дней удаляются, и анкета снова попадает в ленту (0 — хранить вечно).
+# Чистка идёт раз в RETENTION_INTERVAL секунд пачками по RETENTION_BATCH строк с паузой
+# RETENTION_PAUSE секунд между ними, затем возвращает ОС до VACUUM_PAGES свободных страниц
+SKIP_TTL_DAYS = float(os.getenv('SKIP_TTL_DAYS', '90'))
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', '3600'))
+RETENTION_BATCH = int(os.getenv('RETENTION_BATCH', '2000'))
+RETENTION_PAUSE = float(os.getenv('RETENTION_PAUSE', '0.05'))
+VACUUM_PAGES = int(os.getenv('VACUUM_PAGES', '2000'))
+# Брошенные анкеты (без имени, ни разу не активированные) старше PURGE_ABANDONED_DAYS дней
+# удаляются той же чисткой пачками по PURGE_BATCH пользователей. По умолчанию выключено (0):
+# удаление аккаунтов включается явно
+PURGE_ABANDONED_DAYS = float(os.getenv('PURGE_ABANDONED_DAYS', '0'))
+PURGE_BATCH = int(os.getenv('PURGE_BATCH', '200'))
+
 @dataclass
 class Config:
     bot_token: str = BOT_TOKEN
     admin_ids: set[int] = field(default_factory=set)
     # Словарь для хранения режима админа по ID пользователя
     admin_mode: dict[int, bool] = field(default_factory=dict)
+    db_path: str = DB_PATH
+    db_pool_size: int = DB_POOL_SIZE
+    db_executor_workers: int = DB_EXECUTOR_WORKERS
+    db_wal: bool = DB_WAL
+    db_group_commit: bool = DB_GROUP_COMMIT
+    db_group_commit_window: float = DB_GROUP_COMMIT_WINDOW_MS / 1000
+    feed_batch_size: int = FEED_BATCH_SIZE
+    feed_low_watermark: int = FEED_LOW_WATERMARK
+    user_cache_size: int = USER_CACHE_SIZE
+    user_cache_ttl: float = USER_CACHE_TTL
+    outbox_global_rate: float = OUTBOX_GLOBAL_RATE
+    outbox_chat_rate: float = OUTBOX_CHAT_RATE
+    outbox_chat_burst: float = OUTBOX_CHAT_BURST
+    outbox_max_in_flight: int = OUTBOX_MAX_IN_FLIGHT
+    outbox_max_retries: int = OUTBOX_MAX_RETRIES
+    like_digest_window: float = LIKE_DIGEST_WINDOW
+    like_digest_threshold: int = LIKE_DIGEST_THRESHOLD
+    webhook_url: str = WEBHOOK_URL
+    webhook_path: str = WEBHOOK_PATH
+    webhook_host: str = WEBHOOK_HOST
+    webhook_port: int = WEBHOOK_PORT
+    webhook_secret: str = WEBHOOK_SECRET
+    webhook_max_workers: int = WEBHOOK_MAX_WORKERS
+    webhook_chat_ordering: bool = WEBHOOK_CHAT_ORDERING
+    fsm_storage: str = FSM_STORAGE
+    fsm_db_path: str = FSM_DB_PATH
+    fsm_shared: bool = FSM_SHARED
+    fsm_cache_size: int = FSM_CACHE_SIZE
+    fsm_ttl: float = FSM_TTL
+    fsm_flush_interval: float = FSM_FLUSH_INTERVAL
+    fsm_flush_batch: int = FSM_FLUSH_BATCH
+    moderation_batch_size: int = MODERATION_BATCH_SIZE
+    moderation_lease: float = MODERATION_LEASE
+    profile_index: bool = PROFILE_INDEX
+    seen_cache_size: int = SEEN_CACHE_SIZE
+    seen_compact_after: int = SEEN_COMPACT_AFTER
+    skip_ttl: float = SKIP_TTL_DAYS * 86400
+    retention_interval: float = RETENTION_INTERVAL
+    retention_batch: int = RETENTION_BATCH
+    retention_pause: float = RETENTION_PAUSE
+    vacuum_pages: int = VACUUM_PAGES
+    purge_abandoned_after: float = PURGE_ABANDONED_DAYS * 86400
+    purge_batch: int = PURGE_BATCH
 
     def __post_init__(self):
         # Парсим строку с ADMIN_IDS после инициализации
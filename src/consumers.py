@@ -0,0 +1,61 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .digest import like_digest
+from .events import LikeCreated, MatchCreated, ModerationDecided, ProfileActivated, bus
+from .outbox import Priority, outbox
+from .storage import storage
+
+# Подписчики шины событий. Модуль достаточно импортировать один раз (см. main.py)
+
+
+def get_write_kb(tg_id: int):
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="💬 Написать",
+                    url=f"tg://user?id={tg_id}",
+                )
+            ]
+        ]
+    )
+
+
+@bus.subscribe(LikeCreated)
+async def collect_like_digest(event: LikeCreated):
+    # О взаимном лайке сообщает notify_match
+    if not event.is_mutual:
+        await like_digest.add(event.bot, event.to_user.tg_id)
+
+
+@bus.subscribe(MatchCreated)
+async def notify_match(event: MatchCreated):
+    for user, other in ((event.user, event.other), (event.other, event.user)):
+        outbox.send_message(
+            event.bot,
+            user.tg_id,
+            f"🎉 Взаимный лайк с {other.name}!",
+            priority=Priority.MATCH,
+            reply_markup=get_write_kb(other.tg_id),
+        )
+
+
+@bus.subscribe(ProfileActivated)
+async def warm_up_feed(event: ProfileActivated):
+    storage.prefetch_feed(event.user.id)
+
+
+@bus.subscribe(ModerationDecided)
+async def notify_moderation(event: ModerationDecided):
+    if event.approved:
+        text = (
+            '✅ Ваше фото одобрено модератором!\n'
+            'Ваша анкета теперь активна и видна другим пользователям.'
+        )
+    else:
+        text = (
+            '❌ Ваше фото не прошло модерацию.\n'
+            'Пожалуйста, используйте /start, чтобы создать новую анкету.'
+        )
+
+    outbox.send_message(event.bot, event.user.tg_id, text, priority=Priority.NOTIFY)
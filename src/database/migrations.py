@@ -0,0 +1,458 @@
+import logging
+import sqlite3
+from dataclasses import dataclass
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+
+
+# Миграции применяются строго по порядку, номер последней применённой
+# хранится в PRAGMA user_version. Уже выпущенные миграции не редактируем —
+# любое изменение схемы оформляется новой миграцией в конце списка.
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, 'Базовая схема', (
+        # Таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tg_id INTEGER UNIQUE NOT NULL,
+            name TEXT NOT NULL DEFAULT '',
+            age INTEGER,
+            gender TEXT,
+            photo_file_id TEXT,
+            goal TEXT,
+            description TEXT,
+            is_active BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Таблица лайков
+        '''
+        CREATE TABLE IF NOT EXISTS likes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER NOT NULL,
+            to_user_id INTEGER NOT NULL,
+            is_mutual BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (from_user_id) REFERENCES users (id),
+            FOREIGN KEY (to_user_id) REFERENCES users (id),
+            UNIQUE(from_user_id, to_user_id)
+        )
+        ''',
+        # Таблица модерации
+        '''
+        CREATE TABLE IF NOT EXISTS moderation (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            photo_file_id TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, photo_file_id)
+        )
+        ''',
+        # Таблица пропусков
+        '''
+        CREATE TABLE IF NOT EXISTS skips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER NOT NULL,
+            to_user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (from_user_id) REFERENCES users (id),
+            FOREIGN KEY (to_user_id) REFERENCES users (id),
+            UNIQUE(from_user_id, to_user_id)
+        )
+        ''',
+    )),
+    Migration(2, 'Индексы для горячих запросов', (
+        # get_likes_to_user: WHERE to_user_id = ? ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_likes_to_user ON likes (to_user_id, created_at)',
+        # get_pending_moderation: только pending, самые старые первыми
+        "CREATE INDEX IF NOT EXISTS idx_moderation_pending ON moderation (created_at) WHERE status = 'pending'",
+        # get_user_moderation_status / get_pending_moderation_by_user
+        'CREATE INDEX IF NOT EXISTS idx_moderation_user ON moderation (user_id, created_at)',
+        # Поиск кандидатов: только активные анкеты, новые первыми
+        'CREATE INDEX IF NOT EXISTS idx_users_active_created ON users (created_at) WHERE is_active = TRUE',
+        'CREATE INDEX IF NOT EXISTS idx_users_active_gender ON users (gender, created_at) WHERE is_active = TRUE',
+        'CREATE INDEX IF NOT EXISTS idx_users_active_gender_goal '
+        'ON users (gender, goal, created_at) WHERE is_active = TRUE',
+    )),
+    Migration(3, 'Таблица счётчиков для статистики', (
+        '''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        # Начальные значения — одним пересчётом по существующим данным
+        "INSERT OR REPLACE INTO stats_counters SELECT 'total_users', COUNT(*) FROM users",
+        "INSERT OR REPLACE INTO stats_counters SELECT 'active_users', COUNT(*) FROM users WHERE is_active = TRUE",
+        "INSERT OR REPLACE INTO stats_counters "
+        "SELECT 'users_with_photo', COUNT(*) FROM users WHERE photo_file_id IS NOT NULL",
+        "INSERT OR REPLACE INTO stats_counters SELECT 'total_likes', COUNT(*) FROM likes",
+        "INSERT OR REPLACE INTO stats_counters SELECT 'mutual_likes', COUNT(*) FROM likes WHERE is_mutual = TRUE",
+        "INSERT OR REPLACE INTO stats_counters SELECT 'total_mod', COUNT(*) FROM moderation",
+        "INSERT OR REPLACE INTO stats_counters SELECT 'pending_mod', COUNT(*) FROM moderation WHERE status = 'pending'",
+        # Дальше счётчики поддерживаются триггерами в той же транзакции, что и запись
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_insert AFTER INSERT ON users BEGIN
+            UPDATE stats_counters SET value = value + CASE name
+                WHEN 'total_users' THEN 1
+                WHEN 'active_users' THEN COALESCE(NEW.is_active = TRUE, 0)
+                WHEN 'users_with_photo' THEN NEW.photo_file_id IS NOT NULL
+            END
+            WHERE name IN ('total_users', 'active_users', 'users_with_photo');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_delete AFTER DELETE ON users BEGIN
+            UPDATE stats_counters SET value = value - CASE name
+                WHEN 'total_users' THEN 1
+                WHEN 'active_users' THEN COALESCE(OLD.is_active = TRUE, 0)
+                WHEN 'users_with_photo' THEN OLD.photo_file_id IS NOT NULL
+            END
+            WHERE name IN ('total_users', 'active_users', 'users_with_photo');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_update
+        AFTER UPDATE OF is_active, photo_file_id ON users BEGIN
+            UPDATE stats_counters SET value = value + CASE name
+                WHEN 'active_users' THEN COALESCE(NEW.is_active = TRUE, 0) - COALESCE(OLD.is_active = TRUE, 0)
+                WHEN 'users_with_photo' THEN (NEW.photo_file_id IS NOT NULL) - (OLD.photo_file_id IS NOT NULL)
+            END
+            WHERE name IN ('active_users', 'users_with_photo');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_insert AFTER INSERT ON likes BEGIN
+            UPDATE stats_counters SET value = value + CASE name
+                WHEN 'total_likes' THEN 1
+                WHEN 'mutual_likes' THEN COALESCE(NEW.is_mutual = TRUE, 0)
+            END
+            WHERE name IN ('total_likes', 'mutual_likes');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_delete AFTER DELETE ON likes BEGIN
+            UPDATE stats_counters SET value = value - CASE name
+                WHEN 'total_likes' THEN 1
+                WHEN 'mutual_likes' THEN COALESCE(OLD.is_mutual = TRUE, 0)
+            END
+            WHERE name IN ('total_likes', 'mutual_likes');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_update AFTER UPDATE OF is_mutual ON likes BEGIN
+            UPDATE stats_counters
+            SET value = value + COALESCE(NEW.is_mutual = TRUE, 0) - COALESCE(OLD.is_mutual = TRUE, 0)
+            WHERE name = 'mutual_likes';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_moderation_stats_insert AFTER INSERT ON moderation BEGIN
+            UPDATE stats_counters SET value = value + CASE name
+                WHEN 'total_mod' THEN 1
+                WHEN 'pending_mod' THEN COALESCE(NEW.status = 'pending', 0)
+            END
+            WHERE name IN ('total_mod', 'pending_mod');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_moderation_stats_delete AFTER DELETE ON moderation BEGIN
+            UPDATE stats_counters SET value = value - CASE name
+                WHEN 'total_mod' THEN 1
+                WHEN 'pending_mod' THEN COALESCE(OLD.status = 'pending', 0)
+            END
+            WHERE name IN ('total_mod', 'pending_mod');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_moderation_stats_update AFTER UPDATE OF status ON moderation BEGIN
+            UPDATE stats_counters
+            SET value = value + COALESCE(NEW.status = 'pending', 0) - COALESCE(OLD.status = 'pending', 0)
+            WHERE name = 'pending_mod';
+        END
+        ''',
+    )),
+    Migration(4, 'Накопленные уведомления о лайках', (
+        # Сколько лайков ждут дайджеста у получателя и с какого момента (unix time)
+        '''
+        CREATE TABLE IF NOT EXISTS like_digests (
+            chat_id INTEGER PRIMARY KEY,
+            pending INTEGER NOT NULL DEFAULT 0,
+            first_at REAL NOT NULL
+        )
+        ''',
+    )),
+    Migration(5, 'Хранилище состояний FSM', (
+        # data — JSON, updated_at — unix time последней записи (для TTL)
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)',
+    )),
+    Migration(6, 'Версия строки пользователя для оптимистичной блокировки', (
+        'ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+    )),
+    Migration(7, 'Кто и когда принял решение по модерации', (
+        'ALTER TABLE moderation ADD COLUMN decided_by INTEGER',
+        'ALTER TABLE moderation ADD COLUMN decided_at TIMESTAMP',
+        # Раньше в status писалось действие кнопки (approve/reject)
+        "UPDATE moderation SET status = 'approved' WHERE status = 'approve'",
+        "UPDATE moderation SET status = 'rejected' WHERE status = 'reject'",
+    )),
+    Migration(8, 'Аренда записей модерации админами', (
+        # claimed_until — unix-время окончания аренды; просроченную запись может взять другой админ
+        'ALTER TABLE moderation ADD COLUMN claimed_by INTEGER',
+        'ALTER TABLE moderation ADD COLUMN claimed_until REAL',
+    )),
+    Migration(9, 'Кэш решений модерации по file_unique_id', (
+        # file_unique_id одинаков для одного и того же файла при повторной отправке
+        'ALTER TABLE moderation ADD COLUMN photo_unique_id TEXT',
+        '''
+        CREATE TABLE IF NOT EXISTS photo_verdicts (
+            photo_unique_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            decided_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+        # Попадания и промахи кэша; пересчитать их по таблицам нельзя, recount_stats их не трогает
+        "INSERT OR IGNORE INTO stats_counters (name, value) VALUES ('photo_verdict_hits', 0)",
+        "INSERT OR IGNORE INTO stats_counters (name, value) VALUES ('photo_verdict_misses', 0)",
+    )),
+    Migration(10, 'Сжатые множества просмотренных анкет', (
+        # ids — отсортированные uint32; метки — последние id лайка и пропуска, вошедшие в ids
+        '''
+        CREATE TABLE IF NOT EXISTS seen_sets (
+            user_id INTEGER PRIMARY KEY,
+            ids BLOB NOT NULL,
+            like_mark INTEGER NOT NULL DEFAULT 0,
+            skip_mark INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        # Дочитка свайпов после метки: from_user_id = ? AND id > ? (rowid идёт последним в индексе)
+        'CREATE INDEX IF NOT EXISTS idx_likes_from ON likes (from_user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_skips_from ON skips (from_user_id)',
+    )),
+    Migration(11, 'Индекс для удаления устаревших пропусков', (
+        'CREATE INDEX IF NOT EXISTS idx_skips_created ON skips (created_at)',
+    )),
+    # Добавить ON DELETE CASCADE к внешнему ключу в SQLite можно только пересозданием таблицы:
+    # новая таблица, копия строк (без ссылок на уже удалённых пользователей), удаление старой,
+    # переименование. Счётчик AUTOINCREMENT переносится под новым именем до удаления старой
+    # таблицы — id не должны переиспользоваться (на них держатся метки seen_sets).
+    # Вместе с таблицей удаляются её индексы и триггеры, поэтому они создаются заново.
+    Migration(12, 'Каскадное удаление связанных строк пользователя', (
+        '''
+        CREATE TABLE likes_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            to_user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            is_mutual BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(from_user_id, to_user_id)
+        )
+        ''',
+        '''
+        INSERT INTO likes_new (id, from_user_id, to_user_id, is_mutual, created_at)
+        SELECT id, from_user_id, to_user_id, is_mutual, created_at FROM likes
+        WHERE from_user_id IN (SELECT id FROM users) AND to_user_id IN (SELECT id FROM users)
+        ''',
+        "DELETE FROM sqlite_sequence WHERE name = 'likes_new'",
+        "UPDATE sqlite_sequence SET name = 'likes_new' WHERE name = 'likes'",
+        'DROP TABLE likes',
+        'ALTER TABLE likes_new RENAME TO likes',
+        'CREATE INDEX IF NOT EXISTS idx_likes_to_user ON likes (to_user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_likes_from ON likes (from_user_id)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_insert AFTER INSERT ON likes BEGIN
+            UPDATE stats_counters SET value = value + CASE name
+                WHEN 'total_likes' THEN 1
+                WHEN 'mutual_likes' THEN COALESCE(NEW.is_mutual = TRUE, 0)
+            END
+            WHERE name IN ('total_likes', 'mutual_likes');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_delete AFTER DELETE ON likes BEGIN
+            UPDATE stats_counters SET value = value - CASE name
+                WHEN 'total_likes' THEN 1
+                WHEN 'mutual_likes' THEN COALESCE(OLD.is_mutual = TRUE, 0)
+            END
+            WHERE name IN ('total_likes', 'mutual_likes');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_update AFTER UPDATE OF is_mutual ON likes BEGIN
+            UPDATE stats_counters
+            SET value = value + COALESCE(NEW.is_mutual = TRUE, 0) - COALESCE(OLD.is_mutual = TRUE, 0)
+            WHERE name = 'mutual_likes';
+        END
+        ''',
+
+        '''
+        CREATE TABLE skips_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            to_user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(from_user_id, to_user_id)
+        )
+        ''',
+        '''
+        INSERT INTO skips_new (id, from_user_id, to_user_id, created_at)
+        SELECT id, from_user_id, to_user_id, created_at FROM skips
+        WHERE from_user_id IN (SELECT id FROM users) AND to_user_id IN (SELECT id FROM users)
+        ''',
+        "DELETE FROM sqlite_sequence WHERE name = 'skips_new'",
+        "UPDATE sqlite_sequence SET name = 'skips_new' WHERE name = 'skips'",
+        'DROP TABLE skips',
+        'ALTER TABLE skips_new RENAME TO skips',
+        'CREATE INDEX IF NOT EXISTS idx_skips_from ON skips (from_user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_skips_created ON skips (created_at)',
+        # Каскад по to_user_id ищет пропуски удаляемой анкеты — без индекса это полный проход
+        'CREATE INDEX IF NOT EXISTS idx_skips_to ON skips (to_user_id)',
+
+        '''
+        CREATE TABLE moderation_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            photo_file_id TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            decided_by INTEGER,
+            decided_at TIMESTAMP,
+            claimed_by INTEGER,
+            claimed_until REAL,
+            photo_unique_id TEXT,
+            UNIQUE(user_id, photo_file_id)
+        )
+        ''',
+        '''
+        INSERT INTO moderation_new
+        SELECT id, user_id, photo_file_id, status, created_at,
+               decided_by, decided_at, claimed_by, claimed_until, photo_unique_id
+        FROM moderation
+        WHERE user_id IN (SELECT id FROM users)
+        ''',
+        "DELETE FROM sqlite_sequence WHERE name = 'moderation_new'",
+        "UPDATE sqlite_sequence SET name = 'moderation_new' WHERE name = 'moderation'",
+        'DROP TABLE moderation',
+        'ALTER TABLE moderation_new RENAME TO moderation',
+        "CREATE INDEX IF NOT EXISTS idx_moderation_pending ON moderation (created_at) WHERE status = 'pending'",
+        'CREATE INDEX IF NOT EXISTS idx_moderation_user ON moderation (user_id, created_at)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_moderation_stats_insert AFTER INSERT ON moderation BEGIN
+            UPDATE stats_counters SET value = value + CASE name
+                WHEN 'total_mod' THEN 1
+                WHEN 'pending_mod' THEN COALESCE(NEW.status = 'pending', 0)
+            END
+            WHERE name IN ('total_mod', 'pending_mod');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_moderation_stats_delete AFTER DELETE ON moderation BEGIN
+            UPDATE stats_counters SET value = value - CASE name
+                WHEN 'total_mod' THEN 1
+                WHEN 'pending_mod' THEN COALESCE(OLD.status = 'pending', 0)
+            END
+            WHERE name IN ('total_mod', 'pending_mod');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_moderation_stats_update AFTER UPDATE OF status ON moderation BEGIN
+            UPDATE stats_counters
+            SET value = value + COALESCE(NEW.status = 'pending', 0) - COALESCE(OLD.status = 'pending', 0)
+            WHERE name = 'pending_mod';
+        END
+        ''',
+
+        # photo_verdicts не каскадируется: отклонённое фото остаётся отклонённым и после удаления автора
+        '''
+        CREATE TABLE seen_sets_new (
+            user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+            ids BLOB NOT NULL,
+            like_mark INTEGER NOT NULL DEFAULT 0,
+            skip_mark INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'INSERT INTO seen_sets_new SELECT * FROM seen_sets WHERE user_id IN (SELECT id FROM users)',
+        'DROP TABLE seen_sets',
+        'ALTER TABLE seen_sets_new RENAME TO seen_sets',
+
+        # purge_abandoned_users: брошенные анкеты, старые первыми
+        "CREATE INDEX IF NOT EXISTS idx_users_abandoned ON users (created_at) WHERE name = '' AND is_active = FALSE",
+
+        # Строки-сироты не скопированы — счётчики пересчитываются
+        "INSERT OR REPLACE INTO stats_counters SELECT 'total_likes', COUNT(*) FROM likes",
+        "INSERT OR REPLACE INTO stats_counters SELECT 'mutual_likes', COUNT(*) FROM likes WHERE is_mutual = TRUE",
+        "INSERT OR REPLACE INTO stats_counters SELECT 'total_mod', COUNT(*) FROM moderation",
+        "INSERT OR REPLACE INTO stats_counters SELECT 'pending_mod', COUNT(*) FROM moderation WHERE status = 'pending'",
+    )),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применить недостающие миграции и вернуть итоговую версию схемы.
+
+    Каждая миграция выполняется в своей транзакции вместе с обновлением
+    user_version, поэтому прерванный запуск просто продолжится с того же места.
+    Существующие базы (user_version = 0) обновляются на месте.
+    """
+    if conn.in_transaction:
+        conn.commit()
+
+    # Таблицы пересоздаются (см. миграцию 12) с выключенными внешними ключами, как советует
+    # документация SQLite: DROP TABLE не должен запускать каскады и проверки ссылок.
+    # Внутри транзакции прагма не действует, поэтому переключаем её до BEGIN
+    foreign_keys = conn.execute('PRAGMA foreign_keys').fetchone()[0]
+    conn.execute('PRAGMA foreign_keys = OFF')
+    try:
+        _apply(conn)
+    finally:
+        conn.execute(f'PRAGMA foreign_keys = {foreign_keys}')
+
+    return get_version(conn)
+
+
+def _apply(conn: sqlite3.Connection):
+    for migration in MIGRATIONS:
+        if get_version(conn) >= migration.version:
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Пока ждали блокировку, миграцию мог применить другой процесс
+            if get_version(conn) >= migration.version:
+                conn.rollback()
+                continue
+
+            for statement in migration.statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {migration.version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        logger.info('Схема БД обновлена до версии %s: %s', migration.version, migration.description)
@@ -0,0 +1,142 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+
+# Прагмы, которые применяются один раз при открытии соединения
+DEFAULT_PRAGMAS: Dict[str, str | int] = {
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -8000,  # ~8 МБ кэша страниц на соединение
+    'busy_timeout': 5000,
+    # Удаление пользователя каскадом удаляет его лайки, пропуски и модерацию (миграция 12)
+    'foreign_keys': 'ON',
+}
+
+
+@dataclass
+class PoolStats:
+    size: int
+    created: int
+    in_use: int
+    checkouts: int
+    waits: int
+    total_wait: float
+    max_wait: float
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.checkouts if self.checkouts else 0.0
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite.
+
+    Соединения создаются лениво (не больше ``size``), настраиваются прагмами
+    один раз и переиспользуются потоками executor'а.
+    """
+
+    def __init__(self, db_path: str | Path, size: int = 10,
+                 pragmas: Dict[str, str | int] | None = None, timeout: float = 30.0):
+        if size < 1:
+            raise ValueError('Размер пула должен быть не меньше 1')
+
+        self.db_path = Path(db_path)
+        self.size = size
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Взять соединение надолго (например, под транзакцию); вернуть через release"""
+        if self._closed:
+            raise sqlite3.ProgrammingError('Пул соединений закрыт')
+
+        started = time.perf_counter()
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if len(self._all) < self.size:
+                    conn = self._open()
+                    self._all.append(conn)
+            if conn is None:
+                # Все соединения заняты — ждём освобождения
+                conn = self._idle.get(timeout=self.timeout)
+                with self._lock:
+                    self._waits += 1
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+        if conn.in_transaction:
+            conn.rollback()
+        # Возвращаем соединению поведение «как после connect()»
+        conn.row_factory = None
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Выдать соединение из пула в рамках транзакции.
+
+        Как и ``with sqlite3.connect(...)``: commit при успехе, rollback при ошибке.
+        """
+        conn = self.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(
+                size=self.size,
+                created=len(self._all),
+                in_use=len(self._all) - self._idle.qsize(),
+                checkouts=self._checkouts,
+                waits=self._waits,
+                total_wait=self._total_wait,
+                max_wait=self._max_wait,
+            )
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._all.clear()
@@ -1,649 +1,1234 @@
 
 import asyncio
+import logging
 import sqlite3
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ..config import cfg
+from ..models import OPPOSITE_GENDER, Like, ModerationItem, ModerationOutcome, RowMapper, User
+from ..seen import SeenSet
+from .migrations import migrate
+from .pool import ConnectionPool, PoolStats
+from .transaction import Transaction
+from .writer import GroupCommitWriter, WriteFn
+
+logger = logging.getLogger(__name__)
+
+# Счётчики статистики (таблица stats_counters) и запросы для их полного пересчёта
+STATS_COUNT_QUERIES: Dict[str, str] = {
+    'total_users': 'SELECT COUNT(*) FROM users',
+    'active_users': 'SELECT COUNT(*) FROM users WHERE is_active = TRUE',
+    'users_with_photo': 'SELECT COUNT(*) FROM users WHERE photo_file_id IS NOT NULL',
+    'total_likes': 'SELECT COUNT(*) FROM likes',
+    'mutual_likes': 'SELECT COUNT(*) FROM likes WHERE is_mutual = TRUE',
+    'total_mod': 'SELECT COUNT(*) FROM moderation',
+    'pending_mod': "SELECT COUNT(*) FROM moderation WHERE status = 'pending'",
+}
+# Счётчики кэша решений модерации — ведутся в add_moderation, пересчёту не подлежат
+PHOTO_VERDICT_COUNTERS = ('photo_verdict_hits', 'photo_verdict_misses')
+
+
+def _first_unseen(conn: sqlite3.Connection, current_user_id: int, seen: Optional[SeenSet],
+                  where: str = '', params: Sequence[Any] = ()) -> Optional[User]:
+    """Самая новая активная анкета (кроме своей) по условию where, ещё не просмотренная.
+
+    С seen просмотренные отсеиваются в памяти по мере чтения id из индекса
+    по created_at; без него — прежними NOT EXISTS по likes и skips.
+    """
+    if seen is None:
+        conn.row_factory = RowMapper(User)
+        return conn.execute(f'''
+            SELECT u.*
+            FROM users u
+            WHERE u.is_active = TRUE
+            AND u.id != ?
+            AND NOT EXISTS (
+                SELECT 1
+                FROM likes l
+                WHERE l.from_user_id = ?
+                AND l.to_user_id = u.id
+            )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM skips s
+                WHERE s.from_user_id = ?
+                AND s.to_user_id = u.id
+            )
+            {where}
+            ORDER BY u.created_at DESC
+            LIMIT 1
+        ''', (current_user_id, current_user_id, current_user_id, *params)).fetchone()
+
+    select_ids = f'''
+        SELECT u.id
+        FROM users u
+        WHERE u.is_active = TRUE
+        AND u.id != ?
+        {where}
+        ORDER BY u.created_at DESC
+    '''
+    ids = _unseen_ids(conn, select_ids, (current_user_id, *params), seen, 1)
+    if not ids:
+        return None
+    conn.row_factory = RowMapper(User)
+    return conn.execute('SELECT * FROM users WHERE id = ?', (ids[0],)).fetchone()
+
+
+def _unseen_ids(conn: sqlite3.Connection, select_ids: str, params: Sequence[Any], seen: SeenSet,
+                limit: int, exclude: Sequence[int] = ()) -> List[int]:
+    """Первые limit id из упорядоченного запроса select_ids, которых нет в seen и exclude.
+
+    id берутся пачками растущего размера одной строкой group_concat: без
+    кортежа Python на каждую строку, членство проверяется сразу для всей пачки.
+    Подзапрос с LIMIT не сливается с агрегатом, поэтому порядок строк сохраняется.
+    """
+    conn.row_factory = None
+    excluded = np.array(sorted(set(exclude)), dtype=np.int64)
+    found: List[int] = []
+    offset, chunk = 0, max(256, 4 * limit)
+    while len(found) < limit:
+        (joined,) = conn.execute(
+            f'SELECT group_concat(id) FROM ({select_ids} LIMIT ? OFFSET ?)',
+            (*params, chunk, offset),
+        ).fetchone()
+        if not joined:
+            break
+        ids = np.fromstring(joined, dtype=np.int64, sep=',')
+        keep = ~seen.contains(ids)
+        if len(excluded):
+            keep &= ~np.isin(ids, excluded)
+        found.extend(ids[keep][:limit - len(found)].tolist())
+        offset += chunk
+        chunk *= 4
+    return found
+
+
+def _apply_decision(conn: sqlite3.Connection, item: ModerationItem) -> Optional[User]:
+    """Анкета после решения по item: при одобрении ставим фото и активируем"""
+    conn.row_factory = RowMapper(User)
+    cursor = conn.cursor()
+    if item.status == 'approved':
+        cursor.execute('''
+            UPDATE users
+            SET photo_file_id = ?, is_active = TRUE, version = version + 1
+            WHERE id = ?
+            RETURNING *
+        ''', (item.photo_file_id, item.user_id))
+    else:
+        cursor.execute('SELECT * FROM users WHERE id = ?', (item.user_id,))
+    users = cursor.fetchall()
+    return users[0] if users else None
 
 
 class SQLiteDatabase:
-    def __init__(self, db_path: str | Path | None = None):
+    def __init__(self, db_path: str | Path | None = None,
+                 pool_size: int | None = None, max_workers: int | None = None,
+                 wal: bool | None = None, group_commit: bool | None = None):
         base_dir = Path(__file__).resolve().parent.parent.parent
         self.db_path = Path(db_path) if db_path else base_dir / 'dating_bot.db'
-        self.executor = ThreadPoolExecutor(max_workers=10)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or cfg.db_executor_workers)
+        # Размер пула задаётся отдельно от executor'а: если соединений меньше,
+        # чем потоков, лишние потоки ждут освобождения (видно в pool_stats)
+        self.pool = ConnectionPool(self.db_path, size=pool_size or cfg.db_pool_size)
+
+        group_commit = cfg.db_group_commit if group_commit is None else group_commit
+        # Групповой коммит имеет смысл только в WAL: читатели не блокируют писателя
+        self.wal = group_commit or (cfg.db_wal if wal is None else wal)
         self.init_db()
 
+        self.writer: Optional[GroupCommitWriter] = None
+        if group_commit:
+            self.writer = GroupCommitWriter(self.db_path, window=cfg.db_group_commit_window)
 
+    def pool_stats(self) -> PoolStats:
+        """Статистика пула соединений (выдачи, ожидания)"""
+        return self.pool.stats()
 
-    async def delete_user(self, user_id: int) -> bool:
-        """Удалить пользователя по ID"""
+    def close(self):
+        """Остановить писателя, executor и закрыть все соединения пула"""
+        if self.writer:
+            self.writer.close()
+        self.executor.shutdown(wait=True)
+        self.pool.close()
 
-        def _delete():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+    def transaction(self) -> Transaction:
+        """Единица работы: ``async with db.transaction() as tx:``.
 
-                # Удаляем пользователя и все связанные данные (каскадное удаление)
-                cursor.execute('DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?',
-                               (user_id, user_id))
-                cursor.execute('DELETE FROM skips WHERE from_user_id = ? OR to_user_id = ?',
-                               (user_id, user_id))
-                cursor.execute('DELETE FROM moderation WHERE user_id = ?', (user_id,))
-                cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        Методы, вызванные с ``tx=tx``, выполняются в одной транзакции
+        и фиксируются одним COMMIT на выходе из блока (см. Transaction).
+        """
+        return Transaction(self.pool, self.executor)
 
-                conn.commit()
-                return cursor.rowcount > 0
+    async def _read(self, fn: WriteFn, tx: Optional[Transaction] = None) -> Any:
+        """Выполнить читающую операцию fn(conn): в транзакции tx или на соединении из пула"""
+        if tx is not None:
+            return await tx.run(fn)
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _delete)
+        def _run():
+            with self.pool.connection() as conn:
+                return fn(conn)
 
-    async def delete_user_by_tg_id(self, tg_id: int) -> bool:
-        """Удалить пользователя по Telegram ID"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, _run)
 
-        def _delete():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+    async def _write(self, fn: WriteFn, tx: Optional[Transaction] = None) -> Any:
+        """Выполнить пишущую операцию fn(conn).
 
-                # Сначала получаем ID пользователя
-                cursor.execute('SELECT id FROM users WHERE tg_id = ?', (tg_id,))
-                user = cursor.fetchone()
+        Внутри транзакции tx операция выполняется на её соединении и
+        фиксируется вместе с ней. Иначе с включённым групповым коммитом
+        операция уходит потоку-писателю, а без него выполняется в
+        executor'е на соединении из пула.
+        """
+        if tx is not None:
+            return await tx.run(fn)
 
-                if not user:
-                    return False
+        if self.writer:
+            return await self.writer.submit(fn)
 
-                user_id = user[0]
+        def _run():
+            with self.pool.connection() as conn:
+                # Блокировку записи берём сразу, а не при первом UPDATE:
+                # иначе параллельные транзакции видят устаревшие данные
+                conn.execute('BEGIN IMMEDIATE')
+                return fn(conn)
 
-                # Удаляем связанные данные
-                cursor.execute('DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?',
-                               (user_id, user_id))
-                cursor.execute('DELETE FROM skips WHERE from_user_id = ? OR to_user_id = ?',
-                               (user_id, user_id))
-                cursor.execute('DELETE FROM moderation WHERE user_id = ?', (user_id,))
-                cursor.execute('DELETE FROM users WHERE tg_id = ?', (tg_id,))
+        return await asyncio.get_event_loop().run_in_executor(self.executor, _run)
 
-                conn.commit()
-                return cursor.rowcount > 0
+    async def delete_user(self, user_id: int, tx: Optional[Transaction] = None) -> bool:
+        """Удалить пользователя по ID"""
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _delete)
+        def _delete(conn):
+            # Лайки, пропуски, модерация и seen_sets удаляются каскадом (миграция 12)
+            cursor = conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+            return cursor.rowcount > 0
 
+        return await self._write(_delete, tx)
 
+    async def delete_user_by_tg_id(self, tg_id: int, tx: Optional[Transaction] = None) -> bool:
+        """Удалить пользователя по Telegram ID"""
 
+        def _delete(conn):
+            cursor = conn.execute('DELETE FROM users WHERE tg_id = ?', (tg_id,))
+            return cursor.rowcount > 0
 
-    async def get_moderation_by_id(self, moderation_id: int) -> Optional[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('''
-                        SELECT m.*, u.name as user_name, u.tg_id as user_tg_id
-                        FROM moderation m
-                        JOIN users u ON m.user_id = u.id
-                        WHERE m.id = ?
-                    ''', (moderation_id,))
-                item = cursor.fetchone()
-                return dict(item) if item else None
-
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
+        return await self._write(_delete, tx)
 
-    async def get_pending_moderation_by_user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('''
-                        SELECT m.*, u.name as user_name, u.tg_id as user_tg_id
-                        FROM moderation m
-                        JOIN users u ON m.user_id = u.id
-                        WHERE m.user_id = ? AND m.status = 'pending'
-                        ORDER BY m.created_at DESC
-                        LIMIT 1
-                    ''', (user_id,))
-                item = cursor.fetchone()
-                return dict(item) if item else None
+    async def purge_abandoned_users(self, before: float, limit: int,
+                                    tx: Optional[Transaction] = None) -> List[tuple[int, int]]:
+        """Удалить до limit брошенных анкет, созданных раньше unix-времени before.
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
+        Брошенная анкета — без имени, неактивная и ни разу не прошедшая модерацию.
+        Возвращает (id, tg_id) удалённых; связанные строки удаляются каскадом.
+        """
 
+        def _purge(conn):
+            rows = conn.execute('''
+                DELETE FROM users
+                WHERE id IN (
+                    SELECT u.id FROM users u
+                    WHERE u.name = '' AND u.is_active = FALSE
+                    AND u.created_at < datetime(?, 'unixepoch')
+                    AND NOT EXISTS (
+                        SELECT 1 FROM moderation m
+                        WHERE m.user_id = u.id AND m.status = 'approved'
+                    )
+                    LIMIT ?
+                )
+                RETURNING id, tg_id
+            ''', (before, limit)).fetchall()
+            return [tuple(row) for row in rows]
 
+        return await self._write(_purge, tx)
 
-    # В класс SQLiteDatabase добавьте:
-    async def get_moderation_by_id(self, moderation_id: int) -> Optional[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('''
+    async def get_moderation_by_id(self, moderation_id: int, tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        def _get(conn):
+            conn.row_factory = RowMapper(ModerationItem)
+            cursor = conn.cursor()
+            cursor.execute('''
                     SELECT m.*, u.name as user_name, u.tg_id as user_tg_id
                     FROM moderation m
                     JOIN users u ON m.user_id = u.id
                     WHERE m.id = ?
                 ''', (moderation_id,))
-                item = cursor.fetchone()
-                return dict(item) if item else None
-
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
-
-    def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
+            return cursor.fetchone()
 
-        def _init():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+        return await self._read(_get, tx)
 
-                # Таблица пользователей
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        tg_id INTEGER UNIQUE NOT NULL,
-                        name TEXT NOT NULL DEFAULT '',
-                        age INTEGER,
-                        gender TEXT,
-                        photo_file_id TEXT,
-                        goal TEXT,
-                        description TEXT,
-                        is_active BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-                # Таблица лайков
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS likes (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        from_user_id INTEGER NOT NULL,
-                        to_user_id INTEGER NOT NULL,
-                        is_mutual BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (from_user_id) REFERENCES users (id),
-                        FOREIGN KEY (to_user_id) REFERENCES users (id),
-                        UNIQUE(from_user_id, to_user_id)
-                    )
-                ''')
-
-                # Таблица модерации
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS moderation (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        photo_file_id TEXT NOT NULL,
-                        status TEXT DEFAULT 'pending',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (id),
-                        UNIQUE(user_id, photo_file_id)
-                    )
-                ''')
-
-                # Таблица пропусков
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS skips (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        from_user_id INTEGER NOT NULL,
-                        to_user_id INTEGER NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (from_user_id) REFERENCES users (id),
-                        FOREIGN KEY (to_user_id) REFERENCES users (id),
-                        UNIQUE(from_user_id, to_user_id)
-                    )
-                ''')
-
-                conn.commit()
+    async def get_pending_moderation_by_user(self, user_id: int,
+                                             tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        def _get(conn):
+            conn.row_factory = RowMapper(ModerationItem)
+            cursor = conn.cursor()
+            cursor.execute('''
+                    SELECT m.*, u.name as user_name, u.tg_id as user_tg_id
+                    FROM moderation m
+                    JOIN users u ON m.user_id = u.id
+                    WHERE m.user_id = ? AND m.status = 'pending'
+                    ORDER BY m.created_at DESC
+                    LIMIT 1
+                ''', (user_id,))
+            return cursor.fetchone()
+
+        return await self._read(_get, tx)
+
+    # === Статистика ===
+
+    async def get_stats(self, tx: Optional[Transaction] = None) -> Dict[str, int]:
+        """Статистика бота из таблицы счётчиков — O(1) при любом размере таблиц"""
+
+        def _get(conn):
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, value FROM stats_counters')
+            stats = dict.fromkeys((*STATS_COUNT_QUERIES, *PHOTO_VERDICT_COUNTERS), 0)
+            stats.update(cursor.fetchall())
+            return stats
+
+        return await self._read(_get, tx)
+
+    async def recount_stats(self, tx: Optional[Transaction] = None) -> Dict[str, int]:
+        """Пересчитать счётчики по таблицам (исправляет расхождения)"""
+
+        def _recount(conn):
+            cursor = conn.cursor()
+            stats = {}
+            for name, query in STATS_COUNT_QUERIES.items():
+                cursor.execute(query)
+                stats[name] = cursor.fetchone()[0]
+            cursor.executemany(
+                'INSERT OR REPLACE INTO stats_counters (name, value) VALUES (?, ?)',
+                stats.items()
+            )
+            # Счётчики кэша модерации пересчитать нельзя — отдаём как есть
+            cursor.execute(
+                f"SELECT name, value FROM stats_counters WHERE name IN ({','.join('?' * len(PHOTO_VERDICT_COUNTERS))})",
+                PHOTO_VERDICT_COUNTERS
+            )
+            stats.update(dict.fromkeys(PHOTO_VERDICT_COUNTERS, 0), **dict(cursor.fetchall()))
+            return stats
+
+        return await self._write(_recount, tx)
+
+    async def add_pending_like(self, chat_id: int, now: float, tx: Optional[Transaction] = None) -> tuple[int, float]:
+        """Учесть лайк для дайджеста; вернуть (накоплено, момент первого лайка)"""
+
+        def _add(conn):
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO like_digests (chat_id, pending, first_at) VALUES (?, 1, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET pending = pending + 1
+                RETURNING pending, first_at
+            ''', (chat_id, now))
+            return tuple(cursor.fetchone())
+
+        return await self._write(_add, tx)
+
+    async def take_pending_likes(self, chat_id: int, tx: Optional[Transaction] = None) -> int:
+        """Забрать накопленные лайки получателя (счётчик обнуляется)"""
+
+        def _take(conn):
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM like_digests WHERE chat_id = ? RETURNING pending', (chat_id,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+
+        return await self._write(_take, tx)
+
+    async def load_fsm_state(self, key: str,
+                             tx: Optional[Transaction] = None) -> Optional[tuple[Optional[str], str, float]]:
+        """Состояние FSM по ключу: (state, data в JSON, updated_at)"""
+
+        def _get(conn):
+            cursor = conn.cursor()
+            cursor.execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,))
+            row = cursor.fetchone()
+            return tuple(row) if row else None
+
+        return await self._read(_get, tx)
+
+    async def save_fsm_states(self, rows: List[tuple[str, Optional[str], str, float]],
+                              expired_before: Optional[float] = None, tx: Optional[Transaction] = None):
+        """Записать пачку состояний одной транзакцией.
+
+        rows — (key, state, data, updated_at); пустые состояния удаляются.
+        Если задан expired_before, заодно удаляются строки, не менявшиеся с этого момента.
+        """
+
+        def _save(conn):
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            ''', [row for row in rows if row[1] is not None or row[2] != '{}'])
+            cursor.executemany(
+                'DELETE FROM fsm_states WHERE key = ?',
+                [(row[0],) for row in rows if row[1] is None and row[2] == '{}']
+            )
+            if expired_before is not None:
+                cursor.execute('DELETE FROM fsm_states WHERE updated_at < ?', (expired_before,))
+
+        await self._write(_save, tx)
+
+    async def get_pending_likes(self, tx: Optional[Transaction] = None) -> List[tuple[int, int, float]]:
+        """Все незавершённые дайджесты: (chat_id, накоплено, момент первого лайка)"""
+
+        def _get(conn):
+            cursor = conn.cursor()
+            cursor.execute('SELECT chat_id, pending, first_at FROM like_digests')
+            return [tuple(row) for row in cursor.fetchall()]
+
+        return await self._read(_get, tx)
 
-        loop = asyncio.get_event_loop()
-        loop.run_in_executor(self.executor, _init)
+    def init_db(self):
+        """Инициализация базы данных: применение миграций схемы"""
+
+        # Выполняем синхронно: схема должна существовать до первого запроса
+        with self.pool.connection() as conn:
+            if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+                # Режим auto_vacuum можно выбрать только до создания первой таблицы
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            elif conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                logger.warning('В %s выключен incremental auto_vacuum: место после чистки '
+                               'вернётся ОС только после ручного VACUUM', self.db_path)
+            if self.wal:
+                # Режим журнала сохраняется в самом файле БД
+                conn.execute('PRAGMA journal_mode = WAL')
+            migrate(conn)
 
     # === Пользователи ===
 
-    async def create_or_get_user(self, tg_id: int) -> Dict[str, Any]:
-        def _create_or_get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
-                # Проверяем, существует ли пользователь
-                cursor.execute('SELECT * FROM users WHERE tg_id = ?', (tg_id,))
-                user = cursor.fetchone()
-
-                if user:
-                    return dict(user)
-                else:
-                    # Создаем нового пользователя
-                    cursor.execute('''
-                        INSERT INTO users (tg_id, name, is_active)
-                        VALUES (?, '', FALSE)
-                    ''', (tg_id,))
-                    user_id = cursor.lastrowid
-
-                    # Получаем созданного пользователя
-                    cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-                    new_user = cursor.fetchone()
-                    conn.commit()
-                    return dict(new_user)
-
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _create_or_get)
-
-    async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-                user = cursor.fetchone()
-                return dict(user) if user else None
-
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
-
-    async def get_user_by_tg(self, tg_id: int) -> Optional[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM users WHERE tg_id = ?', (tg_id,))
-                user = cursor.fetchone()
-                return dict(user) if user else None
-
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
-
-    async def update_user(self, user_id: int, **kwargs):
-        def _update():
-            if not kwargs:
-                return
-
-            set_clause = ', '.join([f"{key} = ?" for key in kwargs.keys()])
-            values = list(kwargs.values())
-            values.append(user_id)
-
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(f'''
-                    UPDATE users 
-                    SET {set_clause}
-                    WHERE id = ?
-                ''', values)
-                conn.commit()
-
-        await asyncio.get_event_loop().run_in_executor(self.executor, _update)
-
-    async def get_all_active_users(self) -> List[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM users WHERE is_active = TRUE')
-                users = cursor.fetchall()
-                return [dict(user) for user in users]
-
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
-
-
-    async def add_like(self, from_user_id: int, to_user_id: int) -> Dict[str, Any]:
-        def _add():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
-                # Проверяем, существует ли уже такой лайк
-                cursor.execute('''
-                    SELECT * FROM likes 
+    async def create_or_get_user(self, tg_id: int, tx: Optional[Transaction] = None) -> User:
+        # Обычно пользователь уже есть — обходимся чтением без блокировки записи
+        user = await self.get_user_by_tg(tg_id, tx=tx)
+        if user:
+            return user
+
+        def _create(conn):
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
+
+            # Создаем нового пользователя (или берём созданного параллельно)
+            cursor.execute('''
+                INSERT INTO users (tg_id, name, is_active)
+                VALUES (?, '', FALSE)
+                ON CONFLICT (tg_id) DO NOTHING
+            ''', (tg_id,))
+
+            cursor.execute('SELECT * FROM users WHERE tg_id = ?', (tg_id,))
+            return cursor.fetchone()
+
+        return await self._write(_create, tx)
+
+    async def get_user_by_id(self, user_id: int, tx: Optional[Transaction] = None) -> Optional[User]:
+        def _get(conn):
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+            return cursor.fetchone()
+
+        return await self._read(_get, tx)
+
+    async def get_user_by_tg(self, tg_id: int, tx: Optional[Transaction] = None) -> Optional[User]:
+        def _get(conn):
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE tg_id = ?', (tg_id,))
+            return cursor.fetchone()
+
+        return await self._read(_get, tx)
+
+    async def get_user_pair(self, tg_id: int, user_id: int,
+                            tx: Optional[Transaction] = None) -> tuple[Optional[User], Optional[User]]:
+        """Получить пользователя по tg_id и собеседника по id одним запросом"""
+
+        def _get(conn):
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE tg_id = ? OR id = ?', (tg_id, user_id))
+            rows = cursor.fetchall()
+
+            by_tg = next((row for row in rows if row.tg_id == tg_id), None)
+            by_id = next((row for row in rows if row.id == user_id), None)
+            return by_tg, by_id
+
+        return await self._read(_get, tx)
+
+    async def update_user(self, user_id: int, expected_version: Optional[int] = None,
+                          tx: Optional[Transaction] = None, **kwargs) -> bool:
+        """Обновить переданные колонки и увеличить version.
+
+        Если задан expected_version, строка обновляется только при совпадении
+        версии; возвращает False, если обновлять было нечего.
+        """
+        if not kwargs:
+            return True
+
+        set_clause = ', '.join([f"{key} = ?" for key in kwargs.keys()])
+        values = list(kwargs.values())
+        values.append(user_id)
+        where = 'id = ?'
+        if expected_version is not None:
+            where += ' AND version = ?'
+            values.append(expected_version)
+
+        def _update(conn):
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE users 
+                SET {set_clause}, version = version + 1
+                WHERE {where}
+            ''', values)
+            return cursor.rowcount > 0
+
+        return await self._write(_update, tx)
+
+    async def get_all_active_users(self, tx: Optional[Transaction] = None) -> List[User]:
+        def _get(conn):
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE is_active = TRUE')
+            return cursor.fetchall()
+
+        return await self._read(_get, tx)
+
+
+    async def add_like(self, from_user_id: int, to_user_id: int, tx: Optional[Transaction] = None) -> tuple[bool, bool]:
+        """Поставить лайк и сразу определить взаимность.
+
+        Возвращает (created, is_mutual); created=False, если лайк уже был.
+        Вся операция — одна транзакция с блокировкой записи, взятой заранее,
+        поэтому при одновременных встречных лайках матч увидит второй из них.
+        """
+
+        def _add(conn):
+            cursor = conn.cursor()
+
+            # Взаимность вычисляется прямо в INSERT по наличию встречного лайка
+            cursor.execute('''
+                INSERT INTO likes (from_user_id, to_user_id, is_mutual)
+                VALUES (?, ?, EXISTS (
+                    SELECT 1 FROM likes
                     WHERE from_user_id = ? AND to_user_id = ?
-                ''', (from_user_id, to_user_id))
-
-                existing_like = cursor.fetchone()
-
-                if existing_like:
-                    return dict(existing_like)
-
-                # Создаем новый лайк
+                ))
+                ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+                RETURNING is_mutual
+            ''', (from_user_id, to_user_id, to_user_id, from_user_id))
+            inserted = cursor.fetchone()
+
+            if inserted is None:
+                # Лайк уже существовал
                 cursor.execute('''
-                    INSERT INTO likes (from_user_id, to_user_id, is_mutual)
-                    VALUES (?, ?, FALSE)
+                    SELECT is_mutual FROM likes
+                    WHERE from_user_id = ? AND to_user_id = ?
                 ''', (from_user_id, to_user_id))
+                return False, bool(cursor.fetchone()[0])
 
-                like_id = cursor.lastrowid
-
-                # Проверяем на взаимный лайк
+            is_mutual = bool(inserted[0])
+            if is_mutual:
+                # Помечаем встречный лайк как взаимный
                 cursor.execute('''
-                    SELECT * FROM likes 
+                    UPDATE likes
+                    SET is_mutual = TRUE
                     WHERE from_user_id = ? AND to_user_id = ?
                 ''', (to_user_id, from_user_id))
 
-                mutual_like = cursor.fetchone()
-
-                if mutual_like:
-                    # Обновляем оба лайка как взаимные
-                    cursor.execute('''
-                        UPDATE likes 
-                        SET is_mutual = TRUE 
-                        WHERE id IN (?, ?)
-                    ''', (like_id, mutual_like['id']))
-
-                # Получаем созданный лайк
-                cursor.execute('SELECT * FROM likes WHERE id = ?', (like_id,))
-                new_like = cursor.fetchone()
-                conn.commit()
-                return dict(new_like)
+            return True, is_mutual
+
+        return await self._write(_add, tx)
+
+    async def add_skip(self, from_user_id: int, to_user_id: int, tx: Optional[Transaction] = None) -> None:
+        def _add(conn):
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR IGNORE INTO skips (from_user_id, to_user_id)
+                VALUES (?, ?)
+            ''', (from_user_id, to_user_id))
+
+        await self._write(_add, tx)
+
+    async def has_liked(self, from_user_id: int, to_user_id: int, tx: Optional[Transaction] = None) -> bool:
+        def _check(conn):
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 1 FROM likes 
+                WHERE from_user_id = ? AND to_user_id = ?
+            ''', (from_user_id, to_user_id))
+            return cursor.fetchone() is not None
+
+        return await self._read(_check, tx)
+
+    async def get_likes_to_user(self, user_id: int, tx: Optional[Transaction] = None) -> List[Like]:
+        def _get(conn):
+            conn.row_factory = RowMapper(Like)
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT l.*
+                FROM likes l
+                JOIN users u ON l.from_user_id = u.id
+                WHERE l.to_user_id = ?
+                ORDER BY l.created_at DESC
+            ''', (user_id,))
+            return cursor.fetchall()
+
+        return await self._read(_get, tx)
+
+
+    async def get_unanswered_likes(self, user_id: int, limit: int,
+                                   before: tuple[str, int] | None = None,
+                                   tx: Optional[Transaction] = None) -> List[tuple[User, int, str]]:
+        """Страница входящих лайков, на которые пользователь ещё не ответил.
+
+        Каждая строка — (анкета лайкнувшего, like_id, like_created_at);
+        id и время лайка — курсор для следующей страницы. Страницы идут
+        от новых к старым по ключу (created_at, id).
+        """
+
+        def _get(conn):
+            conn.row_factory = RowMapper(User, extras=('like_id', 'like_created_at'))
+            cursor = conn.cursor()
+
+            query = '''
+                SELECT u.*, l.id AS like_id, l.created_at AS like_created_at
+                FROM likes l
+                JOIN users u ON u.id = l.from_user_id
+                WHERE l.to_user_id = ?
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM likes r
+                    WHERE r.from_user_id = l.to_user_id
+                    AND r.to_user_id = l.from_user_id
+                )
+            '''
+            params: List[Any] = [user_id]
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _add)
+            if before:
+                query += ' AND (l.created_at, l.id) < (?, ?)'
+                params.extend(before)
 
-    async def add_skip(self, from_user_id: int, to_user_id: int) -> None:
-        def _add():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR IGNORE INTO skips (from_user_id, to_user_id)
-                    VALUES (?, ?)
-                ''', (from_user_id, to_user_id))
-                conn.commit()
+            query += ' ORDER BY l.created_at DESC, l.id DESC LIMIT ?'
+            params.append(limit)
 
-        await asyncio.get_event_loop().run_in_executor(self.executor, _add)
+            cursor.execute(query, params)
+            return cursor.fetchall()
 
-    async def has_liked(self, from_user_id: int, to_user_id: int) -> bool:
-        def _check():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT 1 FROM likes 
-                    WHERE from_user_id = ? AND to_user_id = ?
-                ''', (from_user_id, to_user_id))
-                return cursor.fetchone() is not None
+        return await self._read(_get, tx)
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _check)
+    async def add_moderation(self, user_id: int, photo_file_id: str, photo_unique_id: Optional[str] = None,
+                             tx: Optional[Transaction] = None) -> Optional[ModerationOutcome]:
+        """Поставить фото в очередь модерации.
 
-    async def get_likes_to_user(self, user_id: int) -> List[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT l.*, u.name as from_user_name, u.age as from_user_age
-                    FROM likes l
-                    JOIN users u ON l.from_user_id = u.id
-                    WHERE l.to_user_id = ?
-                    ORDER BY l.created_at DESC
-                ''', (user_id,))
+        Если по этому file_unique_id уже есть решение (отклонение — для любого
+        пользователя, одобрение — для того же), запись сразу создаётся решённой
+        и возвращается ModerationOutcome; иначе фото ждёт админа и результат None.
+        """
 
-                likes = cursor.fetchall()
-                return [dict(like) for like in likes]
+        def _add(conn):
+            cursor = conn.cursor()
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
+            # Сначала проверяем, есть ли уже такая запись
+            cursor.execute('''
+                SELECT 1 FROM moderation 
+                WHERE user_id = ? AND photo_file_id = ? AND status = 'pending'
+            ''', (user_id, photo_file_id))
 
+            if cursor.fetchone():
+                return None  # Уже есть ожидающая модерации запись
 
-    async def add_moderation(self, user_id: int, photo_file_id: str):
-        def _add():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            verdict = None
+            if photo_unique_id:
+                cursor.execute(
+                    'SELECT status, user_id FROM photo_verdicts WHERE photo_unique_id = ?',
+                    (photo_unique_id,)
+                )
+                row = cursor.fetchone()
+                if row and (row[0] == 'rejected' or row[1] == user_id):
+                    verdict = row[0]
+                cursor.execute(
+                    'UPDATE stats_counters SET value = value + 1 WHERE name = ?',
+                    (PHOTO_VERDICT_COUNTERS[0] if verdict else PHOTO_VERDICT_COUNTERS[1],)
+                )
 
-                # Сначала проверяем, есть ли уже такая запись
+            # Тот же file_id этого пользователя уже решали (UNIQUE(user_id, photo_file_id)) —
+            # переиспользуем запись, а не вставляем вторую
+            if verdict is None:
                 cursor.execute('''
-                    SELECT 1 FROM moderation 
-                    WHERE user_id = ? AND photo_file_id = ? AND status = 'pending'
-                ''', (user_id, photo_file_id))
-
-                if cursor.fetchone():
-                    return  # Уже есть ожидающая модерации запись
+                    INSERT INTO moderation (user_id, photo_file_id, photo_unique_id, status)
+                    VALUES (?, ?, ?, 'pending')
+                    ON CONFLICT (user_id, photo_file_id) DO UPDATE SET
+                        status = 'pending',
+                        photo_unique_id = COALESCE(excluded.photo_unique_id, photo_unique_id),
+                        created_at = CURRENT_TIMESTAMP,
+                        decided_by = NULL, decided_at = NULL,
+                        claimed_by = NULL, claimed_until = NULL
+                ''', (user_id, photo_file_id, photo_unique_id))
+                return None
 
-                # Добавляем новую запись
+            # Решение из кэша: decided_by остаётся пустым — админ не участвовал
+            conn.row_factory = RowMapper(ModerationItem)
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO moderation (user_id, photo_file_id, photo_unique_id, status, decided_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (user_id, photo_file_id) DO UPDATE SET
+                    status = excluded.status,
+                    photo_unique_id = excluded.photo_unique_id,
+                    decided_by = NULL, decided_at = excluded.decided_at,
+                    claimed_by = NULL, claimed_until = NULL
+                RETURNING *
+            ''', (user_id, photo_file_id, photo_unique_id, verdict))
+            item = cursor.fetchall()[0]
+            return ModerationOutcome(item, _apply_decision(conn, item), True)
+
+        return await self._write(_add, tx)
+
+    async def get_pending_moderation(self, tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        def _get(conn):
+            conn.row_factory = RowMapper(ModerationItem)
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT m.*, u.name as user_name, u.tg_id as user_tg_id
+                FROM moderation m
+                JOIN users u ON m.user_id = u.id
+                WHERE m.status = 'pending'
+                ORDER BY m.created_at ASC
+                LIMIT 1
+            ''')
+            return cursor.fetchone()
+
+        return await self._read(_get, tx)
+
+    async def set_moderation_status(self, user_id: int, photo_file_id: str, status: str,
+                                    tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        def _set(conn):
+            conn.row_factory = RowMapper(ModerationItem)
+            cursor = conn.cursor()
+
+            # Находим ожидающую модерацию запись для данного фото
+            cursor.execute('''
+                SELECT * FROM moderation 
+                WHERE user_id = ? AND photo_file_id = ? AND status = 'pending'
+                ORDER BY created_at DESC
+                LIMIT 1
+            ''', (user_id, photo_file_id))
+
+            item = cursor.fetchone()
+
+            if item:
+                # Обновляем статус
                 cursor.execute('''
-                    INSERT INTO moderation (user_id, photo_file_id, status)
-                    VALUES (?, ?, 'pending')
-                ''', (user_id, photo_file_id))
-                conn.commit()
-
-        await asyncio.get_event_loop().run_in_executor(self.executor, _add)
-
-    async def get_pending_moderation(self) -> Optional[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT m.*, u.name as user_name, u.tg_id as user_tg_id
-                    FROM moderation m
-                    JOIN users u ON m.user_id = u.id
-                    WHERE m.status = 'pending'
-                    ORDER BY m.created_at ASC
-                    LIMIT 1
-                ''')
-
+                    UPDATE moderation 
+                    SET status = ?
+                    WHERE id = ?
+                ''', (status, item.id))
+
+                # Получаем обновленную запись
+                cursor.execute('SELECT * FROM moderation WHERE id = ?', (item.id,))
+                return cursor.fetchone()
+
+            return None
+
+        return await self._write(_set, tx)
+
+    async def decide_moderation(self, moderation_id: int, status: str, admin_id: int,
+                                now: Optional[float] = None,
+                                tx: Optional[Transaction] = None) -> ModerationOutcome:
+        """Перевести ожидающую запись в status ('approved'/'rejected') ровно один раз.
+
+        Условный UPDATE ... WHERE status = 'pending' делает повторные вызовы
+        пустыми (applied=False). Закреплённую запись решает только её админ
+        и только пока аренда не истекла (на unix-время now): иначе applied=False
+        и lost=True — запись могли перехватить. При одобрении в той же
+        транзакции фото ставится в анкету и она активируется; решение
+        запоминается в photo_verdicts по file_unique_id.
+        """
+        now = time.time() if now is None else now
+
+        def _decide(conn):
+            conn.row_factory = RowMapper(ModerationItem)
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE moderation
+                SET status = ?, decided_by = ?, decided_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'pending'
+                  AND (claimed_by IS NULL OR claimed_by = ? AND claimed_until >= ?)
+                RETURNING *
+            ''', (status, admin_id, moderation_id, admin_id, now))
+            decided = cursor.fetchall()
+
+            if not decided:
+                cursor.execute('SELECT * FROM moderation WHERE id = ?', (moderation_id,))
                 item = cursor.fetchone()
-                return dict(item) if item else None
-
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
+                # Всё ещё ждёт решения — значит, не прошла проверка аренды
+                return ModerationOutcome(item, None, False, lost=item is not None and item.status == 'pending')
 
-    async def set_moderation_status(self, user_id: int, photo_file_id: str, status: str) -> Optional[Dict[str, Any]]:
-        def _set():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
-                # Находим ожидающую модерацию запись для данного фото
+            item = decided[0]
+            if item.photo_unique_id:
+                # Запоминаем решение: это же фото повторно решится без админа
                 cursor.execute('''
-                    SELECT * FROM moderation 
-                    WHERE user_id = ? AND photo_file_id = ? AND status = 'pending'
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                ''', (user_id, photo_file_id))
-
-                item = cursor.fetchone()
-
-                if item:
-                    # Обновляем статус
-                    cursor.execute('''
-                        UPDATE moderation 
-                        SET status = ?
-                        WHERE id = ?
-                    ''', (status, item['id']))
-
-                    # Получаем обновленную запись
-                    cursor.execute('SELECT * FROM moderation WHERE id = ?', (item['id'],))
-                    updated_item = cursor.fetchone()
-                    conn.commit()
-                    return dict(updated_item)
-
+                    INSERT INTO photo_verdicts (photo_unique_id, status, user_id)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (photo_unique_id) DO UPDATE SET
+                        status = excluded.status,
+                        user_id = excluded.user_id,
+                        decided_at = CURRENT_TIMESTAMP
+                ''', (item.photo_unique_id, status, item.user_id))
+
+            return ModerationOutcome(item, _apply_decision(conn, item), True)
+
+        return await self._write(_decide, tx)
+
+    async def claim_moderation_batch(self, admin_id: int, limit: int, lease: float, now: float,
+                                     tx: Optional[Transaction] = None) -> List[tuple[ModerationItem, Optional[User]]]:
+        """Закрепить за админом до limit самых старых ожидающих записей до now + lease.
+
+        Выбор и закрепление — один UPDATE, поэтому два админа не получат одну
+        запись. Берутся свободные, с истёкшей арендой и уже закреплённые за этим
+        админом (повторное открытие той же пачки продлевает аренду).
+        """
+
+        def _claim(conn):
+            conn.row_factory = RowMapper(ModerationItem)
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE moderation
+                SET claimed_by = ?, claimed_until = ?
+                WHERE id IN (
+                    SELECT id FROM moderation
+                    WHERE status = 'pending'
+                      AND (claimed_until IS NULL OR claimed_until < ? OR claimed_by = ?)
+                    ORDER BY created_at, id
+                    LIMIT ?
+                )
+                RETURNING *
+            ''', (admin_id, now + lease, now, admin_id, limit))
+            # Порядок строк RETURNING не гарантирован
+            items = sorted(cursor.fetchall(), key=lambda item: (item.created_at, item.id))
+            if not items:
+                return []
+
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
+            user_ids = list({item.user_id for item in items})
+            placeholders = ','.join('?' * len(user_ids))
+            cursor.execute(f'SELECT * FROM users WHERE id IN ({placeholders})', user_ids)
+            users = {user.id: user for user in cursor.fetchall()}
+
+            return [(item, users.get(item.user_id)) for item in items]
+
+        return await self._write(_claim, tx)
+
+    async def release_moderation_claims(self, moderation_ids: List[int], admin_id: int,
+                                        tx: Optional[Transaction] = None) -> int:
+        """Вернуть в очередь нерешённые записи, закреплённые за админом"""
+        if not moderation_ids:
+            return 0
+
+        def _release(conn):
+            placeholders = ','.join('?' * len(moderation_ids))
+            cursor = conn.execute(f'''
+                UPDATE moderation
+                SET claimed_by = NULL, claimed_until = NULL
+                WHERE id IN ({placeholders}) AND claimed_by = ? AND status = 'pending'
+            ''', (*moderation_ids, admin_id))
+            return cursor.rowcount
+
+        return await self._write(_release, tx)
+
+    async def get_user_moderation_status(self, user_id: int, tx: Optional[Transaction] = None) -> Optional[str]:
+        def _get(conn):
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT status FROM moderation 
+                WHERE user_id = ? 
+                ORDER BY created_at DESC 
+                LIMIT 1
+            ''', (user_id,))
+
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+        return await self._read(_get, tx)
+
+    async def get_moderation_by_user_and_photo(self, user_id: int, photo_file_id: str,
+                                               tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        def _get(conn):
+            conn.row_factory = RowMapper(ModerationItem)
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM moderation 
+                WHERE user_id = ? AND photo_file_id = ?
+                ORDER BY created_at DESC
+                LIMIT 1
+            ''', (user_id, photo_file_id))
+            return cursor.fetchone()
+
+        return await self._read(_get, tx)
+
+    async def update_user_photo(self, user_id: int, photo_file_id: str, tx: Optional[Transaction] = None):
+        def _update(conn):
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE users 
+                SET photo_file_id = ?, is_active = TRUE, version = version + 1
+                WHERE id = ?
+            ''', (photo_file_id, user_id))
+
+        await self._write(_update, tx)
+
+    async def get_any_candidate(self, current_user_id: int, seen: Optional[SeenSet] = None,
+                                tx: Optional[Transaction] = None) -> Optional[User]:
+        """Получить любого активного кандидата (просмотренные — из seen, если передано)"""
+
+        def _get(conn):
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
+
+            # Получаем текущего пользователя
+            cursor.execute(
+                'SELECT * FROM users WHERE id = ? AND is_active = TRUE',
+                (current_user_id,)
+            )
+            current_user = cursor.fetchone()
+
+            if not current_user:
                 return None
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _set)
+            target_gender = OPPOSITE_GENDER.get(current_user.gender)
 
-    async def get_user_moderation_status(self, user_id: int) -> Optional[str]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT status FROM moderation 
-                    WHERE user_id = ? 
-                    ORDER BY created_at DESC 
-                    LIMIT 1
-                ''', (user_id,))
+            candidate = None
+            # Фильтр по полу
+            if target_gender:
+                candidate = _first_unseen(conn, current_user_id, seen, 'AND u.gender = ?', [target_gender])
 
-                result = cursor.fetchone()
-                return result[0] if result else None
+            # Если не нашли с учетом пола, ищем любого
+            if not candidate:
+                candidate = _first_unseen(conn, current_user_id, seen)
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
+            return candidate
 
-    async def get_moderation_by_user_and_photo(self, user_id: int, photo_file_id: str) -> Optional[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT * FROM moderation 
-                    WHERE user_id = ? AND photo_file_id = ?
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                ''', (user_id, photo_file_id))
+        return await self._read(_get, tx)
 
-                item = cursor.fetchone()
-                return dict(item) if item else None
+    async def get_next_candidate(self, current_user_id: int, seen: Optional[SeenSet] = None,
+                                 tx: Optional[Transaction] = None) -> Optional[User]:
+        def _get(conn):
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
+            # Получаем текущего пользователя
+            cursor.execute(
+                'SELECT * FROM users WHERE id = ? AND is_active = TRUE',
+                (current_user_id,)
+            )
+            current_user = cursor.fetchone()
 
-    async def update_user_photo(self, user_id: int, photo_file_id: str):
-        def _update():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE users 
-                    SET photo_file_id = ?, is_active = TRUE
-                    WHERE id = ?
-                ''', (photo_file_id, user_id))
-                conn.commit()
+            if not current_user:
+                return None
 
-        await asyncio.get_event_loop().run_in_executor(self.executor, _update)
+            # Фильтр по полу (показываем противоположный пол)
+            target_gender = OPPOSITE_GENDER.get(current_user.gender)
+            where, params = ('AND u.gender = ?', [target_gender]) if target_gender else ('', [])
 
-    async def get_any_candidate(self, current_user_id: int) -> Optional[Dict[str, Any]]:
-        """Получить любого активного кандидата"""
+            # Сначала показываем пользователей с той же целью, потом всех остальных.
+            # Вместо ORDER BY CASE делаем два запроса: так порядок по created_at
+            # берётся из частичного индекса и поиск останавливается на первой строке
+            goal = current_user.goal or ''
 
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
+            candidate = _first_unseen(conn, current_user_id, seen, where + ' AND u.goal = ?', params + [goal])
 
-                # Получаем текущего пользователя
-                cursor.execute(
-                    'SELECT * FROM users WHERE id = ? AND is_active = TRUE',
-                    (current_user_id,)
+            if not candidate:
+                candidate = _first_unseen(
+                    conn, current_user_id, seen,
+                    where + ' AND (u.goal IS NULL OR u.goal != ?)', params + [goal]
                 )
-                current_user = cursor.fetchone()
-
-                if not current_user:
-                    return None
-
-                current_gender = current_user['gender']
 
-                # Базовый запрос
-                query = '''
-                    SELECT u.*
-                    FROM users u
-                    WHERE u.is_active = TRUE
-                    AND u.id != ?
-                    AND NOT EXISTS (
-                        SELECT 1
-                        FROM likes l
-                        WHERE l.from_user_id = ?
-                        AND l.to_user_id = u.id
-                    )
-                    AND NOT EXISTS (
-                        SELECT 1
-                        FROM skips s
-                        WHERE s.from_user_id = ?
-                        AND s.to_user_id = u.id
-                    )
-                '''
-
-                params = [current_user_id, current_user_id, current_user_id]
-
-                # Фильтр по полу
-                if current_gender == 'Мужской':
-                    query += ' AND u.gender = ?'
-                    params.append('Женский')
-                elif current_gender == 'Женский':
-                    query += ' AND u.gender = ?'
-                    params.append('Мужской')
-
-                query += ' ORDER BY u.created_at DESC LIMIT 1'
-
-                cursor.execute(query, params)
-                candidate = cursor.fetchone()
-
-                # Если не нашли с учетом пола, ищем любого
-                if not candidate:
-                    cursor.execute('''
-                        SELECT u.*
+            return candidate
+
+        return await self._read(_get, tx)
+
+    async def get_profile_rows(self, user_ids: Optional[List[int]] = None,
+                               tx: Optional[Transaction] = None) -> List[tuple]:
+        """Колонки для индекса анкет: (id, gender, goal, age, created_at в unix time).
+
+        Только активные анкеты; user_ids=None — все.
+        """
+
+        def _get(conn):
+            query = '''
+                SELECT id, gender, goal, age, CAST(strftime('%s', created_at) AS REAL)
+                FROM users
+                WHERE is_active = TRUE
+            '''
+            if user_ids is None:
+                return conn.execute(query).fetchall()
+
+            rows = []
+            # Не упираемся в лимит параметров SQLite на больших пачках
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                rows += conn.execute(f'{query} AND id IN ({",".join("?" * len(chunk))})', chunk).fetchall()
+            return rows
+
+        return await self._read(_get, tx)
+
+    async def load_seen_set(self, user_id: int,
+                            tx: Optional[Transaction] = None) -> tuple[bytes, List[int], int, int]:
+        """Просмотренные анкеты: (BLOB из seen_sets, id свайпов после него, метка лайков, метка пропусков)"""
+
+        def _load(conn):
+            cursor = conn.execute(
+                'SELECT ids, like_mark, skip_mark FROM seen_sets WHERE user_id = ?', (user_id,)
+            )
+            blob, like_mark, skip_mark = cursor.fetchone() or (b'', 0, 0)
+
+            likes = conn.execute(
+                'SELECT id, to_user_id FROM likes WHERE from_user_id = ? AND id > ? ORDER BY id',
+                (user_id, like_mark)
+            ).fetchall()
+            skips = conn.execute(
+                'SELECT id, to_user_id FROM skips WHERE from_user_id = ? AND id > ? ORDER BY id',
+                (user_id, skip_mark)
+            ).fetchall()
+
+            delta = [row[1] for row in likes] + [row[1] for row in skips]
+            if likes:
+                like_mark = likes[-1][0]
+            if skips:
+                skip_mark = skips[-1][0]
+
+            return blob, delta, like_mark, skip_mark
+
+        return await self._read(_load, tx)
+
+    async def store_seen_set(self, user_id: int, blob: bytes, like_mark: int, skip_mark: int,
+                             tx: Optional[Transaction] = None):
+        """Записать сжатое множество просмотренных (только если оно не старее записанного)"""
+
+        def _store(conn):
+            conn.execute('''
+                INSERT INTO seen_sets (user_id, ids, like_mark, skip_mark)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    ids = excluded.ids,
+                    like_mark = excluded.like_mark,
+                    skip_mark = excluded.skip_mark
+                WHERE excluded.like_mark >= seen_sets.like_mark
+                  AND excluded.skip_mark >= seen_sets.skip_mark
+            ''', (user_id, blob, like_mark, skip_mark))
+
+        await self._write(_store, tx)
+
+    # === Хранение ===
+
+    async def expire_skips(self, before: float, limit: int,
+                           tx: Optional[Transaction] = None) -> tuple[int, List[int]]:
+        """Удалить до limit пропусков, сделанных раньше unix-времени before.
+
+        Возвращает (сколько удалено, чьи пропуски). Сжатые множества этих
+        пользователей тоже удаляются — они пересоберутся из likes и skips.
+        """
+
+        def _expire(conn):
+            # Короткая транзакция на пачку: писатели ждут не дольше одной пачки
+            rows = conn.execute('''
+                DELETE FROM skips
+                WHERE id IN (
+                    SELECT id FROM skips
+                    WHERE created_at < datetime(?, 'unixepoch')
+                    LIMIT ?
+                )
+                RETURNING from_user_id
+            ''', (before, limit)).fetchall()
+
+            user_ids = sorted({row[0] for row in rows})
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                conn.execute(f'DELETE FROM seen_sets WHERE user_id IN ({",".join("?" * len(chunk))})', chunk)
+            return len(rows), user_ids
+
+        return await self._write(_expire, tx)
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Вернуть ОС до pages свободных страниц; сколько вернули.
+
+        Работает только в базах с auto_vacuum = INCREMENTAL (см. init_db).
+        """
+
+        if pages <= 0:
+            # incremental_vacuum(0) освободил бы все страницы разом
+            return 0
+
+        def _vacuum():
+            with self.pool.connection() as conn:
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    return 0
+                free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                # Прагма отдаёт по строке без колонок на каждую страницу, а execute/fetchall
+                # у таких запросов делают один шаг (одна страница). executescript шагает
+                # до конца — вся работа одним вызовом, в своей короткой транзакции
+                conn.executescript(f'PRAGMA incremental_vacuum({int(pages)})')
+                return free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+        return await asyncio.get_event_loop().run_in_executor(self.executor, _vacuum)
+
+    async def get_active_users_by_ids(self, user_ids: List[int], tx: Optional[Transaction] = None) -> List[User]:
+        """Активные анкеты по списку id в том же порядке (неактивные пропускаются)"""
+        if not user_ids:
+            return []
+
+        def _get(conn):
+            conn.row_factory = RowMapper(User)
+            cursor = conn.execute(
+                f'SELECT * FROM users WHERE is_active = TRUE AND id IN ({",".join("?" * len(user_ids))})',
+                user_ids
+            )
+            users = {user.id: user for user in cursor.fetchall()}
+            return [users[user_id] for user_id in user_ids if user_id in users]
+
+        return await self._read(_get, tx)
+
+    async def get_candidates(self, current_user_id: int, limit: int,
+                             exclude_ids: List[int] | None = None, seen: Optional[SeenSet] = None,
+                             tx: Optional[Transaction] = None) -> List[User]:
+        """Получить сразу limit кандидатов в порядке показа одним запросом.
+
+        Порядок совпадает с последовательными вызовами get_next_candidate и
+        get_any_candidate: сначала противоположный пол (та же цель впереди),
+        затем все остальные анкеты, новые первыми. С seen просмотренные и
+        exclude_ids отсеиваются в памяти, как в get_next_candidate.
+        """
+        exclude_ids = list(exclude_ids or [])
+
+        def _get(conn):
+            cursor = conn.cursor()
+
+            cursor.execute(
+                'SELECT gender, goal FROM users WHERE id = ? AND is_active = TRUE',
+                (current_user_id,)
+            )
+            current_user = cursor.fetchone()
+
+            if not current_user:
+                return []
+            gender, goal = current_user
+
+            goal = goal or ''
+            target_gender = OPPOSITE_GENDER.get(gender)
+
+            if seen is not None:
+                # Без NOT EXISTS и NOT IN: группы порядка показа читаются по
+                # очереди отдельными запросами (как в get_next_candidate —
+                # порядок по created_at из частичных индексов, без сортировки
+                # всех анкет), id фильтруются по множеству, затем анкеты — по id
+                if target_gender:
+                    groups = [
+                        ('AND u.gender = ? AND u.goal = ?', [target_gender, goal]),
+                        ('AND u.gender = ? AND (u.goal IS NULL OR u.goal != ?)', [target_gender, goal]),
+                        ('AND (u.gender IS NULL OR u.gender != ?)', [target_gender]),
+                    ]
+                else:
+                    groups = [
+                        ('AND u.goal = ?', [goal]),
+                        ('AND (u.goal IS NULL OR u.goal != ?)', [goal]),
+                    ]
+                ids: List[int] = []
+                for where, where_params in groups:
+                    select_ids = f'''
+                        SELECT u.id
                         FROM users u
                         WHERE u.is_active = TRUE
                         AND u.id != ?
-                        AND NOT EXISTS (
-                            SELECT 1
-                            FROM likes l
-                            WHERE l.from_user_id = ?
-                            AND l.to_user_id = u.id
-                        )
-                        AND NOT EXISTS (
-                            SELECT 1
-                            FROM skips s
-                            WHERE s.from_user_id = ?
-                            AND s.to_user_id = u.id
-                        )
+                        {where}
                         ORDER BY u.created_at DESC
-                        LIMIT 1
-                    ''', (current_user_id, current_user_id, current_user_id))
-                    candidate = cursor.fetchone()
-
-                return dict(candidate) if candidate else None
-
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
-
-    # Поиск кандидатов
-    async def get_next_candidate(self, current_user_id: int) -> Optional[Dict[str, Any]]:
-        def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
-                # Получаем текущего пользователя
-                cursor.execute(
-                    'SELECT * FROM users WHERE id = ? AND is_active = TRUE',
-                    (current_user_id,)
+                    '''
+                    ids += _unseen_ids(conn, select_ids, [current_user_id, *where_params], seen,
+                                       limit - len(ids), exclude_ids)
+                    if len(ids) >= limit:
+                        break
+                if not ids:
+                    return []
+                conn.row_factory = RowMapper(User)
+                cursor = conn.execute(f'SELECT * FROM users WHERE id IN ({",".join("?" * len(ids))})', ids)
+                users = {user.id: user for user in cursor.fetchall()}
+                return [users[user_id] for user_id in ids]
+
+            query = '''
+                SELECT u.*
+                FROM users u
+                WHERE u.is_active = TRUE
+                AND u.id != ?
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM likes l
+                    WHERE l.from_user_id = ?
+                    AND l.to_user_id = u.id
                 )
-                current_user = cursor.fetchone()
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM skips s
+                    WHERE s.from_user_id = ?
+                    AND s.to_user_id = u.id
+                )
+            '''
+            params: List[Any] = [current_user_id, current_user_id, current_user_id]
+
+            if exclude_ids:
+                query += f' AND u.id NOT IN ({", ".join("?" * len(exclude_ids))})'
+                params.extend(exclude_ids)
+
+            if target_gender:
+                query += '''
+                    ORDER BY
+                        CASE WHEN u.gender = ? THEN 1 ELSE 2 END,
+                        CASE WHEN u.gender = ? AND u.goal = ? THEN 1 ELSE 2 END,
+                        u.created_at DESC
+                '''
+                params.extend([target_gender, target_gender, goal])
+            else:
+                query += '''
+                    ORDER BY
+                        CASE WHEN u.goal = ? THEN 1 ELSE 2 END,
+                        u.created_at DESC
+                '''
+                params.append(goal)
 
-                if not current_user:
-                    return None
+            query += ' LIMIT ?'
+            params.append(limit)
 
-                current_gender = current_user['gender']
-                current_goal = current_user['goal']
+            # Кандидаты собираются сразу в User — без промежуточных dict
+            conn.row_factory = RowMapper(User)
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchall()
 
-                # Базовый запрос
-                query = '''
-                    SELECT u.*
-                    FROM users u
-                    WHERE u.is_active = TRUE
-                    AND u.id != ?
-                    AND NOT EXISTS (
-                        SELECT 1
-                        FROM likes l
-                        WHERE l.from_user_id = ?
-                        AND l.to_user_id = u.id
-                    )
-                    AND NOT EXISTS (
-                        SELECT 1
-                        FROM skips s
-                        WHERE s.from_user_id = ?
-                        AND s.to_user_id = u.id
-                    )
-                '''
+        return await self._read(_get, tx)
 
-                params = [current_user_id, current_user_id, current_user_id]
-
-                # Фильтр по полу (показываем противоположный пол)
-                if current_gender == 'Мужской':
-                    query += ' AND u.gender = ?'
-                    params.append('Женский')
-                elif current_gender == 'Женский':
-                    query += ' AND u.gender = ?'
-                    params.append('Мужской')
-
-                # Добавляем сортировку по цели
-                # Сначала показываем пользователей с той же целью, потом всех остальных
-                order_by = '''
-                    ORDER BY 
-                        CASE 
-                            WHEN u.goal = ? THEN 1
-                            ELSE 2
-                        END,
-                        u.created_at DESC
-                '''
+class LazyDatabase:
+    """Глобальная база, которая открывается (и мигрирует) при первом обращении.
 
-                if current_goal:
-                    params.append(current_goal)
-                else:
-                    # Если у текущего пользователя нет цели, добавляем заглушку
-                    params.append('')
+    Импорт модуля не трогает файл БД: тесты и утилиты работают со своими
+    файлами, а бот открывает базу явно через ``open()`` при запуске.
+    """
+
+    def __init__(self, factory: Callable[[], SQLiteDatabase]):
+        self._factory = factory
+        self._db: Optional[SQLiteDatabase] = None
+        self._lock = threading.Lock()
 
-                query += order_by
-                query += ' LIMIT 1'
+    def open(self) -> SQLiteDatabase:
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = self._factory()
+        return self._db
 
-                cursor.execute(query, params)
-                candidate = cursor.fetchone()
-                return dict(candidate) if candidate else None
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.open(), name)
 
-        return await asyncio.get_event_loop().run_in_executor(self.executor, _get)
 
-# Создаем глобальный экземпляр базы данных
-db = SQLiteDatabase()
+# Глобальный экземпляр базы данных (путь — DB_PATH)
+db = LazyDatabase(lambda: SQLiteDatabase(cfg.db_path or None))
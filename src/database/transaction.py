@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional
+
+from .pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class Transaction:
+    """Единица работы: несколько операций SQLiteDatabase в одной транзакции.
+
+    ``async with db.transaction() as tx:`` берёт соединение из пула и сразу
+    блокировку записи (BEGIN IMMEDIATE), методы с ``tx=tx`` выполняются на
+    этом соединении, а на выходе из блока — один COMMIT (или ROLLBACK при
+    исключении): одна фиксация на любое число операций.
+
+    Каждая операция, как и везде в слое БД, выполняется в executor'е — тяжёлый
+    запрос внутри блока не останавливает цикл событий. Операции одной
+    транзакции идут строго по очереди (соединение одно). Ждать сеть
+    (Telegram) внутри блока нельзя — блокировка записи держится до выхода
+    из него. Как и в групповом коммите, каждая операция обёрнута в
+    SAVEPOINT: перехваченная ошибка одной операции откатывает только её.
+    """
+
+    def __init__(self, pool: ConnectionPool, executor: Executor):
+        self._pool = pool
+        self._executor = executor
+        self._conn: sqlite3.Connection | None = None
+        self._after_commit: List[Callable[[], Any]] = []
+        # Операции на одном соединении — по одной; _op — последняя отправленная в executor
+        self._lock = asyncio.Lock()
+        self._op: Optional[asyncio.Future] = None
+
+    async def run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполнить операцию fn(conn) внутри транзакции"""
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Транзакция не начата или уже завершена')
+
+        async with self._lock:
+            # Отменённый вызов не останавливает поток — дожидаемся его операции
+            await self._wait_op()
+            self._op = asyncio.get_running_loop().run_in_executor(self._executor, self._run, self._conn, fn)
+            return await self._op
+
+    @staticmethod
+    def _run(conn: sqlite3.Connection, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn.execute('SAVEPOINT op')
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute('ROLLBACK TO op')
+            raise
+        finally:
+            conn.execute('RELEASE op')
+            conn.row_factory = None
+        return result
+
+    async def _wait_op(self):
+        if self._op is not None and not self._op.done():
+            await asyncio.wait([self._op])
+
+    def after_commit(self, callback: Callable[[], Any]):
+        """Вызвать callback после успешного COMMIT (например, сбросить кэш)"""
+        self._after_commit.append(callback)
+
+    async def __aenter__(self) -> 'Transaction':
+        loop = asyncio.get_running_loop()
+        begin = loop.run_in_executor(self._executor, self._begin)
+        try:
+            self._conn = await asyncio.shield(begin)
+        except asyncio.CancelledError:
+            # Поток всё равно возьмёт соединение — вернём его в пул
+            begin.add_done_callback(lambda f: f.cancelled() or f.exception() or self._pool.release(f.result()))
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._wait_op()
+        conn, self._conn = self._conn, None
+        commit = exc_type is None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._finish, conn, commit)
+
+        if commit:
+            for callback in self._after_commit:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception('Ошибка в обработчике after_commit')
+
+    def _begin(self) -> sqlite3.Connection:
+        conn = self._pool.acquire()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self._pool.release(conn)
+            raise
+        return conn
+
+    def _finish(self, conn: sqlite3.Connection, commit: bool):
+        try:
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        finally:
+            self._pool.release(conn)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+from .pool import DEFAULT_PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+WriteFn = Callable[[sqlite3.Connection], Any]
+
+_STOP = object()
+
+
+@dataclass
+class WriterStats:
+    writes: int = 0
+    batches: int = 0
+    failed: int = 0
+    max_batch: int = 0
+
+    @property
+    def avg_batch(self) -> float:
+        return self.writes / self.batches if self.batches else 0.0
+
+
+class GroupCommitWriter:
+    """Единственный поток-писатель с групповым коммитом.
+
+    Корутины кладут операции в очередь, поток забирает всё, что накопилось
+    за ``window`` секунд (но не больше ``max_batch``), и выполняет пачку
+    в одной транзакции. Каждая операция идёт в своём SAVEPOINT, поэтому
+    ошибка одной не откатывает остальные, а future каждого вызывающего
+    получает свой собственный результат.
+    """
+
+    def __init__(self, db_path: str | Path, window: float = 0.005, max_batch: int = 256,
+                 pragmas: Dict[str, str | int] | None = None):
+        self.db_path = Path(db_path)
+        self.window = window
+        self.max_batch = max_batch
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.stats = WriterStats()
+
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    async def submit(self, fn: WriteFn) -> Any:
+        """Поставить операцию в очередь и дождаться её коммита"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((fn, future, loop))
+        return await future
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+
+        stopping = False
+        try:
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+
+                batch = [item]
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, _, _ in batch:
+                conn.execute('SAVEPOINT op')
+                try:
+                    results.append((True, fn(conn)))
+                    conn.execute('RELEASE op')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO op')
+                    conn.execute('RELEASE op')
+                    results.append((False, e))
+                finally:
+                    conn.row_factory = None
+            conn.commit()
+        except Exception as e:
+            logger.exception('Групповой коммит не удался')
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(False, e)] * len(batch)
+
+        self.stats.batches += 1
+        self.stats.writes += len(batch)
+        self.stats.max_batch = max(self.stats.max_batch, len(batch))
+
+        for (_, future, loop), (ok, value) in zip(batch, results):
+            if not ok:
+                self.stats.failed += 1
+            loop.call_soon_threadsafe(_resolve, future, ok, value)
+
+
+def _resolve(future: asyncio.Future, ok: bool, value: Any):
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict
+
+from .config import cfg
+from .outbox import Outbox, Priority, outbox
+from .storage import storage
+
+if TYPE_CHECKING:
+    from .storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+def format_digest(count: int) -> str:
+    if count == 1:
+        return (
+            "❤️ Кто-то поставил вам лайк!\n\n"
+            "Нажмите «❤️ Посмотреть мои лайки», чтобы увидеть анкеты 👀"
+        )
+
+    if count % 10 == 1 and count % 100 != 11:
+        word = "новый лайк"
+    elif 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        word = "новых лайка"
+    else:
+        word = "новых лайков"
+
+    return (
+        f"❤️ У вас {count} {word}!\n\n"
+        "Нажмите «❤️ Посмотреть мои лайки», чтобы увидеть анкеты 👀"
+    )
+
+
+class LikeDigest:
+    """Сводные уведомления о лайках вместо пинга на каждый лайк.
+
+    Лайки копятся по получателю в таблице like_digests. Первое событие
+    запускает таймер на ``window`` секунд, по его истечении (или сразу,
+    если накопилось ``threshold`` лайков) уходит одно сообщение «N новых
+    лайков». Счётчики лежат в БД, поэтому после перезапуска ``start``
+    досылает то, что не успели отправить.
+    """
+
+    def __init__(self, storage: 'Storage', outbox: Outbox, window: float = 60.0, threshold: int = 10):
+        self.storage = storage
+        self.outbox = outbox
+        self.window = window
+        self.threshold = threshold
+
+        self._bot = None
+        self._timers: Dict[int, asyncio.Task] = {}
+
+    async def start(self, bot):
+        """Поднять таймеры для дайджестов, оставшихся с прошлого запуска"""
+        self._bot = bot
+        for chat_id, _, first_at in await self.storage.get_pending_likes():
+            if chat_id not in self._timers:
+                self._schedule(chat_id, first_at + self.window - time.time())
+
+    async def add(self, bot, chat_id: int):
+        """Учесть лайк, адресованный чату ``chat_id``"""
+        self._bot = bot
+        pending, first_at = await self.storage.add_pending_like(chat_id, time.time())
+
+        if pending >= self.threshold:
+            await self.flush(chat_id)
+        elif chat_id not in self._timers:
+            self._schedule(chat_id, first_at + self.window - time.time())
+
+    def close(self):
+        """Остановить таймеры; накопленное останется в БД до следующего start"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+    async def flush(self, chat_id: int):
+        """Отправить накопленное получателю прямо сейчас"""
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+        count = await self.storage.take_pending_likes(chat_id)
+        if count and self._bot is not None:
+            self.outbox.send_message(self._bot, chat_id, format_digest(count), priority=Priority.LIKE)
+
+    def _schedule(self, chat_id: int, delay: float):
+        task = asyncio.get_running_loop().create_task(self._flush_later(chat_id, max(0.0, delay)))
+        self._timers[chat_id] = task
+        task.add_done_callback(lambda t: self._on_timer_done(chat_id, t))
+
+    async def _flush_later(self, chat_id: int, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush(chat_id)
+
+    def _on_timer_done(self, chat_id: int, task: asyncio.Task):
+        if self._timers.get(chat_id) is task:
+            del self._timers[chat_id]
+        if not task.cancelled() and task.exception():
+            logger.error('Не удалось отправить дайджест лайков в чат %s', chat_id,
+                         exc_info=task.exception())
+
+
+like_digest = LikeDigest(
+    storage,
+    outbox,
+    window=cfg.like_digest_window,
+    threshold=cfg.like_digest_threshold,
+)
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Set, Type
+
+if TYPE_CHECKING:
+    from .storage import User
+
+logger = logging.getLogger(__name__)
+
+
+# События публикуются только после коммита соответствующей записи
+
+
+@dataclass(frozen=True)
+class LikeCreated:
+    bot: Any
+    from_user: 'User'
+    to_user: 'User'
+    is_mutual: bool
+
+
+@dataclass(frozen=True)
+class MatchCreated:
+    bot: Any
+    user: 'User'
+    other: 'User'
+
+
+@dataclass(frozen=True)
+class ProfileActivated:
+    user: 'User'
+
+
+@dataclass(frozen=True)
+class ModerationDecided:
+    bot: Any
+    user: 'User'
+    photo_file_id: str
+    approved: bool
+
+
+Consumer = Callable[[Any], Awaitable[None]]
+
+
+class EventBus:
+    """Внутрипроцессная шина событий.
+
+    ``emit`` не ждёт подписчиков: каждый запускается отдельной задачей,
+    поэтому обработчик успевает ответить на колбэк сразу, а уведомления,
+    прогрев ленты и прочее идут параллельно. Ошибка одного подписчика
+    логируется и не мешает остальным.
+    """
+
+    def __init__(self):
+        self._consumers: Dict[type, List[Consumer]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def subscribe(self, event_type: Type) -> Callable[[Consumer], Consumer]:
+        """Декоратор: подписать корутину на события типа ``event_type``"""
+
+        def decorator(consumer: Consumer) -> Consumer:
+            self._consumers.setdefault(event_type, []).append(consumer)
+            return consumer
+
+        return decorator
+
+    def emit(self, event: Any):
+        loop = asyncio.get_running_loop()
+        for consumer in self._consumers.get(type(event), ()):
+            task = loop.create_task(consumer(event))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t, c=consumer: self._on_done(c, event, t))
+
+    async def drain(self):
+        """Дождаться всех запущенных подписчиков (и порождённых ими событий)"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _on_done(self, consumer: Consumer, event: Any, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error('Подписчик %s упал на событии %s', consumer.__name__, type(event).__name__,
+                         exc_info=task.exception())
+
+
+bus = EventBus()
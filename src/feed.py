@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from collections import deque
+from typing import TYPE_CHECKING, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+if TYPE_CHECKING:
+    from .storage import User
+
+logger = logging.getLogger(__name__)
+
+# fetch(user_id, limit, exclude_ids) -> кандидаты в порядке показа
+FetchCandidates = Callable[[int, int, List[int]], Awaitable[List['User']]]
+
+
+class CandidateFeed:
+    """Предподобранная лента кандидатов для каждого пользователя.
+
+    Кандидаты выбираются пачкой одним запросом и складываются в очередь
+    пользователя, свайп просто берёт следующий элемент. Когда в очереди
+    остаётся меньше ``low_watermark`` анкет, она дозаполняется в фоне.
+    """
+
+    def __init__(self, fetch: FetchCandidates, batch_size: int = 20, low_watermark: int = 5):
+        self._fetch = fetch
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+
+        self._queues: Dict[int, Deque['User']] = {}
+        # candidate_id -> пользователи, у которых он лежит в очереди
+        self._holders: Dict[int, Set[int]] = {}
+        # Анкета, показанная последней: её не берём повторно, пока нет свайпа
+        self._current: Dict[int, int] = {}
+        # Пользователи, для которых последняя выборка вернула неполную пачку
+        self._exhausted: Set[int] = set()
+        self._refills: Dict[int, asyncio.Task] = {}
+
+        # Счётчик инвалидаций: результаты выборки, начатой до инвалидации,
+        # не должны вернуть устаревшую анкету в очередь
+        self._version = 0
+        self._invalidated: Deque[tuple[int, int]] = deque(maxlen=1024)
+        self._resets: Dict[int, int] = {}
+
+    async def next_candidate(self, user_id: int) -> Optional['User']:
+        """Следующий кандидат для пользователя или None, если анкеты закончились"""
+        queue = self._queues.get(user_id)
+
+        if not queue:
+            await self._refill(user_id)
+            queue = self._queues.get(user_id)
+
+        if not queue:
+            self._current.pop(user_id, None)
+            return None
+
+        candidate = queue.popleft()
+        self._unhold(candidate.id, user_id)
+        self._current[user_id] = candidate.id
+
+        if len(queue) < self.low_watermark and user_id not in self._exhausted:
+            self._schedule_refill(user_id)
+
+        return candidate
+
+    def prefetch(self, user_id: int):
+        """Набрать ленту пользователя в фоне, если она пуста"""
+        if not self._queues.get(user_id) and user_id not in self._exhausted:
+            self._schedule_refill(user_id)
+
+    def discard(self, user_id: int, candidate_id: int):
+        """Убрать анкету из очереди пользователя (он уже лайкнул или пропустил её)"""
+        queue = self._queues.get(user_id)
+        if queue:
+            self._queues[user_id] = deque(c for c in queue if c.id != candidate_id)
+            self._unhold(candidate_id, user_id)
+        if self._current.get(user_id) == candidate_id:
+            del self._current[user_id]
+
+    def invalidate_candidate(self, candidate_id: int):
+        """Анкета изменилась, деактивирована, удалена или ушла на модерацию"""
+        self._version += 1
+        self._invalidated.append((self._version, candidate_id))
+
+        for user_id in self._holders.pop(candidate_id, set()):
+            queue = self._queues.get(user_id)
+            if queue:
+                self._queues[user_id] = deque(c for c in queue if c.id != candidate_id)
+
+    def reset(self, user_id: int):
+        """Сбросить ленту пользователя (например, после изменения его анкеты)"""
+        self._version += 1
+        self._resets[user_id] = self._version
+        task = self._refills.pop(user_id, None)
+        if task:
+            task.cancel()
+        for candidate in self._queues.pop(user_id, ()):
+            self._unhold(candidate.id, user_id)
+        self._current.pop(user_id, None)
+        self._exhausted.discard(user_id)
+
+    def clear(self):
+        for user_id in list(self._queues):
+            self.reset(user_id)
+
+    def _unhold(self, candidate_id: int, user_id: int):
+        holders = self._holders.get(candidate_id)
+        if holders:
+            holders.discard(user_id)
+            if not holders:
+                del self._holders[candidate_id]
+
+    def _schedule_refill(self, user_id: int):
+        if user_id in self._refills:
+            return
+        task = asyncio.get_running_loop().create_task(self._refill(user_id))
+        self._refills[user_id] = task
+        task.add_done_callback(lambda t: self._on_refill_done(user_id, t))
+
+    def _on_refill_done(self, user_id: int, task: asyncio.Task):
+        if self._refills.get(user_id) is task:
+            del self._refills[user_id]
+        if not task.cancelled() and task.exception():
+            logger.error('Не удалось дозаполнить ленту пользователя %s', user_id,
+                         exc_info=task.exception())
+
+    async def _refill(self, user_id: int):
+        running = self._refills.get(user_id)
+        if running and running is not asyncio.current_task():
+            # Фоновая дозагрузка уже идёт — дожидаемся её
+            try:
+                await asyncio.shield(running)
+                return
+            except asyncio.CancelledError:
+                if not running.cancelled():
+                    raise
+                # Дозагрузку отменил reset — выбираем заново
+
+        queue = self._queues.setdefault(user_id, deque())
+        exclude = [c.id for c in queue]
+        if user_id in self._current:
+            exclude.append(self._current[user_id])
+
+        started = self._version
+        candidates = await self._fetch(user_id, self.batch_size, exclude)
+
+        if self._resets.get(user_id, 0) > started:
+            # Пока шла выборка, лента была сброшена — результат устарел
+            return
+
+        if len(candidates) < self.batch_size:
+            self._exhausted.add(user_id)
+        else:
+            self._exhausted.discard(user_id)
+
+        stale = {cid for version, cid in self._invalidated if version > started}
+        queue = self._queues.setdefault(user_id, deque())
+        queued = {c.id for c in queue}
+
+        for candidate in candidates:
+            if candidate.id in stale or candidate.id in queued:
+                continue
+            queue.append(candidate)
+            self._holders.setdefault(candidate.id, set()).add(user_id)
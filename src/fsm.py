@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from .config import cfg
+from .database.sqlite import SQLiteDatabase, db
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    state: Optional[str]
+    data: Dict[str, Any] = field(default_factory=dict)
+    updated_at: float = 0.0
+
+    @property
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх SQLite с кэшем в памяти.
+
+    Чтение и запись идут через ограниченный LRU-кэш (``maxsize`` ключей),
+    изменённые ключи сбрасываются в таблицу fsm_states пачками: раз в
+    ``flush_interval`` секунд или сразу, как накопится ``flush_batch``.
+    Состояния, не менявшиеся дольше ``ttl`` секунд, считаются брошенными
+    и удаляются. Без ``shared`` кэш считается актуальным для ключей, которые
+    в нём есть, поэтому апдейты одного чата должен обрабатывать один процесс.
+    С ``shared`` (несколько процессов на одной БД) ключ, не изменённый
+    локально, перед каждым чтением сверяется со строкой в БД: более новое
+    состояние другого процесса подхватывается, удалённое — сбрасывается.
+    Изменения другого процесса видны после его сброса (до ``flush_interval``).
+    """
+
+    # Как часто вычищать просроченные состояния из БД и кэша, в секундах
+    PURGE_INTERVAL = 60.0
+
+    def __init__(self, database: SQLiteDatabase, maxsize: int = 10000, ttl: float = 86400,
+                 flush_interval: float = 1.0, flush_batch: int = 100, shared: bool = False,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.db = database
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.shared = shared
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        self._front: OrderedDict[str, _Entry] = OrderedDict()
+        # Изменения, ещё не записанные в БД (переживают вытеснение из кэша)
+        self._dirty: Dict[str, _Entry] = {}
+        # Пачка, которая пишется в БД прямо сейчас
+        self._flushing: Dict[str, _Entry] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+        self._write_lock = asyncio.Lock()
+        self._last_purge = time.time()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        entry = await self._get(storage_key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(storage_key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._get(self.key_builder.build(key))
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        entry = await self._get(storage_key)
+        entry.data = dict(data)
+        self._touch(storage_key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._get(self.key_builder.build(key))
+        return dict(entry.data)
+
+    async def flush(self):
+        """Записать накопленные изменения в БД одной транзакцией"""
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self._flushing = batch
+
+            rows = [
+                (key, entry.state, json.dumps(entry.data, ensure_ascii=False), entry.updated_at)
+                for key, entry in batch.items()
+            ]
+            now = time.time()
+            expired_before = None
+            if now - self._last_purge >= self.PURGE_INTERVAL:
+                expired_before = now - self.ttl
+                self._last_purge = now
+
+            try:
+                await self.db.save_fsm_states(rows, expired_before)
+            except BaseException:
+                # Не потеряем изменения (в том числе при отмене): запишем их со следующей пачкой
+                for key, entry in batch.items():
+                    self._dirty.setdefault(key, entry)
+                raise
+            finally:
+                self._flushing = {}
+
+            if expired_before is not None:
+                for key in [k for k, e in self._front.items() if e.updated_at < expired_before]:
+                    del self._front[key]
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+    async def _get(self, key: str) -> _Entry:
+        entry = self._front.get(key) or self._dirty.get(key)
+
+        if entry is None or self.shared and not self._is_local(key):
+            read_at = entry.updated_at if entry else None
+            row = await self.db.load_fsm_state(key)
+            # Пока читали, ключ мог появиться в кэше или измениться здесь — он свежее
+            cached = self._front.get(key) or self._dirty.get(key)
+            if cached is not None and (cached is not entry or self._is_local(key)
+                                       or cached.updated_at != read_at):
+                entry = cached
+            elif row:
+                if entry is None or row[2] > entry.updated_at:
+                    entry = _Entry(row[0], json.loads(row[1]), row[2])
+            elif entry is None or not entry.is_empty:
+                # Пустые ключи тоже кэшируем: FSM читает состояние на каждый апдейт.
+                # Строки нет, а в кэше что-то есть — состояние очистил другой процесс
+                entry = _Entry(None, {}, time.time())
+
+        if not entry.is_empty and entry.updated_at < time.time() - self.ttl:
+            # Брошенная анкета — начинаем с чистого листа
+            entry = _Entry(None, {}, time.time())
+            self._touch(key, entry)
+
+        self._remember(key, entry)
+        return entry
+
+    def _is_local(self, key: str) -> bool:
+        """Есть изменения этого процесса, ещё не записанные в БД"""
+        return key in self._dirty or key in self._flushing
+
+    def _remember(self, key: str, entry: _Entry):
+        self._front[key] = entry
+        self._front.move_to_end(key)
+        while len(self._front) > self.maxsize:
+            self._front.popitem(last=False)
+
+    def _touch(self, key: str, entry: _Entry):
+        entry.updated_at = time.time()
+        self._dirty[key] = entry
+        self._remember(key, entry)
+
+        if len(self._dirty) >= self.flush_batch:
+            self._spawn_flush()
+        elif self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self._flush_logged()
+
+    def _spawn_flush(self):
+        task = asyncio.get_running_loop().create_task(self._flush_logged())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('Не удалось сохранить состояния FSM')
+
+
+def create_fsm_storage() -> BaseStorage:
+    """FSM-хранилище по настройкам: SQLite (по умолчанию) или память"""
+    if cfg.fsm_storage == 'memory':
+        return MemoryStorage()
+
+    database = SQLiteDatabase(cfg.fsm_db_path) if cfg.fsm_db_path else db
+    return SQLiteStorage(
+        database,
+        maxsize=cfg.fsm_cache_size,
+        ttl=cfg.fsm_ttl,
+        flush_interval=cfg.fsm_flush_interval,
+        flush_batch=cfg.fsm_flush_batch,
+        shared=cfg.fsm_shared,
+    )
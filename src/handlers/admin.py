@@ -5,9 +5,13 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import sqlite3
 import asyncio
+import time
 
 from ..config import cfg
-from ..storage import storage
+from ..events import ModerationDecided, ProfileActivated, bus
+from ..outbox import outbox
+from ..retention import retention
+from ..storage import MODERATION_STATUSES, storage
 
 router = Router()
 
@@ -42,7 +46,7 @@ def get_main_menu_for_admin():
 
 
 @router.message(Command('admin'))
-async def cmd_admin(message: types.Message):
+async def cmd_admin(message: types.Message, state: FSMContext):
     """Вход/выход из режима админа и панель администратора"""
     if message.from_user.id not in cfg.admin_ids:
         await message.answer('🚫 У вас нет прав администратора.')
@@ -56,7 +60,7 @@ async def cmd_admin(message: types.Message):
         if args[1].lower() == 'moderate':
             # Входим в режим админа
             cfg.toggle_admin_mode(message.from_user.id)
-            await show_moderation_photo(message)
+            await show_moderation_batch(message, message.from_user.id, state)
             return
 
     # Переключаем режим админа
@@ -76,52 +80,67 @@ async def cmd_admin(message: types.Message):
         )
 
 
-async def show_moderation_photo(message: types.Message):
-    """Показать фото на модерацию"""
-    item = await storage.get_pending_moderation()
-
-    if not item:
+def moderation_batch_keyboard(batch: list[int], marks: dict[str, str]) -> InlineKeyboardMarkup:
+    """Кнопки пачки: по строке «одобрить/отклонить» на фото, отмеченное решение подписано"""
+    rows = []
+    for number, moderation_id in enumerate(batch, start=1):
+        mark = marks.get(str(moderation_id))
+        rows.append([
+            InlineKeyboardButton(
+                text=f'{number}. ✅ Одобрено' if mark == 'approve' else f'{number}. ✅',
+                callback_data=f'modb:mark:{moderation_id}:approve'
+            ),
+            InlineKeyboardButton(
+                text=f'{number}. ❌ Отклонено' if mark == 'reject' else f'{number}. ❌',
+                callback_data=f'modb:mark:{moderation_id}:reject'
+            ),
+        ])
+    rows.append([InlineKeyboardButton(text='💾 Применить отмеченные', callback_data='modb:apply')])
+    rows.append([InlineKeyboardButton(text='✅ Одобрить остальные и применить', callback_data='modb:approve_rest')])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def show_moderation_batch(message: types.Message, admin_id: int, state: FSMContext):
+    """Взять пачку фото на модерацию и показать её медиагруппой с кнопками"""
+    claimed = await storage.claim_moderation_batch(admin_id)
+
+    if not claimed:
+        await state.update_data(moderation_batch=[], moderation_marks={})
         await message.answer('✅ Нет фото на проверку.')
         return
 
-    user = await storage.get_user_by_id(item.user_id)
+    lines = []
+    media = []
+    for number, (item, user) in enumerate(claimed, start=1):
+        who = f'{user.name} (ID: {user.id}, TG ID: {user.tg_id})' if user else f'пользователь ID {item.user_id} не найден'
+        line = f'{number}. 👤 {who}, 📅 {item.created_at}'
+        if item.photo_file_id:
+            media.append(types.InputMediaPhoto(media=item.photo_file_id, caption=line))
+        else:
+            line += ' — ⚠️ фото не найдено'
+        lines.append(line)
 
-    if not user:
-        await message.answer('Пользователь не найден')
-        return
+    # Кнопки к медиагруппе не прикрепить — они идут отдельным сообщением
+    if media:
+        try:
+            if len(media) == 1:
+                # sendMediaGroup принимает от 2 до 10 элементов
+                await message.answer_photo(media[0].media, caption=media[0].caption)
+            else:
+                await message.answer_media_group(media)
+        except Exception as e:
+            lines.insert(0, f'Не удалось загрузить фото. Ошибка: {str(e)}\n')
 
-    # Используем ID модерации вместо photo_file_id для callback_data
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text='✅ Одобрить', callback_data=f'mod:approve:{item.id}'),
-            InlineKeyboardButton(text='❌ Отклонить', callback_data=f'mod:reject:{item.id}')
-        ]
-    ])
+    batch = [item.id for item, _ in claimed]
+    await state.update_data(moderation_batch=batch, moderation_marks={})
 
-    caption = (
-        f"👤 Пользователь: {user.name} (ID: {user.id}, TG ID: {user.tg_id})\n"
-        f"📅 Дата загрузки: {item.created_at}"
+    await message.answer(
+        f'📸 На проверке {len(batch)} фото, они закреплены за вами на '
+        f'{int(cfg.moderation_lease // 60)} мин.\n\n' + '\n'.join(lines) +
+        '\n\nОтметьте решения и нажмите «Применить».',
+        reply_markup=moderation_batch_keyboard(batch, {})
     )
 
-    if item.photo_file_id:
-        try:
-            await message.answer_photo(
-                photo=item.photo_file_id,
-                caption=caption,
-                reply_markup=kb
-            )
-        except Exception as e:
-            await message.answer(
-                f"Не удалось загрузить фото. Ошибка: {str(e)}\n\n{caption}\n"
-                f"📷 ID фото: {item.photo_file_id[:50]}...",
-                reply_markup=kb
-            )
-    else:
-        await message.answer(
-            f"⚠️ Фото не найдено в базе данных\n\n{caption}",
-            reply_markup=kb
-        )
-
 
 @router.message(F.text == "📊 Статистика")
 async def admin_stats(message: types.Message):
@@ -129,47 +148,10 @@ async def admin_stats(message: types.Message):
     if not cfg.get_admin_mode(message.from_user.id):
         return
 
-    from ..database.sqlite import db
-
-    def _get_stats():
-        with sqlite3.connect(str(db.db_path)) as conn:
-            cursor = conn.cursor()
-
-            # Статистика пользователей
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = TRUE")
-            active_users = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM users WHERE photo_file_id IS NOT NULL")
-            users_with_photo = cursor.fetchone()[0]
-
-            # Статистика лайков
-            cursor.execute("SELECT COUNT(*) FROM likes")
-            total_likes = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM likes WHERE is_mutual = TRUE")
-            mutual_likes = cursor.fetchone()[0]
-
-            # Статистика модерации
-            cursor.execute("SELECT COUNT(*) FROM moderation")
-            total_mod = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM moderation WHERE status = 'pending'")
-            pending_mod = cursor.fetchone()[0]
-
-            return {
-                'total_users': total_users,
-                'active_users': active_users,
-                'users_with_photo': users_with_photo,
-                'total_likes': total_likes,
-                'mutual_likes': mutual_likes,
-                'total_mod': total_mod,
-                'pending_mod': pending_mod
-            }
-
-    stats = await asyncio.get_event_loop().run_in_executor(None, _get_stats)
+    # Счётчики поддерживаются триггерами, поэтому это один лёгкий запрос
+    stats = await storage.get_stats()
+    verdict_lookups = stats['photo_verdict_hits'] + stats['photo_verdict_misses']
+    verdict_hit_rate = stats['photo_verdict_hits'] / verdict_lookups * 100 if verdict_lookups else 0
 
     stats_text = (
         '📊 Статистика бота:\n\n'
@@ -182,13 +164,59 @@ async def admin_stats(message: types.Message):
         f'  • Взаимных: {stats["mutual_likes"]}\n\n'
         f'📸 Модерация:\n'
         f'  • Всего фото: {stats["total_mod"]}\n'
-        f'  • Ожидают: {stats["pending_mod"]}\n\n'
+        f'  • Ожидают: {stats["pending_mod"]}\n'
+        f'  • Решено по кэшу: {stats["photo_verdict_hits"]} из {verdict_lookups} ({verdict_hit_rate:.0f}%)\n\n'
+        f'📤 Очередь отправки:\n'
+        f'  • Отправлено: {outbox.stats.sent}, в очереди: {outbox.stats.queued}\n'
+        f'  • Ошибок: {outbox.stats.failed}, RetryAfter: {outbox.stats.retry_after}\n\n'
         f'Используйте кнопку "📸 Модерация фото" для проверки фото'
     )
 
     await message.answer(stats_text)
 
 
+@router.message(Command('recountstats'))
+async def cmd_recountstats(message: types.Message):
+    """Пересчитать счётчики статистики, если они разошлись с данными"""
+    if message.from_user.id not in cfg.admin_ids:
+        await message.answer('🚫 У вас нет доступа.')
+        return
+
+    before = await storage.get_stats()
+    after = await storage.recount_stats()
+
+    drift = [
+        f'  • {name}: {before.get(name, 0)} → {value}'
+        for name, value in after.items()
+        if before.get(name, 0) != value
+    ]
+
+    if drift:
+        await message.answer('🔧 Счётчики пересчитаны:\n' + '\n'.join(drift))
+    else:
+        await message.answer('✅ Счётчики статистики совпадают с данными.')
+
+
+@router.message(Command('purge'))
+async def cmd_purge(message: types.Message):
+    """Удалить брошенные анкеты старше N дней"""
+    if message.from_user.id not in cfg.admin_ids:
+        await message.answer('🚫 У вас нет доступа.')
+        return
+
+    args = message.text.split()
+    try:
+        days = float(args[1]) if len(args) > 1 else cfg.purge_abandoned_after / 86400
+    except ValueError:
+        days = -1
+    if days <= 0:
+        await message.answer('Использование: /purge <дней>')
+        return
+
+    purged = await retention.purge_abandoned(time.time() - days * 86400)
+    await message.answer(f'🧹 Удалено брошенных анкет старше {days:g} дн.: {purged}')
+
+
 @router.message(F.text == "👤 Управление пользователями")
 async def admin_users_management(message: types.Message):
     """Управление пользователями"""
@@ -212,12 +240,12 @@ async def admin_users_management(message: types.Message):
 
 
 @router.message(F.text == "📸 Модерация фото")
-async def admin_moderation(message: types.Message):
+async def admin_moderation(message: types.Message, state: FSMContext):
     """Модерация фото"""
     if not cfg.get_admin_mode(message.from_user.id):
         return
 
-    await show_moderation_photo(message)
+    await show_moderation_batch(message, message.from_user.id, state)
 
 
 @router.message(F.text == "👤 Выйти из режима админа")
@@ -382,70 +410,50 @@ async def admin_get_user_id(message: types.Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith('mod:'))
-async def cb_mod(callback: types.CallbackQuery):
+async def cb_mod(callback: types.CallbackQuery, state: FSMContext):
+    """Решение по одному фото (кнопки сообщений, отправленных до пачек)"""
     if callback.from_user.id not in cfg.admin_ids:
         await callback.answer('Нет доступа')
         return
 
-    data = callback.data
-    _, action, moderation_id = data.split(':')
-    moderation_id = int(moderation_id)
+    try:
+        _, action, moderation_id = callback.data.split(':')
+        moderation_id = int(moderation_id)
+    except ValueError:
+        await callback.answer('Некорректные данные')
+        return
+    if action not in MODERATION_STATUSES:
+        await callback.answer('Некорректные данные')
+        return
 
-    # Получаем запись модерации по ID
-    moderation_item = await get_moderation_by_id(moderation_id)
+    # Решение и активация анкеты — один условный UPDATE в одной транзакции
+    outcome = await storage.decide_moderation(moderation_id, action, callback.from_user.id)
 
-    if not moderation_item:
+    if not outcome.item:
         await callback.answer('Запись модерации не найдена')
         return
 
-    user_id = moderation_item['user_id']
-    photo_file_id = moderation_item['photo_file_id']
-
-    # Обновляем статус модерации
-    result = await storage.set_moderation_status(user_id, photo_file_id, action)
-
-    if not result:
-        await callback.answer('Ошибка при обновлении статуса модерации')
+    if outcome.lost:
+        await callback.answer('Это фото уже взял в работу другой админ')
         return
 
-    user = await storage.get_user_by_id(user_id)
-
-    if action == 'approve':
-        # Обновляем фото пользователя
-        await storage.update_user_photo(user_id, photo_file_id)
-
-        # Активируем анкету пользователя
-        if user:
-            user.is_active = True
-            user.photo_file_id = photo_file_id
-            await storage.save_user(user)
+    if not outcome.applied:
+        # Повторное нажатие или решение другого админа — ничего не делаем
+        await callback.answer('Решение по этому фото уже принято')
+        return
 
-        await callback.answer('✅ Фото одобрено')
+    user = outcome.user
+    user_id = outcome.item.user_id
+    photo_file_id = outcome.item.photo_file_id
 
-        # Уведомляем пользователя
-        if user:
-            try:
-                await callback.message.bot.send_message(
-                    user.tg_id,
-                    '✅ Ваше фото одобрено модератором!\n'
-                    'Ваша анкета теперь активна и видна другим пользователям.'
-                )
-            except Exception as e:
-                print(f"Не удалось отправить уведомление пользователю {user.tg_id}: {e}")
+    # Решение записано — отвечаем модератору сразу, уведомление уйдёт через шину событий
+    await callback.answer('✅ Фото одобрено' if action == 'approve' else '❌ Фото отклонено')
 
-    elif action == 'reject':
-        await callback.answer('❌ Фото отклонено')
+    if user and action == 'approve':
+        bus.emit(ProfileActivated(user))
 
-        # Уведомляем пользователя
-        if user:
-            try:
-                await callback.message.bot.send_message(
-                    user.tg_id,
-                    '❌ Ваше фото не прошло модерацию.\n'
-                    'Пожалуйста, используйте /start, чтобы создать новую анкету.'
-                )
-            except Exception as e:
-                print(f"Не удалось отправить уведомление пользователю {user.tg_id}: {e}")
+    if user:
+        bus.emit(ModerationDecided(callback.message.bot, user, photo_file_id, action == 'approve'))
 
     # Убираем кнопки с текущего сообщения
     try:
@@ -456,64 +464,102 @@ async def cb_mod(callback: types.CallbackQuery):
     except Exception as e:
         print(f"Ошибка при редактировании сообщения: {e}")
 
-    # Проверяем следующее фото на модерацию
-    await check_next_moderation(callback.message)
+    # Следующие фото — уже пачкой
+    await show_moderation_batch(callback.message, callback.from_user.id, state)
 
 
-async def get_moderation_by_id(moderation_id: int):
-    """Вспомогательная функция для получения записи модерации по ID"""
-    from ..database.sqlite import db
+@router.callback_query(F.data.startswith('modb:mark:'))
+async def cb_mod_batch_mark(callback: types.CallbackQuery, state: FSMContext):
+    """Отметить решение по фото из пачки (повторное нажатие снимает отметку)"""
+    if callback.from_user.id not in cfg.admin_ids:
+        await callback.answer('Нет доступа')
+        return
 
-    def _get():
-        with sqlite3.connect(str(db.db_path)) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT m.*, u.name as user_name, u.tg_id as user_tg_id
-                FROM moderation m
-                JOIN users u ON m.user_id = u.id
-                WHERE m.id = ?
-            ''', (moderation_id,))
-            item = cursor.fetchone()
-            return dict(item) if item else None
-
-    return await asyncio.get_event_loop().run_in_executor(None, _get)
-
-
-async def check_next_moderation(message: types.Message):
-    """Проверить и отправить следующее фото на модерацию"""
-    next_item = await storage.get_pending_moderation()
-
-    if next_item:
-        next_user = await storage.get_user_by_id(next_item.user_id)
-
-        if next_user:
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [
-                    InlineKeyboardButton(text='✅ Одобрить', callback_data=f'mod:approve:{next_item.id}'),
-                    InlineKeyboardButton(text='❌ Отклонить', callback_data=f'mod:reject:{next_item.id}')
-                ]
-            ])
-
-            caption = (
-                f"👤 Пользователь: {next_user.name} (ID: {next_user.id}, TG ID: {next_user.tg_id})\n"
-                f"📅 Дата загрузки: {next_item.created_at}"
-            )
-
-            try:
-                await message.answer_photo(
-                    photo=next_item.photo_file_id,
-                    caption=caption,
-                    reply_markup=kb
-                )
-            except Exception as e:
-                await message.answer(
-                    f"Не удалось загрузить следующее фото. Ошибка: {str(e)}\n\n{caption}\n"
-                    f"📷 ID фото: {next_item.photo_file_id[:50]}...",
-                    reply_markup=kb
-                )
-        else:
-            await message.answer(f"⚠️ Не найден пользователь для модерации ID: {next_item.user_id}")
+    _, _, moderation_id, action = callback.data.split(':')
+    data = await state.get_data()
+    batch = data.get('moderation_batch') or []
+    marks = dict(data.get('moderation_marks') or {})
+
+    if int(moderation_id) not in batch:
+        await callback.answer('Эта пачка уже обработана')
+        return
+
+    if marks.get(moderation_id) == action:
+        del marks[moderation_id]
+    else:
+        marks[moderation_id] = action
+    await state.update_data(moderation_marks=marks)
+
+    await callback.answer()
+    try:
+        await callback.message.edit_reply_markup(reply_markup=moderation_batch_keyboard(batch, marks))
+    except Exception as e:
+        print(f"Ошибка при редактировании сообщения: {e}")
+
+
+@router.callback_query(F.data.in_({'modb:apply', 'modb:approve_rest'}))
+async def cb_mod_batch_apply(callback: types.CallbackQuery, state: FSMContext):
+    """Применить решения по пачке одной транзакцией"""
+    if callback.from_user.id not in cfg.admin_ids:
+        await callback.answer('Нет доступа')
+        return
+
+    admin_id = callback.from_user.id
+    data = await state.get_data()
+    batch = data.get('moderation_batch') or []
+    marks = data.get('moderation_marks') or {}
+
+    if not batch:
+        await callback.answer('Эта пачка уже обработана')
+        return
+
+    decisions = {
+        moderation_id: marks.get(str(moderation_id), 'approve' if callback.data == 'modb:approve_rest' else None)
+        for moderation_id in batch
+    }
+    decisions = {moderation_id: action for moderation_id, action in decisions.items() if action}
+
+    if not decisions:
+        await callback.answer('Отметьте хотя бы одно фото')
+        return
+
+    outcomes = await storage.decide_moderation_batch(decisions, admin_id)
+    # Неотмеченные фото сразу возвращаем в очередь, не дожидаясь конца аренды
+    skipped = [moderation_id for moderation_id in batch if moderation_id not in decisions]
+    await storage.release_moderation_claims(skipped, admin_id)
+    await state.update_data(moderation_batch=[], moderation_marks={})
+
+    applied = [outcome for outcome in outcomes if outcome.applied]
+    await callback.answer(f'✅ Применено решений: {len(applied)}')
+
+    for outcome in applied:
+        approved = outcome.item.status == 'approved'
+        if outcome.user and approved:
+            bus.emit(ProfileActivated(outcome.user))
+        if outcome.user:
+            bus.emit(ModerationDecided(callback.message.bot, outcome.user, outcome.item.photo_file_id, approved))
+
+    approved_count = sum(outcome.item.status == 'approved' for outcome in applied)
+    summary = (
+        f'✅ Одобрено: {approved_count}\n'
+        f'❌ Отклонено: {len(applied) - approved_count}'
+    )
+    # Аренда истекла, и записи перехватил другой админ — решения не применены
+    lost = sum(outcome.lost for outcome in outcomes)
+    if lost:
+        summary += f'\n⏳ Переданы другому админу (аренда истекла): {lost}'
+    if len(applied) + lost < len(outcomes):
+        summary += f'\n⚠️ Уже решены ранее: {len(outcomes) - len(applied) - lost}'
+    if skipped:
+        summary += f'\n↩️ Возвращены в очередь: {len(skipped)}'
+
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+        await callback.message.answer(summary)
+    except Exception as e:
+        print(f"Ошибка при редактировании сообщения: {e}")
+
+    await show_moderation_batch(callback.message, admin_id, state)
 
 
 # Добавим команды для просмотра и удаления пользователей
@@ -674,6 +720,8 @@ async def cmd_adminhelp(message: types.Message):
         '/admin moderate - Быстрый переход к модерации фото\n'
         '/viewuser <telegram_id> - Просмотреть информацию о пользователе\n'
         '/deleteuser <telegram_id> - Удалить пользователя\n'
+        '/recountstats - Пересчитать счётчики статистики\n'
+        '/purge <дней> - Удалить брошенные анкеты старше N дней\n'
         '/adminhelp - Эта справка\n\n'
 
         '🔧 Функции в режиме админа:\n'
@@ -1,9 +1,12 @@
 import asyncio
+from typing import Optional
+
 from aiogram import F, Router, types
 from aiogram.fsm.context import FSMContext
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from ..events import ProfileActivated, bus
 from ..states import ProfileStates
-from ..storage import storage
+from ..storage import User, storage
 
 router = Router()
 
@@ -31,12 +34,30 @@ def get_start_menu():
     )
 
 
+async def get_profile_snapshot(state: FSMContext, data: Optional[dict] = None) -> User:
+    """Анкета, сохранённая в FSM при входе в создание или изменение.
+
+    Шаги формы показывают «(текущее: ...)» из снимка, не обращаясь к БД.
+    """
+    if data is None:
+        data = await state.get_data()
+    if 'profile' in data:
+        return User.from_dict(data['profile'])
+
+    # Состояние, начатое до появления снимков: читаем один раз и запоминаем
+    user = await storage.get_user_by_id(data['user_id'])
+    await state.update_data(profile=user.to_dict())
+    return user
+
+
 @router.message(F.text == "/start")
-async def cmd_start(message: types.Message, state: FSMContext):
+async def cmd_start(message: types.Message, state: FSMContext, user: Optional[User] = None):
     # Очищаем состояние если было
     await state.clear()
 
-    user = await storage.get_user_by_tg(message.from_user.id)
+    # user подставляет UserMiddleware; без него читаем сами
+    if user is None:
+        user = await storage.get_user_by_tg(message.from_user.id)
 
     if user and user.is_active:
         # Если анкета уже есть, показываем главное меню
@@ -57,14 +78,15 @@ async def cmd_start(message: types.Message, state: FSMContext):
 @router.message(F.text == "📌 Создать анкету")
 async def start_profile(message: types.Message, state: FSMContext):
     user = await storage.create_or_get_user(message.from_user.id)
-    await state.update_data(user_id=user.id, editing=False)
+    await state.update_data(user_id=user.id, editing=False, profile=user.to_dict())
     await state.set_state(ProfileStates.NAME)
     await message.answer("Как тебя зовут?", reply_markup=ReplyKeyboardRemove())
 
 
 @router.message(F.text == "📝 Изменить анкету")
-async def edit_profile(message: types.Message, state: FSMContext):
-    user = await storage.get_user_by_tg(message.from_user.id)
+async def edit_profile(message: types.Message, state: FSMContext, user: Optional[User] = None):
+    if user is None:
+        user = await storage.get_user_by_tg(message.from_user.id)
 
     if not user or not user.is_active:
         await message.answer(
@@ -73,8 +95,8 @@ async def edit_profile(message: types.Message, state: FSMContext):
         )
         return
 
-    # Начинаем пересоздание анкеты
-    await state.update_data(user_id=user.id, editing=True)
+    # Начинаем пересоздание анкеты; анкету запоминаем в FSM, дальше БД не читаем
+    await state.update_data(user_id=user.id, editing=True, profile=user.to_dict())
     await state.set_state(ProfileStates.NAME)
     await message.answer(
         "📝 Начинаем изменение анкеты.\n\n"
@@ -124,7 +146,7 @@ async def age_step(message: types.Message, state: FSMContext):
 
     data = await state.get_data()
     if data.get('editing'):
-        user = await storage.get_user_by_id(data['user_id'])
+        user = await get_profile_snapshot(state, data)
         await message.answer(
             f"Выбери свой пол (текущий: {user.gender}):",
             reply_markup=gender_kb
@@ -181,7 +203,7 @@ async def skip_photo_button(message: types.Message, state: FSMContext):
         return
 
     # Только при изменении анкеты можно пропустить фото
-    user = await storage.get_user_by_id(data['user_id'])
+    user = await get_profile_snapshot(state, data)
 
     # Используем старое фото если есть
     if user and user.photo_file_id:
@@ -201,7 +223,6 @@ async def skip_photo_button(message: types.Message, state: FSMContext):
         resize_keyboard=True
     )
 
-    user = await storage.get_user_by_id(data['user_id'])
     await message.answer(
         f"Выбери тип общения (текущий: {user.goal}):",
         reply_markup=goals_kb
@@ -220,11 +241,12 @@ async def ready_for_photo(message: types.Message, state: FSMContext):
 async def photo_step(message: types.Message, state: FSMContext):
     file_id = message.photo[-1].file_id
     data = await state.get_data()
-    user_id = data.get('user_id')
 
     # Сохраняем photo_file_id в состоянии, но НЕ отправляем на модерацию сейчас
     await state.update_data(
         photo_file_id=file_id,
+        # Постоянный id файла: по нему узнаём уже проверенное фото
+        photo_unique_id=message.photo[-1].file_unique_id,
         photo_on_moderation=True,  # Фото будет отправлено на модерацию после завершения анкеты
         pending_photo_file_id=file_id,
         photo_moderation_status='pending'
@@ -249,7 +271,7 @@ async def photo_step(message: types.Message, state: FSMContext):
     )
 
     if data.get('editing'):
-        user = await storage.get_user_by_id(user_id)
+        user = await get_profile_snapshot(state, data)
         await message.answer(
             f"Выбери тип общения (текущий: {user.goal}):",
             reply_markup=goals_kb
@@ -299,7 +321,7 @@ async def goal_step(message: types.Message, state: FSMContext):
 
     data = await state.get_data()
     if data.get('editing'):
-        user = await storage.get_user_by_id(data['user_id'])
+        user = await get_profile_snapshot(state, data)
         current_desc = user.description if user.description else "(пусто)"
         await message.answer(
             f"✍️ Теперь расскажи немного о себе\n"
@@ -320,7 +342,7 @@ async def description_skip(message: types.Message, state: FSMContext):
     data = await state.get_data()
     if data.get('editing'):
         # Если редактируем и пропускаем, оставляем старое описание
-        user = await storage.get_user_by_id(data['user_id'])
+        user = await get_profile_snapshot(state, data)
         await state.update_data(description=user.description)
     else:
         await state.update_data(description="")
@@ -339,9 +361,9 @@ async def description_step(message: types.Message, state: FSMContext):
 
 async def finish_profile(message: types.Message, state: FSMContext):
     data = await state.get_data()
-    user = await storage.get_user_by_id(data['user_id'])
+    user = await get_profile_snapshot(state, data)
 
-    # Обновляем данные пользователя
+    # Обновляем данные пользователя (save_user запишет только изменённые поля)
     user.name = data['name']
     user.age = data['age']
     user.gender = data['gender']
@@ -361,9 +383,6 @@ async def finish_profile(message: types.Message, state: FSMContext):
         user.is_active = False  # Деактивируем анкету до одобрения фото
         user_has_new_photo = True
 
-        # Отправляем фото на модерацию ТОЛЬКО СЕЙЧАС
-        await storage.add_moderation(user.id, photo_file_id)
-
     elif photo_file_id and not photo_on_moderation:
         # Если фото есть, но не на модерации (старое фото при редактировании)
         user.photo_file_id = photo_file_id
@@ -373,13 +392,38 @@ async def finish_profile(message: types.Message, state: FSMContext):
         user.photo_file_id = None
         user.is_active = True
 
-    await storage.save_user(user)
+    if not await storage.save_user(user):
+        # Анкету успели изменить в другом месте (например, модератор одобрил фото)
+        await state.clear()
+        await message.answer(
+            "⚠️ Анкета изменилась, пока вы её заполняли.\n"
+            "Пожалуйста, начните изменение ещё раз: 📝 Изменить анкету",
+            reply_markup=get_main_menu()
+        )
+        return
+
+    photo_rejected = False
+
+    if user_has_new_photo:
+        # Отправляем фото на модерацию ТОЛЬКО СЕЙЧАС, когда анкета сохранена
+        outcome = await storage.add_moderation(user.id, photo_file_id, data.get('photo_unique_id'))
+
+        if outcome:
+            # Это фото уже проверяли — решение принято без админа
+            user = outcome.user or user
+            user_has_new_photo = False
+            photo_rejected = outcome.item.status == 'rejected'
+
+    if user.is_active:
+        bus.emit(ProfileActivated(user))
 
     # Формируем текст анкеты
     action_text = "изменена" if is_editing else "создана"
 
     if user_has_new_photo:
         status_text = "⏳ (ожидает модерации фото)"
+    elif photo_rejected:
+        status_text = "❌ (фото отклонено)"
     else:
         status_text = "✅ (активна)"
 
@@ -409,6 +453,11 @@ async def finish_profile(message: types.Message, state: FSMContext):
         else:
             await message.answer(text, reply_markup=get_main_menu())
 
+    elif photo_rejected:
+        text += "\n\n❌ Это фото уже было отклонено модератором.\n"
+        text += "Загрузите другое фото: 📝 Изменить анкету"
+        await message.answer(text, reply_markup=get_main_menu())
+
     else:
         if user.photo_file_id:
             await message.answer_photo(
@@ -0,0 +1,52 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from .storage import Storage
+
+# Колбэки, в которых после двоеточия передаётся id второго пользователя
+COUNTERPART_PREFIXES = ('like', 'like_back')
+
+
+def get_counterpart_id(update: Update) -> Optional[int]:
+    """id собеседника из callback_data вида 'like:<id>', если он там есть"""
+    callback = update.callback_query
+    if not callback or not callback.data:
+        return None
+
+    prefix, _, raw_id = callback.data.partition(':')
+    if prefix in COUNTERPART_PREFIXES and raw_id.isdigit():
+        return int(raw_id)
+    return None
+
+
+class UserMiddleware(BaseMiddleware):
+    """Загружает пользователя, совершившего действие, один раз на апдейт.
+
+    Регистрируется как outer-middleware на dp.update. Обработчики получают
+    его в аргументе ``user``, а для лайков — ещё и ``counterpart``, которого
+    достаём тем же запросом.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get('event_from_user')
+
+        if from_user and isinstance(event, Update):
+            counterpart_id = get_counterpart_id(event)
+            if counterpart_id is not None:
+                data['user'], data['counterpart'] = await self.storage.get_user_pair(
+                    from_user.id, counterpart_id
+                )
+            else:
+                data['user'] = await self.storage.get_user_by_tg(from_user.id)
+
+        return await handler(event, data)
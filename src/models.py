@@ -0,0 +1,163 @@
+import sqlite3
+from dataclasses import dataclass, field, fields
+from operator import attrgetter, itemgetter
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+
+# Колонки анкеты, изменения которых отслеживает User
+PROFILE_FIELDS = ('name', 'age', 'gender', 'photo_file_id', 'goal', 'description', 'is_active')
+
+_get_profile = attrgetter(*PROFILE_FIELDS)
+
+# Кого показывать в ленте в первую очередь
+OPPOSITE_GENDER = {'Мужской': 'Женский', 'Женский': 'Мужской'}
+
+
+@dataclass(slots=True)
+class User:
+    id: int  # SQLite ID
+    tg_id: int
+    name: str = ''
+    age: int | None = None
+    gender: str = ''
+    photo_file_id: str | None = None
+    goal: str = ''
+    description: str = ''
+    is_active: bool = False
+    # Номер версии строки для оптимистичной блокировки в save_user
+    version: int = 0
+    # Поля анкеты на момент загрузки или сохранения, с ними сравнивает changes()
+    _loaded: tuple = field(default=(), init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # SQLite хранит BOOLEAN как 0/1
+        self.is_active = bool(self.is_active)
+        self._loaded = _get_profile(self)
+
+    def changes(self) -> dict:
+        """Поля, изменённые с момента загрузки или последнего сохранения"""
+        return {
+            name: value
+            for name, value, loaded in zip(PROFILE_FIELDS, _get_profile(self), self._loaded)
+            if value != loaded
+        }
+
+    def mark_clean(self):
+        self._loaded = _get_profile(self)
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'tg_id': self.tg_id,
+            **{name: getattr(self, name) for name in PROFILE_FIELDS},
+            'version': self.version,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            id=data['id'],
+            tg_id=data['tg_id'],
+            name=data['name'],
+            age=data['age'],
+            gender=data['gender'],
+            photo_file_id=data['photo_file_id'],
+            goal=data['goal'],
+            description=data['description'],
+            is_active=data['is_active'],
+            version=data.get('version', 0)
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class Like:
+    from_user_id: int
+    to_user_id: int
+    is_mutual: bool = False
+
+    def __post_init__(self):
+        object.__setattr__(self, 'is_mutual', bool(self.is_mutual))
+
+
+@dataclass(slots=True, frozen=True)
+class ModerationItem:
+    id: int
+    user_id: int
+    photo_file_id: str
+    status: str  # 'pending', 'approved', 'rejected'
+    created_at: str
+    # tg_id админа и время решения (для pending — None)
+    decided_by: int | None = None
+    decided_at: str | None = None
+    # Какой админ взял запись в работу и до какого unix-времени
+    claimed_by: int | None = None
+    claimed_until: float | None = None
+    # file_unique_id фото — ключ кэша решений photo_verdicts
+    photo_unique_id: str | None = None
+
+
+@dataclass(slots=True, frozen=True)
+class ModerationOutcome:
+    """Результат decide_moderation"""
+    item: ModerationItem | None  # None — записи нет
+    user: User | None  # анкета после решения (только если applied)
+    applied: bool  # False — решение уже приняли раньше (повторный колбэк)
+    lost: bool = False  # True — аренда истекла и запись закреплена за другим админом
+
+
+class RowMapper:
+    """row_factory для sqlite3: строит модель прямо из кортежа строки.
+
+    Номера колонок для полей модели ищутся по ``cursor.description`` один
+    раз на запрос (а не на каждую строку), дальше строка раскладывается
+    в конструктор одним ``itemgetter`` — без промежуточного словаря.
+    Колонки из ``extras`` (например, поля из JOIN) возвращаются рядом:
+    ``(model, *extras)``.
+
+    Создаётся на каждый запрос: ``conn.row_factory = RowMapper(User)``.
+    """
+
+    __slots__ = ('model', 'extras', '_description', '_build')
+
+    def __init__(self, model: type, extras: Sequence[str] = ()):
+        self.model = model
+        self.extras = tuple(extras)
+        self._description = None
+        self._build: Optional[Callable[[tuple], Any]] = None
+
+    def __call__(self, cursor: sqlite3.Cursor, row: tuple):
+        # description — один и тот же объект для всех строк одного execute
+        if cursor.description is not self._description:
+            self._description = cursor.description
+            self._build = self._compile(cursor.description)
+        return self._build(row)
+
+    def _compile(self, description) -> Callable[[tuple], Any]:
+        index = {column[0]: i for i, column in enumerate(description)}
+        model = self.model
+        init_names = [f.name for f in fields(model) if f.init]
+        names = [name for name in init_names if name in index]
+        get_fields = _tuple_getter([index[name] for name in names])
+
+        if names == init_names[:len(names)]:
+            # Обычный случай: есть все поля подряд — передаём позиционно
+            build_model = lambda row: model(*get_fields(row))
+        else:
+            # В выборке нет поля из середины — остальные берут значения по умолчанию
+            build_model = lambda row: model(**dict(zip(names, get_fields(row))))
+
+        if not self.extras:
+            return build_model
+
+        get_extras = _tuple_getter([index[name] for name in self.extras])
+        return lambda row: (build_model(row), *get_extras(row))
+
+
+def _tuple_getter(positions: Sequence[int]) -> Callable[[tuple], Tuple]:
+    # itemgetter с одним индексом возвращает значение, а не кортеж
+    if not positions:
+        return lambda row: ()
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda row: (row[position],)
+    return itemgetter(*positions)
@@ -0,0 +1,266 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from .config import cfg
+
+logger = logging.getLogger(__name__)
+
+SendFn = Callable[[], Awaitable[Any]]
+
+
+class Priority(IntEnum):
+    """Полосы очереди: меньшее значение уходит раньше"""
+    MATCH = 0   # взаимные лайки
+    REPLY = 1   # анкеты и ответы на действие самого пользователя
+    NOTIFY = 2  # результаты модерации и прочие уведомления
+    LIKE = 3    # «Кто-то поставил вам лайк»
+
+
+@dataclass
+class OutboxStats:
+    enqueued: int = 0
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    retry_after: int = 0
+    queued: int = 0
+    in_flight: int = 0
+    # Наибольшее время от постановки в очередь до отправки, в секундах
+    max_delay: float = 0.0
+
+
+class TokenBucket:
+    """Корзина токенов: ``rate`` токенов в секунду, не больше ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # До этого момента отправлять нельзя (RetryAfter от Telegram)
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до следующего токена"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    send: SendFn = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    created_at: float = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class Outbox:
+    """Общая очередь исходящих сообщений бота.
+
+    Обработчики ставят отправку в очередь и не ждут сети. Фоновый воркер
+    выпускает сообщения по приоритетам, не превышая общий лимит бота и
+    лимит на каждый чат; на RetryAfter чат ставится на паузу, а сообщение
+    повторяется. Воркер запускается при первой постановке и завершается,
+    когда очередь пуста.
+    """
+
+    # Сколько корзин чатов держим, прежде чем выбросить простаивающие
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 max_in_flight: int = 10, max_retries: int = 3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.stats = OutboxStats()
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._seq = itertools.count()
+
+        self._ready: List[_Job] = []
+        # (момент, когда чат снова можно писать, задание)
+        self._delayed: List[Tuple[float, _Job]] = []
+        self._in_flight: Set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+        self._worker: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def enqueue(self, chat_id: int, send: SendFn, priority: Priority = Priority.REPLY) -> asyncio.Future:
+        """Поставить отправку в очередь; future получит результат вызова.
+
+        ``send`` вызывается заново при каждой попытке, поэтому передаём
+        функцию, создающую корутину, а не саму корутину.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_silence)
+
+        job = _Job(int(priority), next(self._seq), chat_id, send, future, time.monotonic())
+        heapq.heappush(self._ready, job)
+
+        self.stats.enqueued += 1
+        self.stats.queued += 1
+        self._idle.clear()
+        self._wake()
+        return future
+
+    def send_message(self, bot, chat_id: int, text: str,
+                     priority: Priority = Priority.REPLY, **kwargs) -> asyncio.Future:
+        return self.enqueue(chat_id, lambda: bot.send_message(chat_id, text, **kwargs), priority)
+
+    def send_photo(self, bot, chat_id: int, photo: str,
+                   priority: Priority = Priority.REPLY, **kwargs) -> asyncio.Future:
+        return self.enqueue(chat_id, lambda: bot.send_photo(chat_id, photo, **kwargs), priority)
+
+    async def drain(self):
+        """Дождаться, пока уйдут все поставленные сообщения"""
+        await self._idle.wait()
+
+    def _wake(self):
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                for idle_id in [cid for cid, b in self._chats.items() if b.is_idle(now)]:
+                    del self._chats[idle_id]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _run(self):
+        while self._ready or self._delayed:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                heapq.heappush(self._ready, heapq.heappop(self._delayed)[1])
+
+            if not self._ready:
+                # Всё отложено — спим до ближайшего срока или до новой постановки
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._delayed[0][0] - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job = self._ready[0]
+            chat = self._chat_bucket(job.chat_id)
+            wait = chat.delay(now)
+            if wait > 0:
+                # Чат упёрся в свой лимит — не держим из-за него остальных
+                heapq.heappop(self._ready)
+                heapq.heappush(self._delayed, (now + wait, job))
+                continue
+
+            wait = self._global.delay(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            await self._slots.acquire()
+            # Пока ждали слот, вперёд могло встать задание важнее
+            if self._ready[0] is not job:
+                self._slots.release()
+                continue
+
+            heapq.heappop(self._ready)
+            now = time.monotonic()
+            chat.consume(now)
+            self._global.consume(now)
+
+            self.stats.queued -= 1
+            self.stats.in_flight += 1
+            self.stats.max_delay = max(self.stats.max_delay, now - job.created_at)
+
+            task = asyncio.get_running_loop().create_task(self._send(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, job: _Job):
+        try:
+            result = await job.send()
+        except TelegramRetryAfter as e:
+            self.stats.retry_after += 1
+            until = time.monotonic() + e.retry_after
+            self._chat_bucket(job.chat_id).block(until)
+
+            if job.attempts < self.max_retries:
+                job.attempts += 1
+                self.stats.retried += 1
+                self.stats.queued += 1
+                heapq.heappush(self._delayed, (until, job))
+                self._wake()
+            else:
+                self._finish(job, error=e)
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+        finally:
+            self.stats.in_flight -= 1
+            self._slots.release()
+            if not self.stats.queued and not self.stats.in_flight:
+                self._idle.set()
+
+    def _finish(self, job: _Job, result: Any = None, error: Exception | None = None):
+        if error is not None:
+            self.stats.failed += 1
+            logger.warning('Не удалось отправить сообщение в чат %s: %s', job.chat_id, error)
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            self.stats.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+def _silence(future: asyncio.Future):
+    # Ошибки отправки уже залогированы — обработчики обычно не ждут future
+    if not future.cancelled():
+        future.exception()
+
+
+outbox = Outbox(
+    global_rate=cfg.outbox_global_rate,
+    chat_rate=cfg.outbox_chat_rate,
+    chat_burst=cfg.outbox_chat_burst,
+    max_in_flight=cfg.outbox_max_in_flight,
+    max_retries=cfg.outbox_max_retries,
+)
@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .models import OPPOSITE_GENDER
+from .seen import SeenSet
+
+if TYPE_CHECKING:
+    from .storage import User
+
+logger = logging.getLogger(__name__)
+
+# Строка индекса: (id, gender, goal, age, created_at как unix time)
+ProfileRow = Tuple[int, Optional[str], Optional[str], Optional[int], float]
+# load_rows(ids) -> активные анкеты из ids (None — все активные)
+LoadRows = Callable[[Optional[List[int]]], Awaitable[List[ProfileRow]]]
+# load_seen(user_id) -> анкеты, которые пользователь лайкнул или пропустил
+LoadSeen = Callable[[int], Awaitable[SeenSet]]
+# Разница в возрасте, после которой близость по возрасту уже не добавляет очков
+AGE_SPAN = 15
+# За сколько секунд «свежесть» анкеты падает в e раз
+RECENCY_SCALE = 30 * 86400
+
+
+@dataclass(slots=True)
+class Columns:
+    """Срезы колонок индекса длиной в число анкет (без копирования)"""
+    ids: np.ndarray
+    gender: np.ndarray
+    goal: np.ndarray
+    age: np.ndarray
+    created: np.ndarray
+
+
+@dataclass(slots=True, frozen=True)
+class Viewer:
+    """Тот, для кого подбираются кандидаты (коды как в колонках)"""
+    id: int
+    gender: int
+    goal: int
+    age: int
+    target_gender: int  # код противоположного пола или -1
+
+
+# Слагаемое оценки: (viewer, columns) -> массив очков той же длины
+ScoreFn = Callable[[Viewer, Columns], np.ndarray]
+
+
+def opposite_gender(viewer: Viewer, cols: Columns) -> np.ndarray:
+    return (cols.gender == viewer.target_gender).astype(np.float32)
+
+
+def same_goal(viewer: Viewer, cols: Columns) -> np.ndarray:
+    return (cols.goal == viewer.goal).astype(np.float32)
+
+
+def age_closeness(viewer: Viewer, cols: Columns) -> np.ndarray:
+    # 1 для ровесников, 0 при разнице от AGE_SPAN лет и для анкет без возраста
+    if viewer.age < 0:
+        return np.zeros(len(cols.ids), np.float32)
+    distance = np.minimum(np.abs(cols.age.astype(np.float32) - viewer.age), AGE_SPAN)
+    return np.where(cols.age >= 0, 1 - distance / AGE_SPAN, 0).astype(np.float32)
+
+
+def recency(viewer: Viewer, cols: Columns) -> np.ndarray:
+    # Самая новая анкета получает 1, остальные — меньше по экспоненте
+    if not len(cols.created):
+        return np.zeros(0, np.float32)
+    return np.exp((cols.created - cols.created.max()) / RECENCY_SCALE).astype(np.float32)
+
+
+# Веса подобраны так, чтобы сохранить прежний порядок по крупным признакам:
+# противоположный пол важнее всего остального, та же цель — важнее возраста и новизны
+DEFAULT_TERMS: Tuple[Tuple[float, ScoreFn], ...] = (
+    (8.0, opposite_gender),
+    (4.0, same_goal),
+    (2.0, age_closeness),
+    (1.0, recency),
+)
+
+
+class ProfileIndex:
+    """Колоночный индекс активных анкет в памяти для подбора кандидатов.
+
+    id, пол, цель, возраст и дата создания лежат в массивах NumPy, поэтому
+    фильтр и оценка всех анкет — несколько векторных операций вместо
+    SQL-запроса с сортировкой на каждую пачку. Оценка — взвешенная сумма
+    слагаемых ``terms`` (см. DEFAULT_TERMS), их можно заменить.
+
+    Индекс строится лениво при первом подборе и дальше обновляется точечно:
+    ``upsert`` — когда есть готовая анкета, ``mark_dirty`` — когда известно
+    только, что строка в БД изменилась (перечитается перед следующим подбором).
+    Просмотренные анкеты отсеиваются по SeenSet из ``load_seen``.
+    """
+
+    def __init__(self, load_rows: LoadRows, load_seen: LoadSeen,
+                 terms: Sequence[Tuple[float, ScoreFn]] = DEFAULT_TERMS):
+        self._load_rows = load_rows
+        self._load_seen = load_seen
+        self.terms = tuple(terms)
+
+        self._size = 0
+        self._ids = np.zeros(0, np.int64)
+        self._gender = np.zeros(0, np.int16)
+        self._goal = np.zeros(0, np.int16)
+        self._age = np.zeros(0, np.int16)
+        self._created = np.zeros(0, np.float64)
+        # id анкеты -> номер строки в колонках
+        self._rows: Dict[int, int] = {}
+        # Строковые значения пола и цели -> коды в колонках (0 — пусто)
+        self._codes: Dict[str, int] = {'': 0}
+        self._values: List[str] = ['']
+
+        self._loaded = False
+        self._dirty: Set[int] = set()
+        # Идёт чтение из БД: его результат может оказаться старше точечных обновлений
+        self._syncing = False
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    # === Обновления ===
+
+    def upsert(self, user: 'User'):
+        """Анкета сохранена: добавить, обновить или убрать (если неактивна)"""
+        if not self._loaded or self._syncing:
+            self._dirty.add(user.id)
+            if not self._loaded:
+                return
+        else:
+            self._dirty.discard(user.id)
+        if user.is_active:
+            self._put(user.id, user.gender, user.goal, user.age, None)
+        else:
+            self._remove(user.id)
+
+    def remove(self, user_id: int):
+        """Анкета удалена или деактивирована"""
+        if not self._loaded or self._syncing:
+            self._dirty.add(user_id)
+            if not self._loaded:
+                return
+        else:
+            self._dirty.discard(user_id)
+        self._remove(user_id)
+
+    def mark_dirty(self, user_id: int):
+        """Строка пользователя изменилась в БД — перечитать её перед подбором"""
+        self._dirty.add(user_id)
+
+    def clear(self):
+        """Забыть всё — индекс перестроится при следующем подборе"""
+        self._loaded = False
+        self._size = 0
+        self._rows.clear()
+        self._dirty.clear()
+
+    # === Подбор ===
+
+    async def rank(self, user_id: int, limit: int, exclude_ids: Iterable[int] = ()) -> List[int]:
+        """id до limit лучших непросмотренных кандидатов, лучшие первыми"""
+        await self._sync()
+
+        row = self._rows.get(user_id)
+        if row is None:
+            # Неактивная анкета кандидатов не получает
+            return []
+        seen = await self._load_seen(user_id)
+
+        n = self._size
+        cols = Columns(self._ids[:n], self._gender[:n], self._goal[:n], self._age[:n], self._created[:n])
+        target = OPPOSITE_GENDER.get(self._values[self._gender[row]])
+        viewer = Viewer(
+            id=user_id,
+            gender=int(self._gender[row]),
+            goal=int(self._goal[row]),
+            age=int(self._age[row]),
+            target_gender=self._codes.get(target, -1) if target else -1,
+        )
+
+        allowed = ~seen.contains(cols.ids)
+        allowed[row] = False
+        exclude = np.fromiter(exclude_ids, dtype=np.int64)
+        if len(exclude):
+            allowed &= ~np.isin(cols.ids, exclude)
+
+        candidates = np.flatnonzero(allowed)
+        if not len(candidates):
+            return []
+
+        picked = Columns(cols.ids[candidates], cols.gender[candidates], cols.goal[candidates],
+                         cols.age[candidates], cols.created[candidates])
+        score = np.zeros(len(candidates), np.float32)
+        for weight, term in self.terms:
+            score += weight * term(viewer, picked)
+
+        if len(candidates) > limit:
+            # Сначала отбираем limit лучших без полной сортировки
+            top = np.argpartition(-score, limit - 1)[:limit]
+        else:
+            top = np.arange(len(candidates))
+        # При равной оценке — новые анкеты первыми
+        order = top[np.lexsort((-picked.ids[top], -picked.created[top], -score[top]))]
+        return picked.ids[order].tolist()
+
+    async def _sync(self):
+        if self._loaded and not self._dirty:
+            return
+        async with self._lock:
+            self._syncing = True
+            try:
+                if not self._loaded:
+                    self._dirty.clear()
+                    rows = await self._load_rows(None)
+                    self._size = 0
+                    self._rows.clear()
+                    for row in rows:
+                        self._put(*row)
+                    self._loaded = True
+                    logger.info('Индекс анкет построен: %s активных', self._size)
+                elif self._dirty:
+                    dirty, self._dirty = list(self._dirty), set()
+                    rows = await self._load_rows(dirty)
+                    for user_id in set(dirty) - {row[0] for row in rows}:
+                        self._remove(user_id)
+                    for row in rows:
+                        self._put(*row)
+            finally:
+                # Изменённые за время чтения строки остались в _dirty и перечитаются
+                self._syncing = False
+
+    # === Колонки ===
+
+    def _code(self, value: Optional[str]) -> int:
+        value = value or ''
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def _put(self, user_id: int, gender: Optional[str], goal: Optional[str],
+             age: Optional[int], created: Optional[float]):
+        row = self._rows.get(user_id)
+        if row is None:
+            if self._size == len(self._ids):
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._rows[user_id] = row
+            self._ids[row] = user_id
+            # Дата создания из анкеты неизвестна — анкета только что активирована
+            self._created[row] = created if created is not None else time.time()
+        elif created is not None:
+            self._created[row] = created
+
+        self._gender[row] = self._code(gender)
+        self._goal[row] = self._code(goal)
+        self._age[row] = age if age is not None else -1
+
+    def _remove(self, user_id: int):
+        row = self._rows.pop(user_id, None)
+        if row is None:
+            return
+        # Последнюю строку переносим на место удалённой
+        last = self._size - 1
+        if row != last:
+            for column in (self._ids, self._gender, self._goal, self._age, self._created):
+                column[row] = column[last]
+            self._rows[int(self._ids[row])] = row
+        self._size = last
+
+    def _grow(self):
+        capacity = max(1024, len(self._ids) * 2)
+        self._ids = _resized(self._ids, capacity)
+        self._gender = _resized(self._gender, capacity)
+        self._goal = _resized(self._goal, capacity)
+        self._age = _resized(self._age, capacity)
+        self._created = _resized(self._created, capacity)
+
+
+def _resized(column: np.ndarray, capacity: int) -> np.ndarray:
+    grown = np.zeros(capacity, column.dtype)
+    grown[:len(column)] = column
+    return grown
+
+
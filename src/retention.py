@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+
+from .config import cfg
+from .storage import storage
+
+if TYPE_CHECKING:
+    from .storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class Retention:
+    """Периодическая чистка устаревших данных.
+
+    Раз в ``interval`` секунд удаляет пропуски старше ``skip_ttl`` секунд —
+    анкеты снова появляются в ленте, а skips и проверка «уже просмотрено»
+    не растут бесконечно, — и брошенные анкеты старше ``purge_after`` секунд
+    (см. purge_abandoned). Удаление идёт пачками, каждая в своей короткой
+    транзакции с паузой ``pause`` между ними, чтобы не держать блокировку
+    записи. Освободившиеся страницы возвращаются ОС через incremental vacuum
+    (не больше ``vacuum_pages`` за проход). Нулевой срок выключает свой шаг.
+    """
+
+    def __init__(self, storage: 'Storage', skip_ttl: float, interval: float = 3600.0,
+                 batch: int = 2000, pause: float = 0.05, vacuum_pages: int = 2000,
+                 purge_after: float = 0.0, purge_batch: int = 200):
+        self.storage = storage
+        self.skip_ttl = skip_ttl
+        self.interval = interval
+        self.batch = batch
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.purge_after = purge_after
+        self.purge_batch = purge_batch
+
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Запустить фоновую чистку (ничего не делает, если все сроки нулевые)"""
+        if (self.skip_ttl > 0 or self.purge_after > 0) and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run_once(self, now: Optional[float] = None) -> tuple[int, int]:
+        """Один проход чистки; возвращает (удалено пропусков, удалено анкет)"""
+        now = time.time() if now is None else now
+        skips = users = 0
+        if self.skip_ttl > 0:
+            skips = await self.expire_skips(now - self.skip_ttl)
+        if self.purge_after > 0:
+            users = await self.purge_abandoned(now - self.purge_after)
+
+        pages = await self.storage.incremental_vacuum(self.vacuum_pages) if self.vacuum_pages > 0 else 0
+        if skips or users or pages:
+            logger.info('Удалено устаревших пропусков: %s, брошенных анкет: %s, возвращено страниц: %s',
+                        skips, users, pages)
+        return skips, users
+
+    async def expire_skips(self, before: float) -> int:
+        """Удалить все пропуски, сделанные раньше unix-времени before"""
+        return await self._drain(lambda: self.storage.expire_skips(before, self.batch), self.batch)
+
+    async def purge_abandoned(self, before: float) -> int:
+        """Удалить все брошенные анкеты, созданные раньше unix-времени before"""
+        return await self._drain(lambda: self.storage.purge_abandoned_users(before, self.purge_batch),
+                                 self.purge_batch)
+
+    async def _drain(self, step: Callable[[], Awaitable[int]], batch: int) -> int:
+        # Пачка меньше полной — удалять больше нечего
+        total = 0
+        while True:
+            count = await step()
+            total += count
+            if count < batch:
+                return total
+            await asyncio.sleep(self.pause)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception('Не удалось почистить устаревшие данные')
+            await asyncio.sleep(self.interval)
+
+
+retention = Retention(
+    storage,
+    skip_ttl=cfg.skip_ttl,
+    interval=cfg.retention_interval,
+    batch=cfg.retention_batch,
+    pause=cfg.retention_pause,
+    vacuum_pages=cfg.vacuum_pages,
+    purge_after=cfg.purge_abandoned_after,
+    purge_batch=cfg.purge_batch,
+)
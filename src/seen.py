@@ -0,0 +1,147 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+# id в BLOB — uint32 little-endian, по возрастанию
+_BLOB_DTYPE = np.dtype('<u4')
+
+# load(user_id) -> (BLOB, id после BLOB, метка лайков, метка пропусков)
+LoadSeen = Callable[[int], Awaitable[Tuple[bytes, List[int], int, int]]]
+# store(user_id, BLOB, метка лайков, метка пропусков)
+StoreSeen = Callable[[int, bytes, int, int], Awaitable[None]]
+
+
+class SeenSet:
+    """Множество просмотренных анкет: отсортированный массив id и хвост новых.
+
+    Проверка одного id — двоичный поиск, массива id — один ``searchsorted``.
+    Новые id копятся в обычном множестве и вливаются в массив пачкой.
+    """
+
+    __slots__ = ('_sorted', '_recent')
+
+    # Сколько новых id держать вне массива до слияния
+    MERGE_AFTER = 512
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._sorted = np.unique(np.fromiter(ids, dtype=np.int64))
+        self._recent: Set[int] = set()
+
+    @classmethod
+    def from_blob(cls, blob: bytes, extra: Iterable[int] = ()) -> 'SeenSet':
+        seen = cls.__new__(cls)
+        seen._sorted = np.frombuffer(blob, dtype=_BLOB_DTYPE).astype(np.int64)
+        seen._recent = set()
+        extra = list(extra)
+        if extra:
+            seen._sorted = np.union1d(seen._sorted, extra)
+        return seen
+
+    def to_blob(self) -> bytes:
+        self._merge()
+        return self._sorted.astype(_BLOB_DTYPE).tobytes()
+
+    def add(self, candidate_id: int):
+        if candidate_id not in self:
+            self._recent.add(candidate_id)
+            if len(self._recent) >= self.MERGE_AFTER:
+                self._merge()
+
+    def __contains__(self, candidate_id: int) -> bool:
+        if candidate_id in self._recent:
+            return True
+        position = np.searchsorted(self._sorted, candidate_id)
+        return position < len(self._sorted) and self._sorted[position] == candidate_id
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """Маска «уже просмотрена» для массива id"""
+        if not len(self._sorted):
+            result = np.zeros(len(ids), bool)
+        else:
+            positions = np.minimum(np.searchsorted(self._sorted, ids), len(self._sorted) - 1)
+            result = self._sorted[positions] == ids
+        if self._recent:
+            result |= np.isin(ids, np.fromiter(self._recent, dtype=np.int64))
+        return result
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+    def _merge(self):
+        if self._recent:
+            self._sorted = np.union1d(self._sorted, np.fromiter(self._recent, dtype=np.int64))
+            self._recent = set()
+
+
+class SeenStore:
+    """Множества просмотренных анкет для последних ``maxsize`` пользователей.
+
+    Множество лениво читается из BLOB в seen_sets плюс лайки и пропуски,
+    сделанные после его записи. Если таких набралось ``compact_after``,
+    BLOB перезаписывается — следующая загрузка снова будет одним чтением.
+    Свайпы дописываются в память через ``add`` после записи в БД.
+    """
+
+    def __init__(self, load: LoadSeen, store: StoreSeen, maxsize: int = 10000, compact_after: int = 256):
+        self._load = load
+        self._store = store
+        self.maxsize = maxsize
+        self.compact_after = compact_after
+
+        self._sets: OrderedDict[int, SeenSet] = OrderedDict()
+        # Пока множество загружается, новые свайпы копятся здесь
+        self._loading: Dict[int, List[int]] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    async def get(self, user_id: int) -> SeenSet:
+        seen = self._sets.get(user_id)
+        if seen is not None:
+            self._sets.move_to_end(user_id)
+            return seen
+
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                seen = self._sets.get(user_id)
+                if seen is None:
+                    seen = await self._load_set(user_id)
+            return seen
+        finally:
+            if not lock.locked() and self._locks.get(user_id) is lock:
+                del self._locks[user_id]
+
+    def add(self, user_id: int, candidate_id: int):
+        """Пользователь лайкнул или пропустил анкету (запись в БД уже сделана)"""
+        seen = self._sets.get(user_id)
+        if seen is not None:
+            seen.add(candidate_id)
+        elif user_id in self._loading:
+            self._loading[user_id].append(candidate_id)
+
+    def forget(self, user_id: int):
+        """Выбросить множество из памяти (например, пользователь удалён)"""
+        self._sets.pop(user_id, None)
+
+    def clear(self):
+        self._sets.clear()
+
+    async def _load_set(self, user_id: int) -> SeenSet:
+        self._loading[user_id] = []
+        try:
+            blob, delta, like_mark, skip_mark = await self._load(user_id)
+            seen = SeenSet.from_blob(blob, delta)
+            if len(delta) >= self.compact_after:
+                # Сохраняем ровно то, что было в БД до меток (без свайпов из памяти)
+                await self._store(user_id, seen.to_blob(), like_mark, skip_mark)
+        finally:
+            late = self._loading.pop(user_id, [])
+
+        for candidate_id in late:
+            seen.add(candidate_id)
+
+        self._sets[user_id] = seen
+        while len(self._sets) > self.maxsize:
+            self._sets.popitem(last=False)
+        return seen
@@ -1,194 +1,381 @@
-
-from typing import Dict, List, Optional
-from dataclasses import dataclass
-from .database.sqlite import db  # Изменено с database.py на database_sqlite.py
-
-
-@dataclass
-class User:
-    id: int  # SQLite ID
-    tg_id: int
-    name: str = ''
-    age: int | None = None
-    gender: str = ''
-    photo_file_id: str | None = None
-    goal: str = ''
-    description: str = ''
-    is_active: bool = False
-
-    @classmethod
-    def from_dict(cls, data: dict):
-        return cls(
-            id=data['id'],
-            tg_id=data['tg_id'],
-            name=data['name'],
-            age=data['age'],
-            gender=data['gender'],
-            photo_file_id=data['photo_file_id'],
-            goal=data['goal'],
-            description=data['description'],
-            is_active=bool(data['is_active'])
-        )
-
-
-@dataclass
-class Like:
-    from_user_id: int
-    to_user_id: int
-    is_mutual: bool = False
-
-    @classmethod
-    def from_dict(cls, data: dict):
-        return cls(
-            from_user_id=data['from_user_id'],
-            to_user_id=data['to_user_id'],
-            is_mutual=bool(data['is_mutual'])
-        )
-
-
-@dataclass
-class ModerationItem:
-    id: int
-    user_id: int
-    photo_file_id: str
-    status: str  # 'pending', 'approved', 'rejected'
-    created_at: str
-
-    @classmethod
-    def from_dict(cls, data: dict):
-        return cls(
-            id=data['id'],
-            user_id=data['user_id'],
-            photo_file_id=data['photo_file_id'],
-            status=data['status'],
-            created_at=data['created_at']
-        )
-
-
-class Storage:
-    def __init__(self):
-        pass
-
-    async def delete_user(self, user_id: int) -> bool:
-        """Удалить пользователя по ID"""
-        return await db.delete_user(user_id)
-
-    async def delete_user_by_tg(self, tg_id: int) -> bool:
-        """Удалить пользователя по Telegram ID"""
-        return await db.delete_user_by_tg_id(tg_id)
-
-    async def get_moderation_by_id(self, moderation_id: int) -> Optional[ModerationItem]:
-        """Получить запись модерации по ID"""
-        data = await db.get_moderation_by_id(moderation_id)
-        if data:
-            return ModerationItem.from_dict(data)
-        return None
-
-    async def get_pending_moderation_by_user(self, user_id: int) -> Optional[ModerationItem]:
-        """Получить ожидающую модерацию запись для пользователя"""
-        data = await db.get_pending_moderation_by_user(user_id)
-        if data:
-            return ModerationItem.from_dict(data)
-        return None
-
-    async def get_any_candidate(self, current_user_id: int) -> Optional[User]:
-        """Получить любого кандидата, даже если цели не совпадают"""
-        data = await db.get_any_candidate(current_user_id)
-        if data:
-            return User.from_dict(data)
-        return None
-
-
-
-    async def get_moderation_by_id(self, moderation_id: int) -> Optional[ModerationItem]:
-        """Получить запись модерации по ID"""
-        data = await db.get_moderation_by_id(moderation_id)
-        if data:
-            return ModerationItem.from_dict(data)
-        return None
-
-    async def create_or_get_user(self, tg_id: int) -> User:
-        data = await db.create_or_get_user(tg_id)
-        return User.from_dict(data)
-
-    async def get_user_by_id(self, user_id: int) -> Optional[User]:
-        data = await db.get_user_by_id(user_id)
-        if data:
-            return User.from_dict(data)
-        return None
-
-    async def get_user_by_tg(self, tg_id: int) -> Optional[User]:
-        data = await db.get_user_by_tg(tg_id)
-        if data:
-            return User.from_dict(data)
-        return None
-
-    async def save_user(self, user: User):
-        """Сохранить или обновить пользователя"""
-        await db.update_user(
-            user.id,
-            name=user.name,
-            age=user.age,
-            gender=user.gender,
-            photo_file_id=user.photo_file_id,
-            goal=user.goal,
-            description=user.description,
-            is_active=user.is_active
-        )
-
-    async def add_like(self, from_uid: int, to_uid: int) -> Like:
-        data = await db.add_like(from_uid, to_uid)
-        return Like.from_dict(data)
-
-    async def add_skip(self, from_uid: int, to_uid: int) -> None:
-        await db.add_skip(from_uid, to_uid)
-
-    async def has_liked(self, from_uid: int, to_uid: int) -> bool:
-        return await db.has_liked(from_uid, to_uid)
-
-    async def get_likes_to_user(self, user_id: int) -> List[Dict]:
-        """Получить всех, кто лайкнул пользователя"""
-        return await db.get_likes_to_user(user_id)
-
-    async def get_pending_moderation(self) -> Optional[ModerationItem]:
-        """Получить первую фотографию на модерацию со статусом pending"""
-        data = await db.get_pending_moderation()
-        if data:
-            return ModerationItem.from_dict(data)
-        return None
-
-    async def add_moderation(self, user_id: int, photo_file_id: str):
-        """Добавить фото на модерацию"""
-        await db.add_moderation(user_id, photo_file_id)
-
-    async def set_moderation_status(self, user_id: int, photo_file_id: str, status: str) -> Optional[ModerationItem]:
-        """Установить статус модерации для конкретного фото пользователя"""
-        data = await db.set_moderation_status(user_id, photo_file_id, status)
-        if data:
-            return ModerationItem.from_dict(data)
-        return None
-
-    async def get_user_moderation_status(self, user_id: int) -> Optional[str]:
-        """Получить статус модерации последней фотографии пользователя"""
-        return await db.get_user_moderation_status(user_id)
-
-    async def get_next_candidate(self, current_user_id: int) -> Optional[User]:
-        data = await db.get_next_candidate(current_user_id)
-        if data:
-            return User.from_dict(data)
-        return None
-
-    async def get_moderation_by_user_and_photo(self, user_id: int, photo_file_id: str) -> Optional[ModerationItem]:
-        """Получить запись модерации по user_id и photo_file_id"""
-        data = await db.get_moderation_by_user_and_photo(user_id, photo_file_id)
-        if data:
-            return ModerationItem.from_dict(data)
-        return None
-
-    async def update_user_photo(self, user_id: int, photo_file_id: str):
-        """Обновить фото пользователя после одобрения модерации"""
-        await db.update_user_photo(user_id, photo_file_id)
-
-
-# Создаем глобальный экземпляр хранилища
+
+import time
+from dataclasses import replace
+from typing import Dict, List, Optional
+from .cache import UserCache
+from .config import cfg
+from .database.sqlite import db  # Изменено с database.py на database_sqlite.py
+from .database.transaction import Transaction
+from .feed import CandidateFeed
+from .profile_index import ProfileIndex
+from .seen import SeenStore
+# Модели живут в models.py (их строит и слой БД); импорт отсюда сохранён
+from .models import Like, ModerationItem, ModerationOutcome, User
+
+# Действие кнопки модерации → статус записи
+MODERATION_STATUSES = {'approve': 'approved', 'reject': 'rejected'}
+
+
+class Storage:
+    def __init__(self):
+        # Лента кандидатов для свайпов; инвалидируется при изменениях анкет ниже
+        self.feed = CandidateFeed(
+            self.get_candidates,
+            batch_size=cfg.feed_batch_size,
+            low_watermark=cfg.feed_low_watermark,
+        )
+        # Кэш точечных чтений пользователя по id и tg_id
+        self.user_cache = UserCache(maxsize=cfg.user_cache_size, ttl=cfg.user_cache_ttl)
+        # Кого пользователь уже лайкнул или пропустил — вместо NOT EXISTS в запросах
+        self.seen = SeenStore(
+            lambda user_id: db.load_seen_set(user_id),
+            lambda user_id, blob, like_mark, skip_mark: db.store_seen_set(user_id, blob, like_mark, skip_mark),
+            maxsize=cfg.seen_cache_size,
+            compact_after=cfg.seen_compact_after,
+        )
+        # Индекс активных анкет для подбора кандидатов; None — подбор SQL-запросом
+        self.profile_index = ProfileIndex(
+            lambda user_ids: db.get_profile_rows(user_ids),
+            self.seen.get,
+        ) if cfg.profile_index else None
+
+    def transaction(self) -> Transaction:
+        """Несколько операций одной транзакцией: ``async with storage.transaction() as tx:``.
+
+        Методы, принимающие ``tx``, выполняются в ней; кэш и ленты
+        сбрасываются только после COMMIT.
+        """
+        return db.transaction()
+
+    @staticmethod
+    def _on_commit(tx: Optional[Transaction], callback):
+        # Иначе параллельное чтение успеет положить в кэш незафиксированное состояние
+        if tx is None:
+            callback()
+        else:
+            tx.after_commit(callback)
+
+    def _forget_user(self, user_id: int, saved: Optional[User] = None):
+        """Сбросить пользователя из кэша, убрать из чужих лент и пересобрать его ленту.
+
+        saved — анкета после сохранения (None — пользователь удалён).
+        """
+        self.user_cache.invalidate(user_id=user_id)
+        self.feed.invalidate_candidate(user_id)
+        self.feed.reset(user_id)
+        if not saved:
+            self.seen.forget(user_id)
+        if self.profile_index:
+            if saved:
+                self.profile_index.upsert(saved)
+            else:
+                self.profile_index.remove(user_id)
+
+    def _forget_decided(self, user_id: int, user: Optional[User] = None):
+        """Сбросить анкету после решения модерации (фото и активность изменились)"""
+        self.user_cache.invalidate(user_id=user_id)
+        self.feed.invalidate_candidate(user_id)
+        if self.profile_index:
+            if user:
+                self.profile_index.upsert(user)
+            else:
+                self.profile_index.mark_dirty(user_id)
+
+    async def delete_user(self, user_id: int, tx: Optional[Transaction] = None) -> bool:
+        """Удалить пользователя по ID"""
+        deleted = await db.delete_user(user_id, tx=tx)
+        self._on_commit(tx, lambda: self._forget_user(user_id))
+        return deleted
+
+    async def delete_user_by_tg(self, tg_id: int, tx: Optional[Transaction] = None) -> bool:
+        """Удалить пользователя по Telegram ID"""
+        user = await self.get_user_by_tg(tg_id, tx=tx)
+        deleted = await db.delete_user_by_tg_id(tg_id, tx=tx)
+
+        def forget():
+            self.user_cache.invalidate(tg_id=tg_id)
+            if user:
+                self._forget_user(user.id)
+
+        self._on_commit(tx, forget)
+        return deleted
+
+    async def purge_abandoned_users(self, before: float, limit: int) -> int:
+        """Удалить пачку брошенных анкет, созданных раньше before; сколько удалено"""
+        purged = await db.purge_abandoned_users(before, limit)
+        for user_id, tg_id in purged:
+            self.user_cache.invalidate(tg_id=tg_id)
+            self._forget_user(user_id)
+        return len(purged)
+
+    async def get_moderation_by_id(self, moderation_id: int,
+                                   tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        """Получить запись модерации по ID"""
+        return await db.get_moderation_by_id(moderation_id, tx=tx)
+
+    async def get_pending_moderation_by_user(self, user_id: int,
+                                             tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        """Получить ожидающую модерацию запись для пользователя"""
+        return await db.get_pending_moderation_by_user(user_id, tx=tx)
+
+    async def get_any_candidate(self, current_user_id: int) -> Optional[User]:
+        """Получить любого кандидата, даже если цели не совпадают"""
+        return await db.get_any_candidate(current_user_id, await self.seen.get(current_user_id))
+
+    async def create_or_get_user(self, tg_id: int, tx: Optional[Transaction] = None) -> User:
+        if tx is not None:
+            return await db.create_or_get_user(tg_id, tx=tx)
+
+        token = self.user_cache.token()
+        user = await db.create_or_get_user(tg_id)
+        self.user_cache.put(user, token)
+        return user
+
+    async def get_user_by_id(self, user_id: int, tx: Optional[Transaction] = None) -> Optional[User]:
+        if tx is not None:
+            # Внутри транзакции читаем её собственное состояние, мимо кэша
+            return await db.get_user_by_id(user_id, tx=tx)
+
+        cached = self.user_cache.get_by_id(user_id)
+        if cached:
+            return cached
+
+        token = self.user_cache.token()
+        user = await db.get_user_by_id(user_id)
+        if user:
+            self.user_cache.put(user, token)
+        return user
+
+    async def get_user_by_tg(self, tg_id: int, tx: Optional[Transaction] = None) -> Optional[User]:
+        if tx is not None:
+            return await db.get_user_by_tg(tg_id, tx=tx)
+
+        cached = self.user_cache.get_by_tg(tg_id)
+        if cached:
+            return cached
+
+        token = self.user_cache.token()
+        user = await db.get_user_by_tg(tg_id)
+        if user:
+            self.user_cache.put(user, token)
+        return user
+
+    async def get_user_pair(self, tg_id: int, user_id: int) -> tuple[Optional[User], Optional[User]]:
+        """Пользователь по tg_id и собеседник по id: из кэша или одним запросом"""
+        user = self.user_cache.get_by_tg(tg_id)
+        other = self.user_cache.get_by_id(user_id)
+
+        if user is None and other is None:
+            token = self.user_cache.token()
+            user, other = await db.get_user_pair(tg_id, user_id)
+            for item in (user, other):
+                if item:
+                    self.user_cache.put(item, token)
+        elif user is None:
+            user = await self.get_user_by_tg(tg_id)
+        elif other is None:
+            other = await self.get_user_by_id(user_id)
+
+        return user, other
+
+    async def save_user(self, user: User, tx: Optional[Transaction] = None) -> bool:
+        """Сохранить изменённые поля пользователя.
+
+        Пишутся только поля, изменённые после загрузки, и только если строку
+        за это время никто не поменял (версия совпадает). При конфликте
+        возвращает False и ничего не записывает.
+        """
+        changes = user.changes()
+        if not changes:
+            return True
+
+        if not await db.update_user(user.id, expected_version=user.version, tx=tx, **changes):
+            self.user_cache.invalidate(user_id=user.id)
+            return False
+
+        user.version += 1
+        user.mark_clean()
+        # Анкета могла измениться или деактивироваться: убираем её из чужих лент,
+        # а ленту самого пользователя пересобираем под новые пол и цель
+        user_id = user.id
+        # Копия: до COMMIT вызывающий код может снова поменять анкету
+        saved = replace(user)
+        self._on_commit(tx, lambda: self._forget_user(user_id, saved))
+        return True
+
+    async def add_like(self, from_uid: int, to_uid: int, tx: Optional[Transaction] = None) -> tuple[bool, bool]:
+        """Поставить лайк; возвращает (created, is_mutual)"""
+        created, is_mutual = await db.add_like(from_uid, to_uid, tx=tx)
+        self.feed.discard(from_uid, to_uid)
+        self._mark_seen(tx, from_uid, to_uid)
+        return created, is_mutual
+
+    async def add_skip(self, from_uid: int, to_uid: int, tx: Optional[Transaction] = None) -> None:
+        await db.add_skip(from_uid, to_uid, tx=tx)
+        self.feed.discard(from_uid, to_uid)
+        self._mark_seen(tx, from_uid, to_uid)
+
+    def _mark_seen(self, tx: Optional[Transaction], from_uid: int, to_uid: int):
+        self._on_commit(tx, lambda: self.seen.add(from_uid, to_uid))
+
+    async def expire_skips(self, before: float, limit: int) -> int:
+        """Удалить пачку пропусков старше before; анкеты снова попадут в ленты"""
+        count, user_ids = await db.expire_skips(before, limit)
+        for user_id in user_ids:
+            # Множество перечитается из БД уже без удалённых пропусков
+            self.seen.forget(user_id)
+        return count
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Вернуть ОС до pages свободных страниц файла БД"""
+        return await db.incremental_vacuum(pages)
+
+    async def has_liked(self, from_uid: int, to_uid: int, tx: Optional[Transaction] = None) -> bool:
+        return await db.has_liked(from_uid, to_uid, tx=tx)
+
+    async def get_likes_to_user(self, user_id: int) -> List[Like]:
+        """Получить всех, кто лайкнул пользователя"""
+        return await db.get_likes_to_user(user_id)
+
+    async def get_likes_inbox(self, user_id: int, limit: int,
+                              cursor: tuple[str, int] | None = None) -> tuple[List[User], Optional[tuple[str, int]]]:
+        """Страница лайкнувших без ответа и курсор следующей страницы (или None)"""
+        rows = await db.get_unanswered_likes(user_id, limit + 1, cursor)
+        page = rows[:limit]
+
+        next_cursor = None
+        if len(rows) > limit:
+            _, like_id, like_created_at = page[-1]
+            next_cursor = (like_created_at, like_id)
+
+        return [user for user, _, _ in page], next_cursor
+
+    async def get_stats(self) -> Dict[str, int]:
+        """Счётчики статистики бота"""
+        return await db.get_stats()
+
+    async def recount_stats(self) -> Dict[str, int]:
+        """Пересчитать счётчики статистики по таблицам"""
+        return await db.recount_stats()
+
+    async def add_pending_like(self, chat_id: int, now: float) -> tuple[int, float]:
+        """Учесть лайк для дайджеста получателя"""
+        return await db.add_pending_like(chat_id, now)
+
+    async def take_pending_likes(self, chat_id: int) -> int:
+        """Забрать и обнулить накопленные лайки получателя"""
+        return await db.take_pending_likes(chat_id)
+
+    async def get_pending_likes(self) -> List[tuple[int, int, float]]:
+        """Незавершённые дайджесты лайков (для восстановления после перезапуска)"""
+        return await db.get_pending_likes()
+
+    async def get_pending_moderation(self) -> Optional[ModerationItem]:
+        """Получить первую фотографию на модерацию со статусом pending"""
+        return await db.get_pending_moderation()
+
+    async def add_moderation(self, user_id: int, photo_file_id: str, photo_unique_id: Optional[str] = None,
+                             tx: Optional[Transaction] = None) -> Optional[ModerationOutcome]:
+        """Добавить фото на модерацию.
+
+        Уже проверенное раньше фото (по file_unique_id) решается сразу —
+        тогда возвращается ModerationOutcome, иначе None.
+        """
+        outcome = await db.add_moderation(user_id, photo_file_id, photo_unique_id, tx=tx)
+        if outcome:
+            self._on_commit(tx, lambda: self._forget_decided(user_id, outcome.user))
+        return outcome
+
+    async def set_moderation_status(self, user_id: int, photo_file_id: str, status: str,
+                                    tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        """Установить статус модерации для конкретного фото пользователя"""
+        item = await db.set_moderation_status(user_id, photo_file_id, status, tx=tx)
+        self._on_commit(tx, lambda: self.feed.invalidate_candidate(user_id))
+        return item
+
+    async def decide_moderation(self, moderation_id: int, action: str, admin_id: int,
+                                tx: Optional[Transaction] = None) -> ModerationOutcome:
+        """Одобрить или отклонить фото ('approve'/'reject') одним обращением к БД.
+
+        Решение применяется только к ожидающей записи: повторный колбэк
+        ничего не меняет и возвращает applied=False. Запись, закреплённая за
+        другим админом или с истёкшей арендой, не меняется (lost=True).
+        """
+        if action not in MODERATION_STATUSES:
+            raise ValueError(f'Неизвестное действие модерации: {action}')
+
+        outcome = await db.decide_moderation(moderation_id, MODERATION_STATUSES[action], admin_id,
+                                             time.time(), tx=tx)
+        if outcome.applied:
+            user_id = outcome.item.user_id
+            self._on_commit(tx, lambda: self._forget_decided(user_id, outcome.user))
+        return outcome
+
+    async def claim_moderation_batch(self, admin_id: int, limit: Optional[int] = None,
+                                     lease: Optional[float] = None) -> List[tuple[ModerationItem, Optional[User]]]:
+        """Взять в работу пачку фото на модерацию: [(запись, анкета), ...].
+
+        Записи закрепляются за админом на lease секунд — другие админы их не
+        получат, пока аренда не истечёт или записи не вернут в очередь.
+        """
+        return await db.claim_moderation_batch(
+            admin_id,
+            limit or cfg.moderation_batch_size,
+            cfg.moderation_lease if lease is None else lease,
+            time.time(),
+        )
+
+    async def release_moderation_claims(self, moderation_ids: List[int], admin_id: int) -> int:
+        """Вернуть в очередь записи, по которым админ не принял решения"""
+        return await db.release_moderation_claims(moderation_ids, admin_id)
+
+    async def decide_moderation_batch(self, decisions: Dict[int, str], admin_id: int) -> List[ModerationOutcome]:
+        """Применить решения {moderation_id: 'approve'/'reject'} одной транзакцией"""
+        unknown = set(decisions.values()) - MODERATION_STATUSES.keys()
+        if unknown:
+            raise ValueError(f'Неизвестное действие модерации: {", ".join(sorted(unknown))}')
+
+        async with self.transaction() as tx:
+            return [
+                await self.decide_moderation(moderation_id, action, admin_id, tx=tx)
+                for moderation_id, action in decisions.items()
+            ]
+
+    async def get_user_moderation_status(self, user_id: int, tx: Optional[Transaction] = None) -> Optional[str]:
+        """Получить статус модерации последней фотографии пользователя"""
+        return await db.get_user_moderation_status(user_id, tx=tx)
+
+    async def get_next_candidate(self, current_user_id: int) -> Optional[User]:
+        return await db.get_next_candidate(current_user_id, await self.seen.get(current_user_id))
+
+    async def get_candidates(self, current_user_id: int, limit: int,
+                             exclude_ids: List[int] | None = None) -> List[User]:
+        """Получить пачку кандидатов в порядке показа"""
+        if self.profile_index is None:
+            return await db.get_candidates(current_user_id, limit, exclude_ids, await self.seen.get(current_user_id))
+
+        # Порядок считает индекс в памяти, из БД читаются только выбранные анкеты
+        candidate_ids = await self.profile_index.rank(current_user_id, limit, exclude_ids or ())
+        return await db.get_active_users_by_ids(candidate_ids)
+
+    async def get_feed_candidate(self, current_user_id: int) -> Optional[User]:
+        """Следующая анкета из предподобранной ленты пользователя"""
+        return await self.feed.next_candidate(current_user_id)
+
+    def prefetch_feed(self, user_id: int):
+        """Начать подбор ленты заранее, чтобы первый свайп не ждал запроса"""
+        self.feed.prefetch(user_id)
+
+    async def get_moderation_by_user_and_photo(self, user_id: int, photo_file_id: str,
+                                               tx: Optional[Transaction] = None) -> Optional[ModerationItem]:
+        """Получить запись модерации по user_id и photo_file_id"""
+        return await db.get_moderation_by_user_and_photo(user_id, photo_file_id, tx=tx)
+
+    async def update_user_photo(self, user_id: int, photo_file_id: str, tx: Optional[Transaction] = None):
+        """Обновить фото пользователя после одобрения модерации"""
+        await db.update_user_photo(user_id, photo_file_id, tx=tx)
+        self._on_commit(tx, lambda: self._forget_decided(user_id))
+
+
+# Создаем глобальный экземпляр хранилища
 storage = Storage()
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from .config import cfg
+
+logger = logging.getLogger(__name__)
+
+ProcessUpdate = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def get_chat_key(update: Dict[str, Any]) -> Optional[int]:
+    """Чат, к которому относится апдейт (для колбэков — чат сообщения с кнопкой)"""
+    for key, payload in update.items():
+        if key == 'update_id' or not isinstance(payload, dict):
+            continue
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if chat:
+            return chat.get('id')
+        user = payload.get('from') or payload.get('user')
+        if user:
+            return user.get('id')
+    return None
+
+
+class UpdateScheduler:
+    """Параллельная обработка апдейтов с сохранением порядка внутри чата.
+
+    Одновременно работает не больше ``max_workers`` обработчиков. Апдейты
+    одного чата (два быстрых нажатия «лайк») выстраиваются в цепочку и
+    обрабатываются строго по очереди; разные чаты друг друга не ждут.
+    """
+
+    def __init__(self, process: ProcessUpdate, max_workers: int = 32, per_chat_ordering: bool = True):
+        self._process = process
+        self.per_chat_ordering = per_chat_ordering
+        self._slots = asyncio.Semaphore(max_workers)
+        self._chains: Dict[int, Deque[Dict[str, Any]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, update: Dict[str, Any]):
+        key = get_chat_key(update) if self.per_chat_ordering else None
+        if key is None:
+            self._spawn(self._run_one(update))
+            return
+
+        chain = self._chains.get(key)
+        if chain is not None:
+            chain.append(update)
+            return
+
+        self._chains[key] = deque([update])
+        self._spawn(self._run_chain(key))
+
+    async def close(self):
+        """Дождаться обработки всего, что уже принято"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn(self, coro: Awaitable[None]):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_chain(self, key: int):
+        chain = self._chains[key]
+        try:
+            while chain:
+                await self._run_one(chain.popleft())
+        finally:
+            del self._chains[key]
+
+    async def _run_one(self, update: Dict[str, Any]):
+        async with self._slots:
+            try:
+                await self._process(update)
+            except Exception:
+                logger.exception('Ошибка при обработке апдейта %s', update.get('update_id'))
+
+
+class OrderedRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука aiogram: сразу отвечает Telegram и передаёт апдейт планировщику"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_workers: int = 32,
+                 per_chat_ordering: bool = True, secret_token: str | None = None, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.scheduler = UpdateScheduler(
+            lambda update: self._background_feed_update(bot=self.bot, update=update),
+            max_workers=max_workers,
+            per_chat_ordering=per_chat_ordering,
+        )
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        self.scheduler.submit(await request.json(loads=bot.session.json_loads))
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self):
+        await self.scheduler.close()
+        await super().close()
+
+
+def create_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """aiohttp-приложение с эндпоинтом вебхука и хуками startup/shutdown диспетчера"""
+    app = web.Application()
+    handler = OrderedRequestHandler(
+        dp,
+        bot,
+        max_workers=cfg.webhook_max_workers,
+        per_chat_ordering=cfg.webhook_chat_ordering,
+        secret_token=cfg.webhook_secret or None,
+    )
+    handler.register(app, path=cfg.webhook_path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Запустить бота в режиме вебхука (вместо long polling)"""
+
+    async def on_startup(bot: Bot):
+        await bot.set_webhook(
+            cfg.webhook_url + cfg.webhook_path,
+            secret_token=cfg.webhook_secret or None,
+            drop_pending_updates=False,
+        )
+
+    dp.startup.register(on_startup)
+
+    runner = web.AppRunner(create_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, cfg.webhook_host, cfg.webhook_port)
+    await site.start()
+    logger.info('Вебхук слушает %s:%s%s', cfg.webhook_host, cfg.webhook_port, cfg.webhook_path)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -1,8 +1,11 @@
 ﻿import asyncio
+import os
 import sys
+import tempfile
 from pathlib import Path
 
 import pytest
+import pytest_asyncio
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
@@ -10,6 +13,9 @@ if str(ROOT) not in sys.path:
 
 import sqlite3
 
+# Глобальная база (если к ней обратится код без подмены) — во временном файле, а не в dating_bot.db
+os.environ['DB_PATH'] = str(Path(tempfile.mkdtemp()) / 'global.db')
+
 from src.database import sqlite as sqlite_module  # noqa: E402
 from src import storage as storage_module  # noqa: E402
 
@@ -75,19 +81,39 @@ def temp_db(tmp_path):
 @pytest.fixture
 def storage_with_db(monkeypatch, temp_db):
     monkeypatch.setattr(storage_module, "db", temp_db)
-    return storage_module.storage
+    # Storage держит ленту кандидатов в памяти — на каждый тест свой экземпляр
+    current_storage = storage_module.Storage()
+    monkeypatch.setattr(storage_module, "storage", current_storage)
+    return current_storage
 
 
-@pytest.fixture
-def handlers_storage(monkeypatch, tmp_path):
+@pytest_asyncio.fixture
+async def handlers_storage(monkeypatch, tmp_path):
     db = sqlite_module.SQLiteDatabase(tmp_path / "handlers.db")
     ensure_tables(db.db_path)
     monkeypatch.setattr(storage_module, "db", db)
-    current_storage = storage_module.storage
+    current_storage = storage_module.Storage()
+    monkeypatch.setattr(storage_module, "storage", current_storage)
 
     from src.handlers import browse, profile, admin  # noqa: E402
+    from src import consumers  # noqa: E402
+    from src.digest import LikeDigest  # noqa: E402
+    from src.events import bus  # noqa: E402
+    from src.outbox import Outbox  # noqa: E402
 
     monkeypatch.setattr(browse, "storage", current_storage)
     monkeypatch.setattr(profile, "storage", current_storage)
     monkeypatch.setattr(admin, "storage", current_storage)
-    return current_storage
+
+    # Своя очередь отправки, чтобы счётчики не смешивались между тестами
+    current_outbox = Outbox()
+    monkeypatch.setattr(browse, "outbox", current_outbox)
+    monkeypatch.setattr(admin, "outbox", current_outbox)
+    current_digest = LikeDigest(current_storage, current_outbox)
+    monkeypatch.setattr(consumers, "storage", current_storage)
+    monkeypatch.setattr(consumers, "outbox", current_outbox)
+    monkeypatch.setattr(consumers, "like_digest", current_digest)
+    yield current_storage
+    # Подписчики событий могут ещё работать — даём им завершиться
+    await bus.drain()
+    current_digest.close()
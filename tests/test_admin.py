@@ -4,6 +4,7 @@ import pytest
 
 from src.handlers import admin
 from src.config import cfg
+from tests.test_handlers import FakeState
 
 
 class DummyMessage:
@@ -19,6 +20,11 @@ class DummyMessage:
     async def answer_photo(self, photo, caption, reply_markup=None):
         self.photo_answers.append((photo, caption))
 
+    async def answer_media_group(self, media):
+        if not 2 <= len(media) <= 10:
+            raise ValueError('sendMediaGroup принимает от 2 до 10 элементов')
+        self.photo_answers.extend((item.media, item.caption) for item in media)
+
     async def edit_reply_markup(self, reply_markup=None):
         return None
 
@@ -124,7 +130,7 @@ class FakeStorage:
 
 
 @pytest.mark.asyncio
-async def test_admin_stats_and_users(monkeypatch):
+async def test_admin_stats_and_users(monkeypatch, handlers_storage):
     cfg.admin_ids = {2}
     cfg.admin_mode = {2: True}
     monkeypatch.setattr(admin, "sqlite3", SimpleNamespace(connect=lambda _path: DummyConnection()))
@@ -161,3 +167,171 @@ async def test_admin_quick_delete(monkeypatch):
     callback = DummyCallback("admin:quick_delete:1", user_id=7)
     await admin.admin_quick_delete(callback)
     assert isinstance(callback.answers, list)
+
+
+@pytest.mark.asyncio
+async def test_admin_stats_counters_follow_writes(handlers_storage):
+    u1 = await handlers_storage.create_or_get_user(801)
+    u2 = await handlers_storage.create_or_get_user(802)
+    u1.is_active = True
+    u1.photo_file_id = "photo"
+    await handlers_storage.save_user(u1)
+    await handlers_storage.add_like(u1.id, u2.id)
+    await handlers_storage.add_like(u2.id, u1.id)
+    await handlers_storage.add_moderation(u2.id, "photo2")
+
+    stats = await handlers_storage.get_stats()
+    assert stats == await handlers_storage.recount_stats()
+    assert stats["total_users"] == 2
+    assert stats["active_users"] == 1
+    assert stats["users_with_photo"] == 1
+    assert stats["mutual_likes"] == 2
+    assert stats["pending_mod"] == 1
+
+    await handlers_storage.delete_user(u2.id)
+    stats = await handlers_storage.get_stats()
+    assert stats == await handlers_storage.recount_stats()
+    assert stats["total_likes"] == 0
+
+    cfg.admin_ids = {9}
+    cfg.admin_mode = {9: True}
+    msg = DummyMessage(user_id=9)
+    await admin.admin_stats(msg)
+    assert "Всего: 1" in msg.answers[-1]
+
+    await admin.cmd_recountstats(msg)
+    assert msg.answers[-1] == "✅ Счётчики статистики совпадают с данными."
+
+
+@pytest.mark.asyncio
+async def test_cb_mod_decides_once(handlers_storage):
+    from src.events import bus
+
+    user = await handlers_storage.create_or_get_user(901)
+    await handlers_storage.add_moderation(user.id, "photo")
+    item = await handlers_storage.get_pending_moderation_by_user(user.id)
+
+    sent = []
+
+    class Bot:
+        async def send_message(self, chat_id, text, **kwargs):
+            sent.append((chat_id, text))
+
+    cfg.admin_ids = {9}
+    callback = DummyCallback(f"mod:approve:{item.id}", user_id=9)
+    callback.message.bot = Bot()
+    await admin.cb_mod(callback, FakeState())
+    await bus.drain()
+    await admin.outbox.drain()
+
+    assert callback.answers == ["✅ Фото одобрено"]
+    approved = await handlers_storage.get_user_by_id(user.id)
+    assert approved.is_active is True and approved.photo_file_id == "photo"
+    assert await handlers_storage.get_user_moderation_status(user.id) == "approved"
+    assert len(sent) == 1
+
+    # Повторное нажатие (или «Отклонить» после одобрения) ничего не меняет
+    repeat = DummyCallback(f"mod:reject:{item.id}", user_id=9)
+    repeat.message.bot = Bot()
+    await admin.cb_mod(repeat, FakeState())
+    await bus.drain()
+
+    assert repeat.answers == ["Решение по этому фото уже принято"]
+    assert await handlers_storage.get_user_moderation_status(user.id) == "approved"
+    assert len(sent) == 1
+
+
+@pytest.mark.asyncio
+async def test_cb_mod_rejects_malformed_data(handlers_storage):
+    user = await handlers_storage.create_or_get_user(902)
+    await handlers_storage.add_moderation(user.id, "photo")
+    item = await handlers_storage.get_pending_moderation_by_user(user.id)
+
+    cfg.admin_ids = {9}
+    for data in (f"mod:ban:{item.id}", "mod:approve:abc", "mod:approve", f"mod:approve:{item.id}:x"):
+        callback = DummyCallback(data, user_id=9)
+        await admin.cb_mod(callback, FakeState())
+        assert callback.answers == ["Некорректные данные"]
+
+    assert await handlers_storage.get_user_moderation_status(user.id) == "pending"
+
+
+@pytest.mark.asyncio
+async def test_moderation_batch_applies_marked_decisions(handlers_storage):
+    from src.events import bus
+
+    users = []
+    for tg_id in (911, 912, 913):
+        user = await handlers_storage.create_or_get_user(tg_id)
+        await handlers_storage.add_moderation(user.id, f"photo{tg_id}")
+        users.append(user)
+
+    sent = []
+
+    class Bot:
+        async def send_message(self, chat_id, text, **kwargs):
+            sent.append((chat_id, text))
+
+    cfg.admin_ids = {9, 10}
+    cfg.admin_mode[9] = True
+    state = FakeState()
+    msg = DummyMessage(user_id=9, text="📸 Модерация фото")
+    await admin.admin_moderation(msg, state)
+
+    batch = state.data["moderation_batch"]
+    assert len(batch) == 3
+    assert [photo for photo, _ in msg.photo_answers] == ["photo911", "photo912", "photo913"]
+
+    # Второй админ не получает уже взятые фото
+    other = DummyMessage(user_id=10)
+    await admin.show_moderation_batch(other, 10, FakeState())
+    assert other.answers == ["✅ Нет фото на проверку."]
+
+    for data in (f"modb:mark:{batch[0]}:approve", f"modb:mark:{batch[1]}:reject"):
+        await admin.cb_mod_batch_mark(DummyCallback(data, user_id=9), state)
+    assert state.data["moderation_marks"] == {str(batch[0]): "approve", str(batch[1]): "reject"}
+
+    callback = DummyCallback("modb:apply", user_id=9)
+    callback.message.bot = Bot()
+    await admin.cb_mod_batch_apply(callback, state)
+    await bus.drain()
+    await admin.outbox.drain()
+
+    assert callback.answers == ["✅ Применено решений: 2"]
+    assert (await handlers_storage.get_user_by_id(users[0].id)).is_active is True
+    assert await handlers_storage.get_user_moderation_status(users[1].id) == "rejected"
+    assert await handlers_storage.get_user_moderation_status(users[2].id) == "pending"
+    assert len(sent) == 2
+
+    # Неотмеченное фото вернулось в очередь и сразу пришло следующей пачкой
+    assert state.data["moderation_batch"] == [batch[2]]
+    # Пачка из одного фото приходит обычным фото (медиагруппа требует минимум два)
+    assert callback.message.photo_answers[-1][0] == "photo913"
+    assert not any("Не удалось загрузить фото" in text for text in callback.message.answers)
+
+
+@pytest.mark.asyncio
+async def test_moderation_batch_reports_reassigned_photos(handlers_storage):
+    import sqlite3
+    from src import storage as storage_module
+
+    user = await handlers_storage.create_or_get_user(921)
+    await handlers_storage.add_moderation(user.id, "photo921")
+
+    cfg.admin_ids = {9, 10}
+    state = FakeState()
+    await admin.show_moderation_batch(DummyMessage(user_id=9), 9, state)
+    [moderation_id] = state.data["moderation_batch"]
+    await admin.cb_mod_batch_mark(DummyCallback(f"modb:mark:{moderation_id}:approve", user_id=9), state)
+
+    # Аренда админа 9 истекла, фото забрал админ 10
+    with sqlite3.connect(storage_module.db.db_path) as conn:
+        conn.execute('UPDATE moderation SET claimed_until = 0')
+    assert len(await handlers_storage.claim_moderation_batch(10)) == 1
+
+    callback = DummyCallback("modb:apply", user_id=9)
+    await admin.cb_mod_batch_apply(callback, state)
+
+    assert callback.answers == ["✅ Применено решений: 0"]
+    assert any("Переданы другому админу" in text for text in callback.message.answers)
+    assert await handlers_storage.get_user_moderation_status(user.id) == "pending"
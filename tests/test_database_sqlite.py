@@ -1,4 +1,5 @@
 ﻿import sqlite3
+import time
 import pytest
 
 
@@ -6,10 +7,10 @@ import pytest
 async def test_create_and_get_user(temp_db):
     try:
         user = await temp_db.create_or_get_user(12345)
-        assert user["tg_id"] == 12345
+        assert user.tg_id == 12345
 
         same_user = await temp_db.get_user_by_tg(12345)
-        assert same_user["id"] == user["id"]
+        assert same_user.id == user.id
     except sqlite3.OperationalError:
         assert True
 
@@ -20,16 +21,16 @@ async def test_update_user(temp_db):
         user = await temp_db.create_or_get_user(1)
 
         await temp_db.update_user(
-            user["id"],
+            user.id,
             name="Alice",
             age=25,
             gender="Женский",
             is_active=True,
         )
 
-        updated = await temp_db.get_user_by_id(user["id"])
+        updated = await temp_db.get_user_by_id(user.id)
         assert updated is not None
-        assert updated["name"] == "Alice"
+        assert updated.name == "Alice"
     except sqlite3.OperationalError:
         assert True
 
@@ -40,15 +41,16 @@ async def test_likes_and_mutual(temp_db):
         u1 = await temp_db.create_or_get_user(10)
         u2 = await temp_db.create_or_get_user(11)
 
-        like1 = await temp_db.add_like(u1["id"], u2["id"])
-        assert "is_mutual" in like1
+        created, is_mutual = await temp_db.add_like(u1.id, u2.id)
+        assert created is True
+        assert is_mutual is False
 
-        await temp_db.add_like(u2["id"], u1["id"])
-        likes_to_u1 = await temp_db.get_likes_to_user(u1["id"])
+        await temp_db.add_like(u2.id, u1.id)
+        likes_to_u1 = await temp_db.get_likes_to_user(u1.id)
         assert likes_to_u1
     except sqlite3.OperationalError:
         assert True
-    assert any(l["is_mutual"] for l in likes_to_u1)
+    assert any(l.is_mutual for l in likes_to_u1)
 
 
 @pytest.mark.asyncio
@@ -57,12 +59,12 @@ async def test_get_next_candidate(temp_db):
         u1 = await temp_db.create_or_get_user(20)
         u2 = await temp_db.create_or_get_user(21)
 
-        await temp_db.update_user(u1["id"], is_active=True)
-        await temp_db.update_user(u2["id"], is_active=True)
+        await temp_db.update_user(u1.id, is_active=True)
+        await temp_db.update_user(u2.id, is_active=True)
 
-        candidate = await temp_db.get_next_candidate(u1["id"])
+        candidate = await temp_db.get_next_candidate(u1.id)
         assert candidate is not None
-        assert candidate["id"] != u1["id"]
+        assert candidate.id != u1.id
     except sqlite3.OperationalError:
         assert True
 
@@ -70,13 +72,13 @@ async def test_get_next_candidate(temp_db):
 @pytest.mark.asyncio
 async def test_moderation_flow(temp_db):
     user = await temp_db.create_or_get_user(30)
-    await temp_db.add_moderation(user["id"], "file123")
+    await temp_db.add_moderation(user.id, "file123")
 
     pending = await temp_db.get_pending_moderation()
-    assert pending["user_id"] == user["id"]
+    assert pending.user_id == user.id
 
-    await temp_db.set_moderation_status(user["id"], pending["photo_file_id"], "approved")
-    status = await temp_db.get_user_moderation_status(user["id"])
+    await temp_db.set_moderation_status(user.id, pending.photo_file_id, "approved")
+    status = await temp_db.get_user_moderation_status(user.id)
     assert status == "approved"
 
 
@@ -84,22 +86,45 @@ async def test_moderation_flow(temp_db):
 async def test_delete_user_and_by_tg(temp_db):
     u1 = await temp_db.create_or_get_user(40)
     u2 = await temp_db.create_or_get_user(41)
-    await temp_db.add_like(u1["id"], u2["id"])
-    await temp_db.add_moderation(u1["id"], "photo")
+    await temp_db.add_like(u1.id, u2.id)
+    await temp_db.add_moderation(u1.id, "photo")
 
-    deleted = await temp_db.delete_user(u1["id"])
+    deleted = await temp_db.delete_user(u1.id)
     assert deleted is True
 
     deleted_tg = await temp_db.delete_user_by_tg_id(9999)
     assert deleted_tg is False
 
 
+@pytest.mark.asyncio
+async def test_delete_user_cascades_to_related_rows(temp_db):
+    gone = await temp_db.create_or_get_user(50)
+    kept = await temp_db.create_or_get_user(51)
+    await temp_db.add_like(gone.id, kept.id)
+    await temp_db.add_like(kept.id, gone.id)
+    await temp_db.add_skip(kept.id, gone.id)
+    await temp_db.add_moderation(gone.id, "photo", "uniq")
+    item = await temp_db.get_moderation_by_user_and_photo(gone.id, "photo")
+    await temp_db.decide_moderation(item.id, "rejected", 42)
+    await temp_db.store_seen_set(gone.id, b"", 0, 0)
+
+    assert await temp_db.delete_user_by_tg_id(50) is True
+    assert await temp_db.delete_user_by_tg_id(50) is False
+
+    with sqlite3.connect(temp_db.db_path) as conn:
+        for table in ("likes", "skips", "moderation", "seen_sets"):
+            assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0, table
+        # Решение по фото переживает удаление автора
+        assert conn.execute("SELECT status FROM photo_verdicts").fetchall() == [("rejected",)]
+    assert await temp_db.recount_stats() == await temp_db.get_stats()
+
+
 @pytest.mark.asyncio
 async def test_get_all_active_users(temp_db):
     u1 = await temp_db.create_or_get_user(50)
     u2 = await temp_db.create_or_get_user(51)
-    await temp_db.update_user(u1["id"], is_active=True)
-    await temp_db.update_user(u2["id"], is_active=False)
+    await temp_db.update_user(u1.id, is_active=True)
+    await temp_db.update_user(u2.id, is_active=False)
 
     active = await temp_db.get_all_active_users()
     assert len(active) == 1
@@ -109,14 +134,14 @@ async def test_get_all_active_users(temp_db):
 async def test_update_user_photo_and_moderation_lookup(temp_db):
     try:
         user = await temp_db.create_or_get_user(70)
-        await temp_db.add_moderation(user["id"], "file999")
-        await temp_db.update_user_photo(user["id"], "file999")
+        await temp_db.add_moderation(user.id, "file999")
+        await temp_db.update_user_photo(user.id, "file999")
 
-        updated = await temp_db.get_user_by_id(user["id"])
-        assert updated["photo_file_id"] == "file999"
-        assert bool(updated["is_active"]) is True
+        updated = await temp_db.get_user_by_id(user.id)
+        assert updated.photo_file_id == "file999"
+        assert updated.is_active is True
 
-        item = await temp_db.get_moderation_by_user_and_photo(user["id"], "file999")
+        item = await temp_db.get_moderation_by_user_and_photo(user.id, "file999")
         assert item is not None
     except sqlite3.OperationalError:
         assert True
@@ -128,10 +153,10 @@ async def test_add_like_existing_and_has_liked(temp_db):
         u1 = await temp_db.create_or_get_user(90)
         u2 = await temp_db.create_or_get_user(91)
 
-        await temp_db.add_like(u1["id"], u2["id"])
-        await temp_db.add_like(u1["id"], u2["id"])
+        await temp_db.add_like(u1.id, u2.id)
+        await temp_db.add_like(u1.id, u2.id)
 
-        assert await temp_db.has_liked(u1["id"], u2["id"]) is True
+        assert await temp_db.has_liked(u1.id, u2.id) is True
     except sqlite3.OperationalError:
         assert True
 
@@ -139,16 +164,325 @@ async def test_add_like_existing_and_has_liked(temp_db):
 @pytest.mark.asyncio
 async def test_moderation_helpers(temp_db):
     user = await temp_db.create_or_get_user(100)
-    await temp_db.add_moderation(user["id"], "photo3")
+    await temp_db.add_moderation(user.id, "photo3")
 
-    pending = await temp_db.get_pending_moderation_by_user(user["id"])
+    pending = await temp_db.get_pending_moderation_by_user(user.id)
     assert pending is not None
 
-    by_id = await temp_db.get_moderation_by_id(pending["id"])
+    by_id = await temp_db.get_moderation_by_id(pending.id)
     assert by_id is not None
 
-    no_status = await temp_db.set_moderation_status(user["id"], pending["photo_file_id"], "approved")
+    no_status = await temp_db.set_moderation_status(user.id, pending.photo_file_id, "approved")
     assert no_status is not None
 
-    none_status = await temp_db.set_moderation_status(user["id"], pending["photo_file_id"], "approved")
+    none_status = await temp_db.set_moderation_status(user.id, pending.photo_file_id, "approved")
     assert none_status is None
+
+
+@pytest.mark.asyncio
+async def test_connection_pool_reuses_connections(tmp_path):
+    from src.database.sqlite import SQLiteDatabase
+
+    db = SQLiteDatabase(tmp_path / "pool.db", pool_size=2, max_workers=4)
+    try:
+        user = await db.create_or_get_user(1)
+        for _ in range(20):
+            await db.get_user_by_id(user.id)
+
+        stats = db.pool_stats()
+        assert stats.size == 2
+        assert stats.created <= 2
+        assert stats.checkouts >= 21
+        assert stats.in_use == 0
+    finally:
+        db.close()
+
+
+@pytest.mark.asyncio
+async def test_group_commit_writer_resolves_each_caller(tmp_path):
+    import asyncio
+    from src.database.sqlite import SQLiteDatabase
+
+    db = SQLiteDatabase(tmp_path / "wal.db", group_commit=True)
+    try:
+        with sqlite3.connect(db.db_path) as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        users = [await db.create_or_get_user(tg_id) for tg_id in range(1, 6)]
+        target = users[0].id
+        writes, batches = db.writer.stats.writes, db.writer.stats.batches
+
+        likes = await asyncio.gather(*(db.add_like(u.id, target) for u in users[1:]))
+        assert likes == [(True, False)] * 4
+
+        assert await db.add_like(target, users[1].id) == (True, True)
+
+        # Лайки, отправленные одновременно, коммитятся пачками
+        assert db.writer.stats.writes - writes == 5
+        assert db.writer.stats.batches - batches < 5
+    finally:
+        db.close()
+
+
+def test_migrations_upgrade_legacy_db_in_place(tmp_path):
+    from src.database.migrations import LATEST_VERSION, get_version
+    from src.database.sqlite import SQLiteDatabase
+    from tests.conftest import ensure_tables
+
+    db_path = tmp_path / "legacy.db"
+    ensure_tables(db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO users (tg_id, name) VALUES (1, 'Old')")
+        conn.execute("INSERT INTO moderation (user_id, photo_file_id, status) VALUES (1, 'p', 'approve')")
+        # Лайк удалённого раньше пользователя — без каскада такие строки оставались навсегда
+        conn.execute("INSERT INTO likes (from_user_id, to_user_id) VALUES (1, 99)")
+
+    db = SQLiteDatabase(db_path)
+    db.close()
+
+    with sqlite3.connect(db_path) as conn:
+        assert get_version(conn) == LATEST_VERSION
+        assert conn.execute("SELECT name FROM users WHERE tg_id = 1").fetchone()[0] == "Old"
+        assert conn.execute("SELECT status FROM moderation").fetchone()[0] == "approved"
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"idx_likes_to_user", "idx_moderation_pending", "idx_users_active_gender"} <= indexes
+        assert conn.execute("SELECT COUNT(*) FROM likes").fetchone()[0] == 0
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+
+    # Повторный запуск ничего не меняет
+    SQLiteDatabase(db_path).close()
+    with sqlite3.connect(db_path) as conn:
+        assert get_version(conn) == LATEST_VERSION
+
+
+@pytest.mark.asyncio
+async def test_get_next_candidate_prefers_same_goal(temp_db):
+    viewer = await temp_db.create_or_get_user(60)
+    same_goal = await temp_db.create_or_get_user(61)
+    other_goal = await temp_db.create_or_get_user(62)
+
+    await temp_db.update_user(viewer.id, gender="Мужской", goal="💼 Деловое", is_active=True)
+    await temp_db.update_user(same_goal.id, gender="Женский", goal="💼 Деловое", is_active=True)
+    await temp_db.update_user(other_goal.id, gender="Женский", goal="👥 Дружеское", is_active=True)
+
+    candidate = await temp_db.get_next_candidate(viewer.id)
+    assert candidate.id == same_goal.id
+
+    await temp_db.add_skip(viewer.id, same_goal.id)
+    candidate = await temp_db.get_next_candidate(viewer.id)
+    assert candidate.id == other_goal.id
+
+
+@pytest.mark.asyncio
+async def test_add_like_is_atomic_for_simultaneous_mutual_likes(temp_db):
+    import asyncio
+
+    users = [await temp_db.create_or_get_user(tg_id) for tg_id in range(200, 220)]
+    pairs = [(users[i].id, users[i + 1].id) for i in range(0, len(users), 2)]
+
+    results = await asyncio.gather(*(
+        temp_db.add_like(a, b) if forward else temp_db.add_like(b, a)
+        for a, b in pairs
+        for forward in (True, False)
+    ))
+
+    for i in range(0, len(results), 2):
+        # Оба лайка созданы, ровно один из них увидел матч
+        assert results[i][0] and results[i + 1][0]
+        assert results[i][1] != results[i + 1][1]
+
+    likes = await temp_db.get_likes_to_user(users[0].id)
+    assert likes[0].is_mutual is True
+
+    assert await temp_db.add_like(*pairs[0]) == (False, True)
+
+
+@pytest.mark.asyncio
+async def test_transaction_commits_once_and_rolls_back_on_error(temp_db):
+    user = await temp_db.create_or_get_user(300)
+    await temp_db.add_moderation(user.id, "photo")
+
+    async with temp_db.transaction() as tx:
+        item = await temp_db.set_moderation_status(user.id, "photo", "approve", tx=tx)
+        await temp_db.update_user_photo(user.id, "photo", tx=tx)
+        inside = await temp_db.get_user_by_id(user.id, tx=tx)
+        # Снаружи транзакции изменения ещё не видны
+        assert (await temp_db.get_user_by_id(user.id)).is_active is False
+
+    assert item.status == "approve"
+    assert inside.is_active is True
+    assert (await temp_db.get_user_by_id(user.id)).photo_file_id == "photo"
+
+    with pytest.raises(RuntimeError):
+        async with temp_db.transaction() as tx:
+            await temp_db.update_user(user.id, tx=tx, name="Rolled back")
+            raise RuntimeError
+
+    assert (await temp_db.get_user_by_id(user.id)).name == ""
+    assert temp_db.pool_stats().in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_transaction_failed_operation_rolls_back_only_itself(temp_db):
+    user = await temp_db.create_or_get_user(301)
+
+    async with temp_db.transaction() as tx:
+        await temp_db.update_user(user.id, tx=tx, name="Kept")
+        with pytest.raises(sqlite3.OperationalError):
+            await temp_db.update_user(user.id, tx=tx, no_such_column=1)
+
+    assert (await temp_db.get_user_by_id(user.id)).name == "Kept"
+
+
+@pytest.mark.asyncio
+async def test_transaction_operations_run_off_the_event_loop(temp_db):
+    import asyncio
+    import threading
+
+    users = [await temp_db.create_or_get_user(tg_id) for tg_id in (302, 303, 304)]
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def slow_op(conn):
+        threads.append(threading.get_ident())
+        time.sleep(0.05)
+        return conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    async def ticker():
+        ticks = 0
+        while not done.is_set():
+            ticks += 1
+            await asyncio.sleep(0.005)
+        return ticks
+
+    done = asyncio.Event()
+    ticks = asyncio.ensure_future(ticker())
+    async with temp_db.transaction() as tx:
+        # Параллельные вызовы с одним tx выполняются по очереди на его соединении
+        counts = await asyncio.gather(*(temp_db._read(slow_op, tx) for _ in users))
+    done.set()
+
+    assert counts == [3, 3, 3]
+    assert loop_thread not in threads
+    # Пока шли операции транзакции, цикл событий продолжал работать
+    assert await ticks > 5
+
+    user = await temp_db.create_or_get_user(310)
+    await temp_db.add_moderation(user.id, "photo")
+    item = await temp_db.get_pending_moderation_by_user(user.id)
+
+    outcome = await temp_db.decide_moderation(item.id, "approved", 42)
+    assert outcome.applied is True
+    assert (outcome.item.status, outcome.item.decided_by) == ("approved", 42)
+    assert outcome.user.is_active is True and outcome.user.photo_file_id == "photo"
+    assert outcome.user.version == user.version + 1
+
+    again = await temp_db.decide_moderation(item.id, "rejected", 43)
+    assert again.applied is False
+    assert (again.item.status, again.item.decided_by) == ("approved", 42)
+
+    missing = await temp_db.decide_moderation(10_000, "approved", 42)
+    assert missing.item is None and missing.applied is False
+
+
+@pytest.mark.asyncio
+async def test_claim_moderation_batch_is_disjoint_and_leased(temp_db):
+    for tg_id in range(320, 325):
+        user = await temp_db.create_or_get_user(tg_id)
+        await temp_db.add_moderation(user.id, f"photo{tg_id}")
+
+    first = await temp_db.claim_moderation_batch(1, 3, 60, now=1000)
+    second = await temp_db.claim_moderation_batch(2, 3, 60, now=1000)
+    first_ids = [item.id for item, _ in first]
+    second_ids = [item.id for item, _ in second]
+
+    assert len(first_ids) == 3 and len(second_ids) == 2
+    assert not set(first_ids) & set(second_ids)
+    assert all(user.id == item.user_id for item, user in first)
+    assert all(item.claimed_by == 1 and item.claimed_until == 1060 for item, _ in first)
+
+    # Пока аренда не истекла, свободных записей нет
+    assert await temp_db.claim_moderation_batch(3, 10, 60, now=1030) == []
+
+    # Брошенную пачку подбирает другой админ после конца аренды
+    reclaimed = await temp_db.claim_moderation_batch(3, 10, 60, now=1061)
+    assert sorted(item.id for item, _ in reclaimed) == sorted(first_ids + second_ids)
+
+    assert await temp_db.release_moderation_claims(first_ids, 3) == 3
+    again = await temp_db.claim_moderation_batch(1, 10, 60, now=1062)
+    assert [item.id for item, _ in again] == first_ids
+
+
+@pytest.mark.asyncio
+async def test_decide_moderation_respects_the_lease(temp_db):
+    users = [await temp_db.create_or_get_user(tg_id) for tg_id in (326, 327)]
+    for user in users:
+        await temp_db.add_moderation(user.id, f"photo{user.tg_id}")
+
+    [(stolen, _), (kept, _)] = await temp_db.claim_moderation_batch(111, 2, 60, now=1000)
+    # Аренда 111 истекла, первую запись перехватил 222
+    await temp_db.release_moderation_claims([kept.id], 111)
+    await temp_db.claim_moderation_batch(222, 1, 60, now=1061)
+
+    late = await temp_db.decide_moderation(stolen.id, "approved", 111, now=1062)
+    assert not late.applied and late.lost
+    assert late.item.status == "pending" and late.item.claimed_by == 222
+
+    # Новый владелец решает свою запись, свободная решается без аренды
+    owner = await temp_db.decide_moderation(stolen.id, "rejected", 222, now=1070)
+    assert owner.applied and not owner.lost
+    free = await temp_db.decide_moderation(kept.id, "approved", 111, now=1070)
+    assert free.applied
+
+    again = await temp_db.decide_moderation(stolen.id, "approved", 222, now=1071)
+    assert not again.applied and not again.lost
+
+
+@pytest.mark.asyncio
+async def test_photo_verdict_cache_resolves_known_photos(temp_db):
+    owner = await temp_db.create_or_get_user(330)
+    other = await temp_db.create_or_get_user(331)
+
+    assert await temp_db.add_moderation(owner.id, "ok1", "ok") is None
+    assert await temp_db.add_moderation(owner.id, "bad1", "bad") is None
+    ok, bad = [await temp_db.get_moderation_by_user_and_photo(owner.id, p) for p in ("ok1", "bad1")]
+    await temp_db.decide_moderation(ok.id, "approved", 42)
+    await temp_db.decide_moderation(bad.id, "rejected", 42)
+
+    # Одобрение действует только для владельца, отклонение — для всех
+    approved = await temp_db.add_moderation(owner.id, "ok2", "ok")
+    assert approved.applied and approved.item.status == "approved" and approved.item.decided_by is None
+    assert approved.user.is_active is True and approved.user.photo_file_id == "ok2"
+
+    rejected = await temp_db.add_moderation(other.id, "bad2", "bad")
+    assert rejected.item.status == "rejected" and rejected.user.is_active is False
+
+    assert await temp_db.add_moderation(other.id, "ok3", "ok") is None
+    assert await temp_db.get_pending_moderation_by_user(other.id) is not None
+
+    stats = await temp_db.get_stats()
+    assert (stats["photo_verdict_hits"], stats["photo_verdict_misses"]) == (2, 3)
+    assert await temp_db.recount_stats() == stats
+
+
+@pytest.mark.asyncio
+async def test_resubmitting_the_same_photo_reuses_its_row(temp_db):
+    owner = await temp_db.create_or_get_user(340)
+
+    assert await temp_db.add_moderation(owner.id, "photo", "uniq") is None
+    item = await temp_db.get_moderation_by_user_and_photo(owner.id, "photo")
+    await temp_db.decide_moderation(item.id, "approved", 42)
+
+    # Тот же file_id и file_unique_id: решение из кэша на той же записи
+    again = await temp_db.add_moderation(owner.id, "photo", "uniq")
+    assert again.applied and again.item.id == item.id and again.item.status == "approved"
+    assert again.user.is_active is True
+
+    # Без file_unique_id кэш не помогает — запись снова ждёт админа
+    assert await temp_db.add_moderation(owner.id, "photo") is None
+    pending = await temp_db.get_pending_moderation_by_user(owner.id)
+    assert pending.id == item.id and pending.decided_by is None
+
+    stats = await temp_db.get_stats()
+    assert (stats["total_mod"], stats["pending_mod"]) == (1, 1)
+    assert await temp_db.recount_stats() == stats
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from src.digest import LikeDigest, format_digest
+from src.outbox import Outbox
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_format_digest_plurals():
+    assert "Кто-то поставил вам лайк" in format_digest(1)
+    assert "3 новых лайка" in format_digest(3)
+    assert "11 новых лайков" in format_digest(11)
+    assert "21 новый лайк" in format_digest(21)
+
+
+@pytest.mark.asyncio
+async def test_digest_coalesces_likes_within_window(storage_with_db):
+    outbox = Outbox()
+    digest = LikeDigest(storage_with_db, outbox, window=0.05, threshold=10)
+    bot = RecordingBot()
+
+    for _ in range(3):
+        await digest.add(bot, 100)
+    assert bot.sent == []
+
+    await asyncio.sleep(0.1)
+    await outbox.drain()
+    assert bot.sent == [(100, format_digest(3))]
+    assert await storage_with_db.get_pending_likes() == []
+
+
+@pytest.mark.asyncio
+async def test_digest_flushes_at_threshold(storage_with_db):
+    outbox = Outbox()
+    digest = LikeDigest(storage_with_db, outbox, window=60, threshold=2)
+    bot = RecordingBot()
+
+    await digest.add(bot, 200)
+    await digest.add(bot, 200)
+    await outbox.drain()
+
+    assert bot.sent == [(200, format_digest(2))]
+    assert not digest._timers
+
+
+@pytest.mark.asyncio
+async def test_digest_survives_restart(storage_with_db):
+    first = LikeDigest(storage_with_db, Outbox(), window=60)
+    await first.add(RecordingBot(), 300)
+    await first.add(RecordingBot(), 300)
+    # «Перезапуск»: таймер прошлого процесса пропадает, счётчик остаётся в БД
+    first.close()
+
+    outbox = Outbox()
+    restarted = LikeDigest(storage_with_db, outbox, window=0)
+    bot = RecordingBot()
+    await restarted.start(bot)
+    await asyncio.sleep(0.01)
+    await outbox.drain()
+
+    assert bot.sent == [(300, format_digest(2))]
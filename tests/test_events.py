@@ -0,0 +1,58 @@
+import asyncio
+from dataclasses import dataclass
+
+import pytest
+
+from src.events import EventBus
+
+
+@dataclass(frozen=True)
+class Ping:
+    value: int
+
+
+@pytest.mark.asyncio
+async def test_bus_runs_consumers_concurrently_after_emit():
+    bus = EventBus()
+    started = []
+    release = asyncio.Event()
+
+    @bus.subscribe(Ping)
+    async def first(event):
+        started.append(("first", event.value))
+        await release.wait()
+
+    @bus.subscribe(Ping)
+    async def second(event):
+        started.append(("second", event.value))
+        await release.wait()
+
+    bus.emit(Ping(1))
+    # emit не ждёт подписчиков
+    assert started == []
+
+    await asyncio.sleep(0)
+    assert sorted(started) == [("first", 1), ("second", 1)]
+
+    release.set()
+    await bus.drain()
+
+
+@pytest.mark.asyncio
+async def test_bus_isolates_failing_consumer():
+    bus = EventBus()
+    delivered = []
+
+    @bus.subscribe(Ping)
+    async def broken(event):
+        raise RuntimeError("boom")
+
+    @bus.subscribe(Ping)
+    async def working(event):
+        delivered.append(event.value)
+
+    bus.emit(Ping(2))
+    bus.emit(object())  # без подписчиков — просто ничего не происходит
+    await bus.drain()
+
+    assert delivered == [2]
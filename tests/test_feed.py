@@ -0,0 +1,70 @@
+import pytest
+
+
+async def _active_user(storage, tg_id, gender, goal="💼 Деловое"):
+    user = await storage.create_or_get_user(tg_id)
+    user.name = f"User{tg_id}"
+    user.gender = gender
+    user.goal = goal
+    user.is_active = True
+    await storage.save_user(user)
+    return user
+
+
+@pytest.mark.asyncio
+async def test_feed_matches_sequential_candidate_order(storage_with_db):
+    viewer = await _active_user(storage_with_db, 1, "Мужской")
+    same_goal = await _active_user(storage_with_db, 2, "Женский")
+    other_goal = await _active_user(storage_with_db, 3, "Женский", goal="👥 Дружеское")
+    same_gender = await _active_user(storage_with_db, 4, "Мужской")
+
+    shown = []
+    while (candidate := await storage_with_db.get_feed_candidate(viewer.id)) is not None:
+        shown.append(candidate.id)
+        await storage_with_db.add_skip(viewer.id, candidate.id)
+
+    assert shown == [same_goal.id, other_goal.id, same_gender.id]
+
+
+@pytest.mark.asyncio
+async def test_feed_pops_from_queue_and_refills(storage_with_db, monkeypatch):
+    storage_with_db.feed.batch_size = 3
+    storage_with_db.feed.low_watermark = 1
+    viewer = await _active_user(storage_with_db, 10, "Мужской")
+    for tg_id in range(11, 18):
+        await _active_user(storage_with_db, tg_id, "Женский")
+
+    calls = []
+    fetch = storage_with_db.feed._fetch
+
+    async def counting_fetch(*args):
+        calls.append(args)
+        return await fetch(*args)
+
+    monkeypatch.setattr(storage_with_db.feed, "_fetch", counting_fetch)
+
+    seen = set()
+    for _ in range(7):
+        candidate = await storage_with_db.get_feed_candidate(viewer.id)
+        assert candidate.id not in seen
+        seen.add(candidate.id)
+        await storage_with_db.add_like(viewer.id, candidate.id)
+
+    assert len(calls) < 7
+    assert await storage_with_db.get_feed_candidate(viewer.id) is None
+
+
+@pytest.mark.asyncio
+async def test_feed_drops_deactivated_profiles(storage_with_db):
+    viewer = await _active_user(storage_with_db, 20, "Мужской")
+    first = await _active_user(storage_with_db, 21, "Женский")
+    second = await _active_user(storage_with_db, 22, "Женский")
+
+    # Наполняем ленту: второй кандидат остаётся в очереди
+    shown = await storage_with_db.get_feed_candidate(viewer.id)
+    queued = second if shown.id == first.id else first
+
+    queued.is_active = False
+    await storage_with_db.save_user(queued)
+
+    assert await storage_with_db.get_feed_candidate(viewer.id) is None
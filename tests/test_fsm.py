@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from src.fsm import SQLiteStorage
+from src.states import ProfileStates
+
+
+def make_key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+@pytest.mark.asyncio
+async def test_fsm_state_survives_restart(temp_db):
+    storage = SQLiteStorage(temp_db)
+    key = make_key(10)
+    await storage.set_state(key, ProfileStates.AGE)
+    await storage.update_data(key, {"name": "Алиса"})
+    await storage.close()
+
+    restarted = SQLiteStorage(temp_db)
+    assert await restarted.get_state(key) == ProfileStates.AGE.state
+    assert await restarted.get_data(key) == {"name": "Алиса"}
+
+    # Очищенное состояние удаляется из таблицы
+    await restarted.set_state(key, None)
+    await restarted.set_data(key, {})
+    await restarted.close()
+    assert await temp_db.load_fsm_state(storage.key_builder.build(key)) is None
+
+
+@pytest.mark.asyncio
+async def test_fsm_writes_are_batched(temp_db, monkeypatch):
+    storage = SQLiteStorage(temp_db, flush_interval=0.05, flush_batch=100)
+    batches = []
+    save = temp_db.save_fsm_states
+
+    async def counting_save(rows, expired_before=None):
+        batches.append(len(rows))
+        await save(rows, expired_before)
+
+    monkeypatch.setattr(temp_db, "save_fsm_states", counting_save)
+
+    for user_id in range(5):
+        await storage.set_state(make_key(user_id), ProfileStates.NAME)
+        await storage.update_data(make_key(user_id), {"step": 1})
+    assert batches == []
+
+    await asyncio.sleep(0.1)
+    assert batches == [5]
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_fsm_memory_is_bounded_without_losing_writes(temp_db):
+    storage = SQLiteStorage(temp_db, maxsize=2, flush_interval=60)
+    for user_id in range(5):
+        await storage.set_state(make_key(user_id), ProfileStates.GENDER)
+
+    assert len(storage._front) == 2
+    # Вытесненный, но ещё не записанный ключ читается из несохранённых изменений
+    assert await storage.get_state(make_key(0)) == ProfileStates.GENDER.state
+    await storage.close()
+
+    restarted = SQLiteStorage(temp_db)
+    assert await restarted.get_state(make_key(4)) == ProfileStates.GENDER.state
+
+
+@pytest.mark.asyncio
+async def test_fsm_idle_state_expires(temp_db):
+    storage = SQLiteStorage(temp_db, ttl=0.05)
+    key = make_key(1)
+    await storage.set_state(key, ProfileStates.PHOTO)
+    await storage.update_data(key, {"name": "Боб"})
+
+    await asyncio.sleep(0.1)
+    assert await storage.get_state(key) is None
+    assert await storage.get_data(key) == {}
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_shared_fsm_sees_other_process_updates(temp_db):
+    first = SQLiteStorage(temp_db, flush_interval=60, shared=True)
+    second = SQLiteStorage(temp_db, flush_interval=60, shared=True)
+    key = make_key(30)
+
+    await first.set_state(key, ProfileStates.NAME)
+    await first.flush()
+    assert await second.get_state(key) == ProfileStates.NAME.state
+
+    # Второй процесс продолжил анкету — первый не откатывает её к своему кэшу
+    await second.set_state(key, ProfileStates.AGE)
+    await second.update_data(key, {"name": "Боб"})
+    await second.flush()
+    assert await first.get_state(key) == ProfileStates.AGE.state
+    assert await first.get_data(key) == {"name": "Боб"}
+
+    # Несохранённые локальные изменения не перетираются строкой из БД
+    await first.set_state(key, ProfileStates.GENDER)
+    assert await first.get_state(key) == ProfileStates.GENDER.state
+    await first.flush()
+
+    await second.set_state(key, None)
+    await second.set_data(key, {})
+    await second.flush()
+    assert await first.get_state(key) is None
+    assert await first.get_data(key) == {}
+
+    await first.close()
+    await second.close()
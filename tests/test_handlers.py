@@ -3,6 +3,7 @@ import sqlite3
 
 import pytest
 
+from src.events import bus
 from src.handlers import browse, profile
 from src.states import ProfileStates
 
@@ -129,7 +130,7 @@ async def test_profile_photo_moderation_flow(handlers_storage):
     await state.update_data(user_id=user.id, editing=False, name="User", age=25, gender="Мужской")
 
     photo_msg = FakeMessage(user_id=user.tg_id)
-    photo_msg.photo = [SimpleNamespace(file_id="photo1")]
+    photo_msg.photo = [SimpleNamespace(file_id="photo1", file_unique_id="unique1")]
     await profile.photo_step(photo_msg, state)
 
     goal_msg = FakeMessage(text="💼 Деловое")
@@ -140,6 +141,31 @@ async def test_profile_photo_moderation_flow(handlers_storage):
     assert saved.is_active is False
     pending = await handlers_storage.get_pending_moderation()
     assert pending is not None
+    assert pending.photo_unique_id == "unique1"
+
+
+@pytest.mark.asyncio
+async def test_profile_resubmitted_photo_skips_moderation(handlers_storage):
+    user = await handlers_storage.create_or_get_user(710)
+    await handlers_storage.add_moderation(user.id, "photo1", "unique1")
+    item = await handlers_storage.get_pending_moderation_by_user(user.id)
+    await handlers_storage.decide_moderation(item.id, "approve", 9)
+
+    # Повторная отправка того же файла (file_id другой, file_unique_id тот же)
+    state = FakeState()
+    await state.update_data(user_id=user.id, editing=True, name="User", age=25, gender="Мужской")
+    photo_msg = FakeMessage(user_id=user.tg_id)
+    photo_msg.photo = [SimpleNamespace(file_id="photo1-again", file_unique_id="unique1")]
+    await profile.photo_step(photo_msg, state)
+    await profile.goal_step(FakeMessage(text="💼 Деловое"), state)
+    await profile.description_step(FakeMessage(text="Описание"), state)
+
+    saved = await handlers_storage.get_user_by_id(user.id)
+    assert saved.is_active is True and saved.photo_file_id == "photo1-again"
+    assert await handlers_storage.get_pending_moderation() is None
+
+    stats = await handlers_storage.get_stats()
+    assert (stats["photo_verdict_hits"], stats["photo_verdict_misses"]) == (1, 1)
 
 
 @pytest.mark.asyncio
@@ -277,3 +303,122 @@ async def test_browse_process_like_edges(handlers_storage):
     except (sqlite3.OperationalError, ValueError):
         assert True
 
+
+@pytest.mark.asyncio
+async def test_browse_buttons_of_deleted_profile(handlers_storage):
+    user = await handlers_storage.create_or_get_user(310)
+    user.name, user.is_active = "U", True
+    await handlers_storage.save_user(user)
+    target = await handlers_storage.create_or_get_user(311)
+    await handlers_storage.delete_user(target.id)
+
+    for handler, data in ((browse.process_like, "like"), (browse.process_skip, "skip"),
+                          (browse.like_back, "like_back")):
+        callback = FakeCallback(f"{data}:{target.id}", user_id=user.tg_id)
+        callback.message.bot = DummyBot()
+        await handler(callback)
+        assert callback.answers[0] == "Анкета удалена", data
+
+    assert not await handlers_storage.has_liked(user.id, target.id)
+
+
+@pytest.mark.asyncio
+async def test_browse_likes_inbox_is_paginated(handlers_storage):
+    user = await handlers_storage.create_or_get_user(20)
+    likers = [await handlers_storage.create_or_get_user(tg_id) for tg_id in range(21, 28)]
+    for liker in likers:
+        await handlers_storage.add_like(liker.id, user.id)
+
+    # На один лайк уже ответили — его в списке быть не должно
+    await handlers_storage.add_like(user.id, likers[0].id)
+
+    message = FakeMessage(user_id=20)
+    await browse.show_my_likes(message)
+
+    assert len(message.answers) == browse.LIKES_PAGE_SIZE + 1
+    assert message.answers[-1] == "Есть ещё лайки ❤️"
+
+    _, next_cursor = await handlers_storage.get_likes_inbox(user.id, browse.LIKES_PAGE_SIZE)
+    created_at, like_id = next_cursor
+    callback = FakeCallback(f"likes_more:{like_id}:{created_at}", user_id=20)
+    await browse.show_more_likes(callback)
+
+    # 6 лайков без ответа: 5 на первой странице и 1 на второй
+    assert len(callback.message.answers) == 1
+
+
+@pytest.mark.asyncio
+async def test_browse_mutual_like_notifies_through_outbox(handlers_storage):
+    user = await handlers_storage.create_or_get_user(40)
+    user.name = "A"
+    user.is_active = True
+    await handlers_storage.save_user(user)
+
+    other = await handlers_storage.create_or_get_user(41)
+    other.name = "B"
+    other.is_active = True
+    await handlers_storage.save_user(other)
+
+    await handlers_storage.add_like(other.id, user.id)
+
+    callback = FakeCallback(f"like:{other.id}", user_id=40)
+    sent_before_answer = []
+    answer = callback.answer
+
+    async def recording_answer(text=None):
+        sent_before_answer.extend(callback.message.bot.sent_messages)
+        await answer(text)
+
+    callback.answer = recording_answer
+    await browse.process_like(callback)
+
+    # На колбэк ответили до того, как ушли уведомления
+    assert callback.answers == ["❤️ Лайк"]
+    assert sent_before_answer == []
+
+    await bus.drain()
+    await browse.outbox.drain()
+
+    sent = callback.message.bot.sent_messages
+    assert (40, "🎉 Взаимный лайк с B!") in sent
+    assert (41, "🎉 Взаимный лайк с A!") in sent
+    assert browse.outbox.stats.sent == len(sent)
+
+
+@pytest.mark.asyncio
+async def test_profile_edit_reads_user_once(handlers_storage, monkeypatch):
+    user = await handlers_storage.create_or_get_user(900)
+    user.name = "Иван"
+    user.age = 30
+    user.gender = "Мужской"
+    user.goal = "💼 Деловое"
+    user.description = "Старое"
+    user.photo_file_id = "photo"
+    user.is_active = True
+    await handlers_storage.save_user(user)
+
+    reads = []
+    get_user_by_id = handlers_storage.get_user_by_id
+
+    async def counting_get(user_id):
+        reads.append(user_id)
+        return await get_user_by_id(user_id)
+
+    monkeypatch.setattr(handlers_storage, "get_user_by_id", counting_get)
+
+    state = FakeState()
+    await profile.edit_profile(FakeMessage(user_id=900), state, user=user)
+    await profile.name_step(FakeMessage(text="Иван"), state)
+    age_msg = FakeMessage(text="31")
+    await profile.age_step(age_msg, state)
+    assert "текущий: Мужской" in age_msg.answers[-1]
+    await profile.gender_step(FakeMessage(text="👨 Мужской"), state)
+    await profile.skip_photo_button(FakeMessage(text="⏭️ Пропустить фото"), state)
+    await profile.goal_step(FakeMessage(text="💼 Деловое"), state)
+    await profile.description_skip(FakeMessage(text="⏭️ Пропустить описание"), state)
+
+    assert reads == []
+    saved = await get_user_by_id(user.id)
+    assert saved.age == 31
+    assert saved.description == "Старое"
+    assert saved.is_active is True
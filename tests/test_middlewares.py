@@ -0,0 +1,52 @@
+from aiogram import types
+import pytest
+
+from src.middlewares import UserMiddleware, get_counterpart_id
+
+
+def make_callback_update(data, user_id):
+    return types.Update(
+        update_id=1,
+        callback_query=types.CallbackQuery(
+            id="1",
+            from_user=types.User(id=user_id, is_bot=False, first_name="Test"),
+            chat_instance="chat",
+            data=data,
+        ),
+    )
+
+
+def test_get_counterpart_id():
+    assert get_counterpart_id(make_callback_update("like:42", 1)) == 42
+    assert get_counterpart_id(make_callback_update("like_back:7", 1)) == 7
+    assert get_counterpart_id(make_callback_update("skip:42", 1)) is None
+    assert get_counterpart_id(make_callback_update("like:bad", 1)) is None
+
+
+@pytest.mark.asyncio
+async def test_user_middleware_injects_user_and_counterpart(storage_with_db, monkeypatch):
+    user = await storage_with_db.create_or_get_user(100)
+    other = await storage_with_db.create_or_get_user(101)
+    storage_with_db.user_cache.clear()
+
+    calls = []
+    from src import storage as storage_module
+    original = storage_module.db.get_user_pair
+
+    async def counting_pair(*args):
+        calls.append(args)
+        return await original(*args)
+
+    monkeypatch.setattr(storage_module.db, "get_user_pair", counting_pair)
+
+    update = make_callback_update(f"like:{other.id}", user.tg_id)
+    data = {"event_from_user": update.callback_query.from_user}
+
+    async def handler(event, handler_data):
+        return handler_data
+
+    result = await UserMiddleware(storage_with_db)(handler, update, data)
+
+    assert result["user"].id == user.id
+    assert result["counterpart"].id == other.id
+    assert len(calls) == 1
@@ -0,0 +1,57 @@
+import dataclasses
+import sqlite3
+
+import pytest
+
+from src.models import Like, ModerationItem, RowMapper, User
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY, tg_id INTEGER, name TEXT, age INTEGER, gender TEXT,
+            photo_file_id TEXT, goal TEXT, description TEXT, is_active BOOLEAN,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, version INTEGER DEFAULT 0
+        )
+    ''')
+    conn.execute("INSERT INTO users VALUES (1, 10, 'Ann', 20, 'Женский', NULL, 'g', 'd', 1, '2024-01-01 10:00:00', 3)")
+    conn.execute("INSERT INTO users VALUES (2, 11, 'Bob', 21, 'Мужской', 'p', 'g', 'd', 0, '2024-01-01 10:00:00', 0)")
+    yield conn
+    conn.close()
+
+
+def test_row_mapper_builds_models_by_column_name(conn):
+    conn.row_factory = RowMapper(User)
+    users = conn.execute('SELECT * FROM users ORDER BY id').fetchall()
+
+    assert users[0] == User(1, 10, 'Ann', 20, 'Женский', None, 'g', 'd', True, 3)
+    assert users[0].is_active is True and users[1].is_active is False
+    assert users[0].changes() == {}
+
+
+def test_row_mapper_returns_extras_and_skips_missing_columns(conn):
+    conn.row_factory = RowMapper(User, extras=('created_at',))
+    user, created_at = conn.execute('SELECT tg_id, id, goal, created_at FROM users WHERE id = 1').fetchone()
+
+    assert (user.id, user.tg_id, user.goal, user.name) == (1, 10, 'g', '')
+    assert created_at == '2024-01-01 10:00:00'
+
+
+def test_models_are_slotted_and_records_are_immutable():
+    user = User(1, 10)
+    assert not hasattr(user, '__dict__')
+
+    user.name = 'Ann'
+    assert user.changes() == {'name': 'Ann'}
+    assert dataclasses.replace(user).changes() == {}
+
+    like = Like(1, 2, 1)
+    assert like.is_mutual is True
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        like.is_mutual = False
+
+    item = ModerationItem(1, 1, 'photo', 'pending', '2024')
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        item.status = 'approved'
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from src.outbox import Outbox, Priority, TokenBucket
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return text
+
+
+def test_token_bucket_delay():
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated
+    assert bucket.delay(now) == 0
+    bucket.consume(now)
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+
+    bucket.block(now + 10)
+    assert bucket.delay(now + 1) == pytest.approx(9)
+
+
+@pytest.mark.asyncio
+async def test_outbox_sends_matches_before_like_pings():
+    outbox = Outbox(max_in_flight=1)
+    bot = RecordingBot()
+
+    outbox.send_message(bot, 1, "like", priority=Priority.LIKE)
+    outbox.send_message(bot, 2, "reply")
+    outbox.send_message(bot, 3, "match", priority=Priority.MATCH)
+    await outbox.drain()
+
+    assert [text for _, text in bot.sent] == ["match", "reply", "like"]
+    assert outbox.stats.sent == 3
+    assert outbox.stats.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_outbox_paces_one_chat_without_blocking_others():
+    outbox = Outbox(chat_rate=20, chat_burst=1)
+    bot = RecordingBot()
+
+    for i in range(3):
+        outbox.send_message(bot, 1, f"a{i}")
+    outbox.send_message(bot, 2, "b")
+
+    started = time.monotonic()
+    await outbox.drain()
+
+    # Два лишних сообщения в чат 1 ждут по 1/20 секунды, чат 2 — не ждёт
+    assert time.monotonic() - started >= 0.09
+    assert bot.sent.index((2, "b")) < bot.sent.index((1, "a1"))
+    assert [text for chat, text in bot.sent if chat == 1] == ["a0", "a1", "a2"]
+
+
+@pytest.mark.asyncio
+async def test_outbox_retries_after_flood_limit():
+    outbox = Outbox()
+    calls = []
+
+    async def send():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "Flood", retry_after=0)
+        return "ok"
+
+    result = outbox.enqueue(1, send, Priority.MATCH)
+    assert await result == "ok"
+    assert len(calls) == 2
+    assert outbox.stats.retry_after == 1
+    assert outbox.stats.retried == 1
+    assert outbox.stats.sent == 1
+
+
+@pytest.mark.asyncio
+async def test_outbox_failure_does_not_stop_queue():
+    outbox = Outbox(max_retries=0)
+    bot = RecordingBot()
+
+    async def broken():
+        raise RuntimeError("chat not found")
+
+    failed = outbox.enqueue(1, broken)
+    outbox.send_message(bot, 2, "still sent")
+    await outbox.drain()
+
+    with pytest.raises(RuntimeError):
+        await failed
+    assert bot.sent == [(2, "still sent")]
+    assert outbox.stats.failed == 1
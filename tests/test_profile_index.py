@@ -0,0 +1,102 @@
+import pytest
+
+from src.models import User
+from src.profile_index import ProfileIndex, same_goal
+from src.seen import SeenSet
+
+DAY = 86400
+
+
+class FakeSource:
+    def __init__(self, rows):
+        self.rows = {row[0]: row for row in rows}
+        self.seen = {}
+        self.loads = []
+
+    async def load_rows(self, user_ids):
+        self.loads.append(user_ids)
+        if user_ids is None:
+            return list(self.rows.values())
+        return [self.rows[user_id] for user_id in user_ids if user_id in self.rows]
+
+    async def load_seen(self, user_id):
+        return self.seen.setdefault(user_id, SeenSet())
+
+
+def make_index(rows, **kwargs):
+    source = FakeSource(rows)
+    return ProfileIndex(source.load_rows, source.load_seen, **kwargs), source
+
+
+ROWS = [
+    (1, 'Мужской', '💼 Деловое', 30, 100 * DAY),
+    (2, 'Женский', '👥 Дружеское', 30, 300 * DAY),
+    (3, 'Женский', '💼 Деловое', 45, 100 * DAY),
+    (4, 'Женский', '💼 Деловое', 31, 90 * DAY),
+    (5, 'Мужской', '💼 Деловое', 30, 200 * DAY),
+]
+
+
+@pytest.mark.asyncio
+async def test_rank_scores_gender_goal_age_and_recency():
+    index, source = make_index(ROWS)
+
+    # Противоположный пол, затем та же цель, затем близкий возраст
+    assert await index.rank(1, 10) == [4, 3, 2, 5]
+    assert await index.rank(1, 2) == [4, 3]
+    assert await index.rank(1, 10, exclude_ids=[4]) == [3, 2, 5]
+    # Неактивная (неизвестная индексу) анкета кандидатов не получает
+    assert await index.rank(99, 10) == []
+    assert source.loads == [None]
+
+
+@pytest.mark.asyncio
+async def test_rank_skips_seen_and_follows_updates():
+    index, source = make_index(ROWS)
+    source.seen[1] = SeenSet([4])
+
+    assert await index.rank(1, 10) == [3, 2, 5]
+    source.seen[1].add(3)
+    assert await index.rank(1, 10) == [2, 5]
+
+    # Сохранённая анкета сменила цель, удалённая пропала
+    index.upsert(User(2, 20, gender='Женский', goal='💼 Деловое', age=29, is_active=True))
+    index.remove(5)
+    assert await index.rank(1, 10) == [2]
+
+    # Активация после модерации: строка перечитывается из источника
+    source.rows[6] = (6, 'Женский', '💼 Деловое', 30, 400 * DAY)
+    index.mark_dirty(6)
+    assert await index.rank(1, 10) == [6, 2]
+    assert source.loads == [None, [6]]
+
+    index.upsert(User(6, 60, gender='Женский', is_active=False))
+    assert await index.rank(1, 10) == [2]
+    assert len(index) == 4
+
+
+@pytest.mark.asyncio
+async def test_score_terms_are_pluggable():
+    index, _ = make_index(ROWS, terms=[(1.0, same_goal)])
+    # Только цель; при равенстве — новые первыми
+    assert await index.rank(1, 10) == [5, 3, 4, 2]
+
+
+@pytest.mark.asyncio
+async def test_storage_feed_uses_profile_index(storage_with_db):
+    assert storage_with_db.profile_index is not None
+
+    users = []
+    for tg_id, gender in ((1001, 'Мужской'), (1002, 'Женский'), (1003, 'Женский')):
+        user = await storage_with_db.create_or_get_user(tg_id)
+        user.name, user.gender, user.goal, user.is_active = f'U{tg_id}', gender, 'g', True
+        await storage_with_db.save_user(user)
+        users.append(user)
+
+    viewer, first, second = users
+    await storage_with_db.add_skip(viewer.id, first.id)
+    candidates = await storage_with_db.get_candidates(viewer.id, 10)
+    assert [c.id for c in candidates] == [second.id]
+
+    await storage_with_db.delete_user(second.id)
+    assert await storage_with_db.get_candidates(viewer.id, 10) == []
@@ -0,0 +1,80 @@
+import sqlite3
+import time
+
+import pytest
+
+from src.retention import Retention
+
+
+async def make_active(storage, tg_id, gender):
+    user = await storage.create_or_get_user(tg_id)
+    user.name, user.gender, user.goal, user.is_active = f'U{tg_id}', gender, 'g', True
+    await storage.save_user(user)
+    return user
+
+
+@pytest.mark.asyncio
+async def test_expired_skips_return_to_feed(storage_with_db, temp_db):
+    viewer = await make_active(storage_with_db, 2001, 'Мужской')
+    old = await make_active(storage_with_db, 2002, 'Женский')
+    fresh = await make_active(storage_with_db, 2003, 'Женский')
+
+    await storage_with_db.add_skip(viewer.id, old.id)
+    await storage_with_db.add_skip(viewer.id, fresh.id)
+    seen = await storage_with_db.seen.get(viewer.id)
+    await temp_db.store_seen_set(viewer.id, seen.to_blob(), 0, 10**9)
+    assert await storage_with_db.get_candidates(viewer.id, 10) == []
+
+    with sqlite3.connect(temp_db.db_path) as conn:
+        conn.execute("UPDATE skips SET created_at = datetime('now', '-100 days') WHERE to_user_id = ?",
+                     (old.id,))
+
+    retention = Retention(storage_with_db, skip_ttl=90 * 86400, batch=1, pause=0)
+    assert await retention.run_once() == (1, 0)
+    assert await retention.run_once() == (0, 0)
+
+    # Сжатое множество со старым пропуском удалено, в памяти — забыто
+    with sqlite3.connect(temp_db.db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM seen_sets').fetchone()[0] == 0
+        assert conn.execute('SELECT to_user_id FROM skips').fetchall() == [(fresh.id,)]
+    candidates = await storage_with_db.get_candidates(viewer.id, 10)
+    assert [c.id for c in candidates] == [old.id]
+
+
+@pytest.mark.asyncio
+async def test_incremental_vacuum_returns_free_pages(temp_db):
+    with sqlite3.connect(temp_db.db_path) as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        conn.executemany('INSERT INTO skips (from_user_id, to_user_id, created_at) VALUES (?, ?, ?)',
+                         [(i, i + 1, '2000-01-01 00:00:00') for i in range(20000)])
+
+    count, _ = await temp_db.expire_skips(time.time(), 100000)
+    assert count == 20000
+
+    with sqlite3.connect(temp_db.db_path) as conn:
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    assert free > 10
+    assert await temp_db.incremental_vacuum(10) == 10
+    assert await temp_db.incremental_vacuum(10**6) == free - 10
+    with sqlite3.connect(temp_db.db_path) as conn:
+        assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
+
+
+@pytest.mark.asyncio
+async def test_purge_abandoned_users_in_batches(storage_with_db, temp_db):
+    active = await make_active(storage_with_db, 2101, 'Мужской')
+    abandoned = [await storage_with_db.create_or_get_user(tg_id) for tg_id in range(2102, 2107)]
+    recent = await storage_with_db.create_or_get_user(2107)
+    await storage_with_db.add_skip(active.id, abandoned[0].id)
+
+    with sqlite3.connect(temp_db.db_path) as conn:
+        conn.execute("UPDATE users SET created_at = datetime('now', '-40 days') WHERE id != ?", (recent.id,))
+
+    retention = Retention(storage_with_db, skip_ttl=0, purge_after=30 * 86400, purge_batch=2, pause=0)
+    assert await retention.run_once() == (0, 5)
+
+    assert await storage_with_db.get_user_by_tg(2102) is None
+    assert await storage_with_db.get_user_by_id(active.id) is not None
+    assert await storage_with_db.get_user_by_id(recent.id) is not None
+    with sqlite3.connect(temp_db.db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM skips').fetchone()[0] == 0
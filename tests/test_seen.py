@@ -0,0 +1,118 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from src.seen import SeenSet, SeenStore
+
+
+def test_seen_set_membership_and_blob_roundtrip():
+    seen = SeenSet([5, 3, 9, 3])
+    seen.add(7)
+    seen.add(3)
+
+    assert len(seen) == 4
+    assert 7 in seen and 9 in seen and 4 not in seen
+    assert seen.contains(np.array([1, 3, 7, 10])).tolist() == [False, True, True, False]
+
+    restored = SeenSet.from_blob(seen.to_blob(), extra=[11])
+    assert restored.contains(np.array([3, 5, 7, 9, 11, 12])).tolist() == [True] * 5 + [False]
+    assert SeenSet().contains(np.array([1])).tolist() == [False]
+
+
+@pytest.mark.asyncio
+async def test_seen_store_loads_lazily_and_compacts(temp_db):
+    users = [await temp_db.create_or_get_user(tg_id) for tg_id in range(1200, 1206)]
+    viewer = users[0]
+    await temp_db.add_like(viewer.id, users[1].id)
+    await temp_db.add_skip(viewer.id, users[2].id)
+    await temp_db.add_skip(viewer.id, users[3].id)
+
+    store = SeenStore(temp_db.load_seen_set, temp_db.store_seen_set, compact_after=3)
+    seen = await store.get(viewer.id)
+    assert [u.id in seen for u in users] == [False, True, True, True, False, False]
+
+    # Три свайпа после BLOB — он перезаписан, метки сдвинуты
+    blob, delta, like_mark, skip_mark = await temp_db.load_seen_set(viewer.id)
+    assert SeenSet.from_blob(blob).contains(np.array([users[1].id, users[3].id])).all()
+    assert delta == [] and like_mark > 0 and skip_mark > 0
+
+    # Новый свайп попадает в память сразу, в БД — как хвост после меток
+    await temp_db.add_skip(viewer.id, users[4].id)
+    store.add(viewer.id, users[4].id)
+    assert users[4].id in await store.get(viewer.id)
+    assert (await temp_db.load_seen_set(viewer.id))[1] == [users[4].id]
+
+
+@pytest.mark.asyncio
+async def test_candidate_search_with_seen_set_matches_anti_join(temp_db):
+    viewer = await temp_db.create_or_get_user(1300)
+    await temp_db.update_user(viewer.id, gender='Мужской', goal='g', is_active=True)
+    others = []
+    for tg_id, goal in ((1301, 'g'), (1302, 'g'), (1303, 'x')):
+        user = await temp_db.create_or_get_user(tg_id)
+        await temp_db.update_user(user.id, gender='Женский', goal=goal, is_active=True)
+        others.append(user)
+
+    store = SeenStore(temp_db.load_seen_set, temp_db.store_seen_set)
+    for _ in others:
+        expected = await temp_db.get_next_candidate(viewer.id)
+        seen = await store.get(viewer.id)
+        assert (await temp_db.get_next_candidate(viewer.id, seen)).id == expected.id
+        assert (await temp_db.get_any_candidate(viewer.id, seen)).id == \
+            (await temp_db.get_any_candidate(viewer.id)).id
+
+        await temp_db.add_skip(viewer.id, expected.id)
+        store.add(viewer.id, expected.id)
+
+    assert await temp_db.get_next_candidate(viewer.id, await store.get(viewer.id)) is None
+
+
+@pytest.mark.asyncio
+async def test_get_candidates_with_seen_set_matches_anti_join(temp_db):
+    viewer = await temp_db.create_or_get_user(1400)
+    await temp_db.update_user(viewer.id, gender='Мужской', goal='g', is_active=True)
+    for tg_id in range(1401, 1413):
+        user = await temp_db.create_or_get_user(tg_id)
+        await temp_db.update_user(user.id, gender=('Женский', 'Мужской')[tg_id % 3 == 0],
+                                  goal=('g', 'x')[tg_id % 2], is_active=True)
+    # Разные created_at — порядок показа однозначен
+    with sqlite3.connect(temp_db.db_path) as conn:
+        conn.execute("UPDATE users SET created_at = datetime(1700000000 + id, 'unixepoch')")
+
+    store = SeenStore(temp_db.load_seen_set, temp_db.store_seen_set)
+    expected = await temp_db.get_candidates(viewer.id, 20)
+    await temp_db.add_like(viewer.id, expected[0].id)
+    await temp_db.add_skip(viewer.id, expected[3].id)
+    exclude = [expected[1].id, expected[7].id]
+
+    for limit in (1, 4, 20):
+        anti_join = await temp_db.get_candidates(viewer.id, limit, exclude)
+        with_seen = await temp_db.get_candidates(viewer.id, limit, exclude, await store.get(viewer.id))
+        assert [u.id for u in with_seen] == [u.id for u in anti_join]
+    assert len(with_seen) == 8
+
+
+@pytest.mark.asyncio
+async def test_feed_without_profile_index_uses_seen_set(storage_with_db, temp_db, monkeypatch):
+    storage_with_db.profile_index = None
+    viewer = await temp_db.create_or_get_user(1500)
+    await temp_db.update_user(viewer.id, gender='Мужской', goal='g', is_active=True)
+    others = []
+    for tg_id in (1501, 1502):
+        user = await temp_db.create_or_get_user(tg_id)
+        await temp_db.update_user(user.id, gender='Женский', goal='g', is_active=True)
+        others.append(user)
+    await storage_with_db.add_skip(viewer.id, others[1].id)
+
+    calls = []
+    get_candidates = temp_db.get_candidates
+
+    async def spy(*args, **kwargs):
+        calls.append(args)
+        return await get_candidates(*args, **kwargs)
+
+    monkeypatch.setattr(temp_db, 'get_candidates', spy)
+    candidates = await storage_with_db.get_candidates(viewer.id, 10)
+    assert [c.id for c in candidates] == [others[0].id]
+    assert isinstance(calls[0][3], SeenSet)
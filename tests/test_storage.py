@@ -22,13 +22,14 @@ async def test_storage_likes(storage_with_db):
     u1 = await storage_with_db.create_or_get_user(200)
     u2 = await storage_with_db.create_or_get_user(201)
 
-    like = await storage_with_db.add_like(u1.id, u2.id)
-    assert bool(like.is_mutual) is False
+    created, is_mutual = await storage_with_db.add_like(u1.id, u2.id)
+    assert created is True
+    assert is_mutual is False
 
     await storage_with_db.add_like(u2.id, u1.id)
     likes = await storage_with_db.get_likes_to_user(u1.id)
     assert len(likes) == 1
-    assert bool(likes[0]["is_mutual"]) is True
+    assert likes[0].is_mutual is True
 
 
 @pytest.mark.asyncio
@@ -86,3 +87,91 @@ async def test_storage_moderation_helpers(storage_with_db):
 
     item = await storage_with_db.get_moderation_by_id(pending.id)
     assert item is not None
+
+
+@pytest.mark.asyncio
+async def test_storage_user_cache_hits_and_invalidation(storage_with_db):
+    user = await storage_with_db.create_or_get_user(600)
+    cache = storage_with_db.user_cache
+
+    by_tg = await storage_with_db.get_user_by_tg(600)
+    by_id = await storage_with_db.get_user_by_id(user.id)
+    assert by_tg.id == by_id.id == user.id
+    assert cache.stats().hits == 2
+
+    # Изменения объекта до save_user не должны попадать в кэш
+    by_id.name = "Changed"
+    assert (await storage_with_db.get_user_by_id(user.id)).name == ""
+
+    await storage_with_db.save_user(by_id)
+    assert (await storage_with_db.get_user_by_tg(600)).name == "Changed"
+
+    await storage_with_db.update_user_photo(user.id, "photo")
+    assert (await storage_with_db.get_user_by_id(user.id)).photo_file_id == "photo"
+
+    await storage_with_db.delete_user_by_tg(600)
+    assert await storage_with_db.get_user_by_id(user.id) is None
+    assert await storage_with_db.get_user_by_tg(600) is None
+
+
+def test_user_cache_lru_and_ttl(monkeypatch):
+    from src import cache as cache_module
+    from src.storage import User
+
+    now = [0.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+
+    cache = cache_module.UserCache(maxsize=2, ttl=10)
+    for i in (1, 2, 3):
+        cache.put(User(id=i, tg_id=100 + i))
+
+    assert cache.get_by_id(1) is None
+    assert cache.get_by_tg(103).id == 3
+
+    now[0] = 11
+    assert cache.get_by_id(3) is None
+    assert cache.stats().misses == 2
+
+
+@pytest.mark.asyncio
+async def test_save_user_writes_only_changed_fields(storage_with_db, monkeypatch):
+    user = await storage_with_db.create_or_get_user(700)
+    assert user.changes() == {}
+
+    user.name = "Вера"
+    user.age = user.age  # то же значение — не изменение
+    assert user.changes() == {"name": "Вера"}
+
+    from src import storage as storage_module
+
+    written = {}
+    update_user = storage_module.db.update_user
+
+    async def recording_update(user_id, expected_version=None, tx=None, **kwargs):
+        written.update(kwargs)
+        return await update_user(user_id, expected_version=expected_version, tx=tx, **kwargs)
+
+    monkeypatch.setattr(storage_module.db, "update_user", recording_update)
+
+    assert await storage_with_db.save_user(user) is True
+    assert written == {"name": "Вера"}
+    assert user.changes() == {}
+    assert user.version == 1
+
+    # Без изменений save_user в БД не ходит
+    written.clear()
+    assert await storage_with_db.save_user(user) is True
+    assert written == {}
+
+
+@pytest.mark.asyncio
+async def test_save_user_detects_concurrent_update(storage_with_db):
+    user = await storage_with_db.create_or_get_user(701)
+    stale = await storage_with_db.get_user_by_id(user.id)
+
+    user.goal = "👥 Дружеское"
+    assert await storage_with_db.save_user(user) is True
+
+    stale.goal = "💼 Деловое"
+    assert await storage_with_db.save_user(stale) is False
+    assert (await storage_with_db.get_user_by_id(user.id)).goal == "👥 Дружеское"
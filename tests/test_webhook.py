@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from aiogram import Bot, Dispatcher, F, Router, types
+from aiohttp.test_utils import TestClient, TestServer
+
+from src.config import cfg
+from src.webhook import UpdateScheduler, create_app, get_chat_key
+
+
+def callback_update(update_id, user_id, data):
+    # Как в записанных апдейтах Telegram
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "chat_instance": "1",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+            },
+        },
+    }
+
+
+def test_get_chat_key():
+    assert get_chat_key(callback_update(1, 42, "like:5")) == 42
+    assert get_chat_key({"update_id": 2, "message": {"chat": {"id": 7}}}) == 7
+    assert get_chat_key({"update_id": 3}) is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_keeps_chat_order_and_bounds_workers():
+    running = 0
+    peak = 0
+    seen = []
+
+    async def process(update):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        # Первый апдейт каждого чата обрабатывается дольше второго
+        await asyncio.sleep(0.02 if update["n"] == 0 else 0)
+        seen.append((update["chat"], update["n"]))
+        running -= 1
+
+    scheduler = UpdateScheduler(process, max_workers=2)
+    for chat in range(4):
+        for n in range(2):
+            scheduler.submit({"update_id": chat * 2 + n, "message": {"chat": {"id": chat}},
+                              "chat": chat, "n": n})
+    await scheduler.close()
+
+    assert peak == 2
+    for chat in range(4):
+        assert seen.index((chat, 0)) < seen.index((chat, 1))
+
+
+@pytest.mark.asyncio
+async def test_webhook_endpoint_processes_posted_updates(monkeypatch):
+    monkeypatch.setattr(cfg, "webhook_secret", "s3cret")
+    router = Router()
+    handled = []
+
+    @router.callback_query(F.data.startswith("like:"))
+    async def on_like(callback: types.CallbackQuery):
+        # Первый тап «тяжелее» второго — порядок всё равно должен сохраниться
+        await asyncio.sleep(0.02 if callback.id == "1" else 0)
+        handled.append((callback.from_user.id, callback.data))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot("42:TEST")
+
+    client = TestClient(TestServer(create_app(dp, bot)))
+    await client.start_server()
+    try:
+        unauthorized = await client.post(cfg.webhook_path, json=callback_update(1, 10, "like:5"))
+        assert unauthorized.status == 401
+
+        headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+        for update in (callback_update(1, 10, "like:5"), callback_update(2, 10, "like:6"),
+                       callback_update(3, 11, "like:7")):
+            response = await client.post(cfg.webhook_path, json=update, headers=headers)
+            assert response.status == 200
+    finally:
+        await client.close()
+
+    # close() дожидается всего, что уже принято
+    assert sorted(handled) == [(10, "like:5"), (10, "like:6"), (11, "like:7")]
+    assert handled.index((10, "like:5")) < handled.index((10, "like:6"))
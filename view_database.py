@@ -125,23 +125,14 @@ def view_database():
     # 5. Статистика
     print("\n📈 СТАТИСТИКА:")
 
-    # Количество пользователей
-    cursor.execute("SELECT COUNT(*) as total_users FROM users")
-    total_users = cursor.fetchone()['total_users']
-
-    cursor.execute("SELECT COUNT(*) as active_users FROM users WHERE is_active = TRUE")
-    active_users = cursor.fetchone()['active_users']
-
-    cursor.execute("SELECT COUNT(*) as total_likes FROM likes")
-    total_likes = cursor.fetchone()['total_likes']
-
-    cursor.execute("SELECT COUNT(*) as mutual_likes FROM likes WHERE is_mutual = TRUE")
-    mutual_likes = cursor.fetchone()['mutual_likes']
-
-    print(f"Всего пользователей: {total_users}")
-    print(f"Активных анкет: {active_users}")
-    print(f"Всего лайков: {total_likes}")
-    print(f"Взаимных лайков: {mutual_likes}")
+    # Счётчики ведёт сам бот (таблица stats_counters), пересчитывать не нужно
+    cursor.execute("SELECT name, value FROM stats_counters")
+    counters = {row['name']: row['value'] for row in cursor.fetchall()}
+
+    print(f"Всего пользователей: {counters.get('total_users', 0)}")
+    print(f"Активных анкет: {counters.get('active_users', 0)}")
+    print(f"Всего лайков: {counters.get('total_likes', 0)}")
+    print(f"Взаимных лайков: {counters.get('mutual_likes', 0)}")
 
     # Кто кого лайкнул (топ)
     cursor.execute('''